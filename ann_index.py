@@ -0,0 +1,233 @@
+"""
+Pure-NumPy inverted-file (IVF) index for approximate nearest-neighbour search.
+
+Chunk vectors are clustered with spherical k-means at build time; each chunk
+is stored in the inverted list of its nearest centroid. A query only scores
+the chunks in its `nprobe` closest lists, so cost grows with
+nprobe * n_chunks / n_lists instead of n_chunks. Exact scoring stays available
+through SearchEngine and is what `report` compares against.
+
+Usage:
+    python ann_index.py build  [--lists N]           (add an index to the current embeddings/)
+    python ann_index.py report [--synthetic N] [--k 10] [--queries 200]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+from search_engine import normalize_rows
+from vector_store import artifact_name, load_npz, write_meta
+
+INDEX_FILE = 'ivf'
+DEFAULT_NPROBE = 8
+
+# Rows scored per matmul while assigning vectors to centroids
+_ASSIGN_BATCH = 16384
+
+
+def default_num_lists(num_vectors):
+    return max(1, int(round(np.sqrt(num_vectors))))
+
+
+def _assign(vectors, centroids):
+    """Index of the most similar centroid for every row, computed in batches."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _ASSIGN_BATCH):
+        block = np.asarray(vectors[start:start + _ASSIGN_BATCH], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(vectors, n_lists, iters=20, sample=256, seed=0):
+    """Cluster unit vectors by cosine similarity; trains on at most `sample` rows per list."""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    train_idx = np.sort(rng.choice(n, size=min(n, n_lists * sample), replace=False))
+    train = np.asarray(vectors[train_idx], dtype=np.float32)
+    centroids = train[rng.choice(len(train), size=n_lists, replace=False)].copy()
+    for _ in range(iters):
+        labels = _assign(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, train)
+        counts = np.bincount(labels, minlength=n_lists)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists from random training points
+            sums[empty] = train[rng.choice(len(train), size=int(empty.sum()))]
+        new_centroids = normalize_rows(sums)
+        if np.allclose(new_centroids, centroids, atol=1e-5):
+            break
+        centroids = new_centroids
+    return centroids
+
+
+class IVFIndex:
+    """Centroids plus inverted lists: rows of list `i` are `rows[offsets[i]:offsets[i + 1]]`."""
+
+    def __init__(self, centroids, offsets, rows, generation=0):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.generation = generation
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, iters=20, seed=0, generation=0):
+        n_lists = min(len(vectors), n_lists or default_num_lists(len(vectors)))
+        centroids = spherical_kmeans(vectors, n_lists, iters=iters, seed=seed)
+        labels = _assign(vectors, centroids)
+        # Stable sort keeps rows ascending inside each list
+        rows = np.argsort(labels, kind='stable').astype(np.int32)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+        return cls(centroids.astype(np.float32), offsets, rows, generation)
+
+    @property
+    def num_lists(self):
+        return len(self.centroids)
+
+    def save(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, centroids=self.centroids, offsets=self.offsets, rows=self.rows,
+                     generation=np.int64(self.generation))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        data = load_npz(path)
+        return cls(data['centroids'], data['offsets'], data['rows'], int(data['generation']))
+
+    def candidates(self, query, nprobe=DEFAULT_NPROBE):
+        """Sorted chunk rows stored in the `nprobe` lists closest to a unit query vector."""
+        nprobe = max(1, min(int(nprobe), self.num_lists))
+        sims = self.centroids @ query
+        if nprobe < self.num_lists:
+            probe = np.argpartition(-sims, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.num_lists)
+        rows = np.concatenate([self.rows[self.offsets[i]:self.offsets[i + 1]] for i in probe])
+        rows.sort()
+        return rows
+
+
+def write_index(store_dir, meta, chunk_vectors, n_lists=None):
+    """Build an IVF index for a store generation and register it in meta['files']."""
+    index = IVFIndex.build(chunk_vectors, n_lists=n_lists, generation=meta['generation'])
+    filename = artifact_name('ivf', meta['generation'], 'npz')
+    index.save(os.path.join(store_dir, filename))
+    meta.setdefault('files', {})[INDEX_FILE] = filename
+    return index
+
+
+def load_index(store):
+    """Load the IVF index registered with a store, or None if absent or stale."""
+    path = store.artifact_path(INDEX_FILE)
+    if path is None or not os.path.exists(path):
+        return None
+    index = IVFIndex.load(path)
+    if index.generation != store.generation:
+        logging.warning(f"Ignoring stale {path} (generation {index.generation} != {store.generation})")
+        return None
+    return index
+
+
+def _synthetic_corpus(n_chunks, dim, n_topics=64, chunks_per_doc=3, seed=0):
+    """Clustered unit vectors standing in for a real corpus; returns (vectors, doc_offsets)."""
+    rng = np.random.default_rng(seed)
+    topics = normalize_rows(rng.normal(size=(n_topics, dim)))
+    vectors = topics[rng.integers(n_topics, size=n_chunks)] + 0.9 * rng.normal(size=(n_chunks, dim)) / np.sqrt(dim)
+    offsets = np.arange(0, n_chunks + chunks_per_doc, chunks_per_doc).clip(max=n_chunks)
+    return normalize_rows(vectors), np.unique(offsets)
+
+
+def recall_report(engine, index, nprobes=(1, 2, 4, 8, 16, 32), k=10, n_queries=200, seed=0):
+    """Recall@k of IVF document rankings against exhaustive search, with per-query latency."""
+    from search_engine import SearchEngine
+
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(len(engine.vectors), size=n_queries)
+    noise = rng.normal(size=(n_queries, engine.dim)).astype(np.float32) * (0.5 / np.sqrt(engine.dim))
+    queries = normalize_rows(np.asarray(engine.vectors[rows]) + noise)
+
+    def top_docs(best):
+        k_eff = min(k, len(best))
+        return set(np.argpartition(-best, k_eff - 1)[:k_eff].tolist())
+
+    def timed(fn):
+        results, times = [], []
+        for q in queries:
+            t0 = time.perf_counter()
+            best, _ = fn(q)
+            times.append((time.perf_counter() - t0) * 1000)
+            results.append(top_docs(best))
+        return results, np.array(times)
+
+    exact = SearchEngine(engine.vectors, engine.doc_offsets)
+    truth, exact_ms = timed(exact.score)
+    report = [{'mode': 'exact', 'nprobe': None, 'recall': 1.0,
+               'p50_ms': float(np.percentile(exact_ms, 50)), 'p95_ms': float(np.percentile(exact_ms, 95))}]
+    approx = SearchEngine(engine.vectors, engine.doc_offsets, ann=index)
+    for nprobe in nprobes:
+        if nprobe > index.num_lists:
+            break
+        found, ms = timed(lambda q: approx.score(q, nprobe=nprobe))
+        recall = float(np.mean([len(f & t) / len(t) for f, t in zip(found, truth)]))
+        report.append({'mode': 'ivf', 'nprobe': nprobe, 'recall': recall,
+                       'p50_ms': float(np.percentile(ms, 50)), 'p95_ms': float(np.percentile(ms, 95))})
+    return report
+
+
+def main():
+    from search_engine import SearchEngine
+    from vector_store import STORE_DIR, load_store
+
+    parser = argparse.ArgumentParser(description="Build or evaluate the IVF index")
+    parser.add_argument('command', choices=['build', 'report'])
+    parser.add_argument('--store', default=STORE_DIR)
+    parser.add_argument('--lists', type=int, default=None, help="number of inverted lists (default sqrt(n))")
+    parser.add_argument('--synthetic', type=int, default=0, help="report on N synthetic chunks instead of the store")
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+    if args.synthetic:
+        vectors, offsets = _synthetic_corpus(args.synthetic, args.dim)
+        engine = SearchEngine(vectors, offsets)
+        generation = 0
+    else:
+        store = load_store(args.store, legacy_path=None)
+        if store is None:
+            logging.error(f"No store found in {args.store}/. Run build.py first.")
+            sys.exit(1)
+        engine = SearchEngine.from_store(store)
+        generation = store.generation
+
+    if args.command == 'build':
+        if args.synthetic:
+            logging.error("build needs a real store; use report with --synthetic")
+            sys.exit(1)
+        # The persisted index addresses store chunk rows; meta.json is rewritten to register it
+        t0 = time.perf_counter()
+        index = write_index(args.store, store.meta, store.chunk_vectors, n_lists=args.lists)
+        write_meta(args.store, store.meta)
+        logging.info(f"Wrote {store.artifact_path(INDEX_FILE)} ({index.num_lists} lists over "
+                     f"{len(store.chunk_vectors):,} chunks in {time.perf_counter() - t0:.2f}s)")
+        return
+
+    t0 = time.perf_counter()
+    index = IVFIndex.build(engine.vectors, n_lists=args.lists, generation=generation)
+    logging.info(f"Built IVF index: {index.num_lists} lists over {len(engine.vectors):,} chunks "
+                 f"in {time.perf_counter() - t0:.2f}s")
+
+    print(f"{'mode':<6} {'nprobe':>6} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in recall_report(engine, index, k=args.k, n_queries=args.queries):
+        print(f"{row['mode']:<6} {str(row['nprobe'] or '-'):>6} {row['recall']:>10.3f} "
+              f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,95 +1,246 @@
 import os
 import json
+import time
 import logging
-from flask import Flask, render_template, request, jsonify
-import math
-from openai import OpenAI
-import markdown
+import threading
+from contextlib import nullcontext
+from flask import Flask, render_template, request, jsonify, stream_with_context, g
 from dotenv import load_dotenv
 from cachetools import LRUCache
-import bleach
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import numpy as np
+from ann_index import DEFAULT_NPROBE, INDEX_FILE as ANN_FILE
+from quantize import DEFAULT_RERANK, FAST_KINDS as QUANT_FAST_KINDS, KINDS as QUANT_KINDS, built_kinds
+from search_engine import top_k
+from lexical_index import fuse_rrf
+from snapshot import SnapshotManager, load_snapshot
+from shards import ShardedSnapshot, merge_ranked, ranked
+from diversity import DEFAULT_LAMBDA as MMR_DEFAULT_LAMBDA, mmr
+from vector_store import embedding_model_id
+from rendering import content_etag, render_html
+from single_flight import SingleFlight
+from metrics import Registry, StageTimer
+from embedding_batcher import EmbeddingBatcher, DEFAULT_MAX_BATCH, DEFAULT_WINDOW_MS
+import query_cache
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (LOG_LEVEL=DEBUG for per-request detail; it is costly on the hot path)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-key-change-in-production")
 
-# Rate limiting
-limiter = Limiter(get_remote_address, app=app, default_limits=["200 per minute"])  # global cap
+# Rate limiting; counters are per process unless RATELIMIT_STORAGE_URI points at a
+# shared store (e.g. redis://), so with N gunicorn workers limits are N times looser
+limiter = Limiter(get_remote_address, app=app, default_limits=["200 per minute"],  # global cap
+                  storage_uri=os.environ.get("RATELIMIT_STORAGE_URI", "memory://"))
 
-# Initialize OpenAI client
+# OpenAI client, created on first use (see embedding_client); query embeddings are
+# bounded by EMBEDDING_TIMEOUT seconds (point OPENAI_BASE_URL at a local stub
+# server to run without the real API)
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "your-openai-api-key")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
-# Load embeddings
-try:
-    with open('embeddings.json', 'r', encoding='utf-8') as f:
-        knowledge_base = json.load(f)
-    logging.info(f"Loaded {len(knowledge_base)} knowledge entries")
-except FileNotFoundError:
-    knowledge_base = []
-    logging.warning("No embeddings.json found. Run build.py to generate embeddings.")
-
-def cosine_similarity(a, b):
-    """Calculate cosine similarity between two vectors using pure Python"""
-    # Guard against empty vectors
-    if not a or not b:
-        return 0.0
-    # Compute dot product and norms
-    dot = 0.0
-    norm_a = 0.0
-    norm_b = 0.0
-    # Assume equal length embeddings
-    for x, y in zip(a, b):
-        dot += x * y
-        norm_a += x * x
-        norm_b += y * y
-    denom = math.sqrt(norm_a) * math.sqrt(norm_b)
-    if denom == 0:
-        return 0.0
-    return dot / denom
-
-def get_embedding(text):
+EMBEDDING_TIMEOUT = float(os.environ.get("EMBEDDING_TIMEOUT", 5))
+
+# Load the knowledge base (binary store from build.py, legacy embeddings.json as fallback).
+# Chunk vectors are scored in place (memory-mapped, pre-normalized float32); the
+# scoring engine and search indexes load on the first search (see snapshot.py).
+# An IVF index built with `build.py --ann` is used unless SEARCH_ANN=0; exact
+# search stays available per request with ?exact=1.
+SEARCH_ANN = os.environ.get("SEARCH_ANN", "1") == "1"
+SEARCH_NPROBE = int(os.environ.get("SEARCH_NPROBE", DEFAULT_NPROBE))
+# Quantized codes from `build.py --quantize` give a first pass over compressed
+# vectors and only SEARCH_RERANK chunks are rescored exactly (SEARCH_QUANT=0 disables).
+# int8 codes are slower to scan than float32 and only save memory, so they are
+# searched only with SEARCH_QUANT=int8. A build with several kinds is searched with
+# the first enabled one; a comma list (e.g. SEARCH_QUANT=prefix,binary) sets the order
+_search_quant = os.environ.get("SEARCH_QUANT", "1")
+SEARCH_QUANT = {"0": (), "1": QUANT_FAST_KINDS, "int8": QUANT_KINDS}.get(_search_quant) or tuple(
+    kind for kind in _search_quant.split(',') if kind in QUANT_KINDS)
+SEARCH_RERANK = int(os.environ.get("SEARCH_RERANK", DEFAULT_RERANK))
+# Default search mode: semantic (embeddings), lexical (BM25, no API call) or
+# hybrid (both, fused by reciprocal rank); overridable per request with ?mode=
+SEARCH_MODES = ('semantic', 'hybrid', 'lexical')
+SEARCH_MODE = os.environ.get("SEARCH_MODE", "semantic")
+# Matches ranked (and cached) per query up front; deeper pages extend the ranking
+SEARCH_RANK_DEPTH = int(os.environ.get("SEARCH_RANK_DEPTH", 200))
+# Sharded builds (`build.py --shards N`) are searched on every shard in parallel
+# on a pool of SEARCH_SHARD_WORKERS threads per worker (default: CPU count)
+SEARCH_SHARD_WORKERS = int(os.environ.get("SEARCH_SHARD_WORKERS", 0)) or None
+# Near-duplicates marked by build.py (later copies of an earlier note) are left
+# out of results with SEARCH_DEDUP=1 or ?dedup=1
+SEARCH_DEDUP = os.environ.get("SEARCH_DEDUP", "0") == "1"
+# Maximal marginal relevance re-rank of the top SEARCH_MMR_CANDIDATES results
+# (SEARCH_MMR=1 or ?mmr=1); lower SEARCH_MMR_LAMBDA favours diversity over relevance
+SEARCH_MMR = os.environ.get("SEARCH_MMR", "0") == "1"
+SEARCH_MMR_LAMBDA = float(os.environ.get("SEARCH_MMR_LAMBDA", MMR_DEFAULT_LAMBDA))
+SEARCH_MMR_CANDIDATES = int(os.environ.get("SEARCH_MMR_CANDIDATES", 50))
+# New builds are picked up without restarting workers; RELOAD_INTERVAL=0 disables the check
+RELOAD_INTERVAL = float(os.environ.get("RELOAD_INTERVAL", 5))
+# Load the search indexes and the embedding client in the background right after
+# startup, so a long-lived worker's first search does not pay for them. Off by
+# default on Vercel (which sets VERCEL=1): a serverless instance may be frozen
+# between requests, and its first response should not compete with the warm-up.
+WARM_START = os.environ.get("WARM_START", "0" if os.environ.get("VERCEL") else "1") == "1"
+
+def _load_snapshot():
+    snapshot = load_snapshot(use_ann=SEARCH_ANN, use_quant=SEARCH_QUANT, shard_workers=SEARCH_SHARD_WORKERS)
+    logging.info(f"Loaded {len(snapshot)} knowledge entries (generation {snapshot.generation})")
+    if isinstance(snapshot, ShardedSnapshot):
+        logging.info(f"Searching {len(snapshot.shards)} shards (by {snapshot.store.meta.get('shard_by')})")
+    # Read from meta.json, so logging does not load the indexes themselves
+    if SEARCH_ANN and snapshot.store.artifact_path(ANN_FILE):
+        logging.info(f"Using IVF index (nprobe={SEARCH_NPROBE})")
+    if snapshot.store.dimensions:
+        logging.info(f"Embedding queries at {snapshot.store.dimensions} dimensions (from the build)")
+    quant_kind = next((kind for kind in SEARCH_QUANT if kind in built_kinds(snapshot.store)), None)
+    if quant_kind:
+        logging.info(f"Using {quant_kind} codes (rerank={SEARCH_RERANK})")
+    return snapshot
+
+snapshots = SnapshotManager(_load_snapshot, interval=RELOAD_INTERVAL)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+_openai_client = None
+_client_lock = threading.Lock()
+
+def embedding_client():
+    """The OpenAI client, created on first use.
+
+    Importing openai is the largest part of a cold start, and the index page,
+    /tags without a query and /content never need it.
+    """
+    global _openai_client
+    with _client_lock:
+        if _openai_client is None:
+            from openai import OpenAI
+            _openai_client = OpenAI(api_key=OPENAI_API_KEY, timeout=EMBEDDING_TIMEOUT, max_retries=1)
+    return _openai_client
+
+def get_embedding(text, model=EMBEDDING_MODEL, dimensions=None):
     """Get embedding for text using OpenAI"""
-    response = openai_client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text
+    response = embedding_client().embeddings.create(
+        model=model,
+        input=text,
+        **({'dimensions': dimensions} if dimensions else {})
     )
     return response.data[0].embedding
 
-# Cache for query embeddings and search responses
-embedding_cache = LRUCache(maxsize=256)
-results_cache = LRUCache(maxsize=128)
+# Query embedding misses from concurrent requests are sent upstream together:
+# a batch closes EMBED_BATCH_WINDOW_MS after its first query or at EMBED_BATCH_MAX
+# queries (EMBED_BATCH_WINDOW_MS=0 sends each query on its own)
+EMBED_BATCH_WINDOW_MS = float(os.environ.get("EMBED_BATCH_WINDOW_MS", DEFAULT_WINDOW_MS))
+EMBED_BATCH_MAX = int(os.environ.get("EMBED_BATCH_MAX", DEFAULT_MAX_BATCH))
+# Created with the client on the first query embedding miss
+embedding_batcher = None
+
+def query_batcher():
+    global embedding_batcher
+    if embedding_batcher is None and EMBED_BATCH_WINDOW_MS > 0:
+        client = embedding_client()
+        with _client_lock:
+            if embedding_batcher is None:
+                embedding_batcher = EmbeddingBatcher(client, EMBEDDING_MODEL, window_ms=EMBED_BATCH_WINDOW_MS,
+                                                     max_batch=EMBED_BATCH_MAX, timeout=EMBEDDING_TIMEOUT)
+    return embedding_batcher
+
+# Cache for query embeddings and search responses, shared by all workers on the
+# host and kept across restarts (QUERY_CACHE=memory for a per-process cache)
+QUERY_CACHE = os.environ.get("QUERY_CACHE", "sqlite")
+QUERY_CACHE_PATH = os.environ.get("QUERY_CACHE_PATH", query_cache.DEFAULT_PATH)
+QUERY_CACHE_MAX_MB = int(os.environ.get("QUERY_CACHE_MAX_MB", query_cache.DEFAULT_MAX_MB))
+EMBEDDING_CACHE_TTL = int(os.environ.get("EMBEDDING_CACHE_TTL", 7 * 24 * 3600))
+RESULTS_CACHE_TTL = int(os.environ.get("RESULTS_CACHE_TTL", 3600))
+cache_backend = query_cache.open_backend(QUERY_CACHE, QUERY_CACHE_PATH, max_mb=QUERY_CACHE_MAX_MB)
+embedding_cache = query_cache.QueryCache(cache_backend, 'embedding', EMBEDDING_CACHE_TTL,
+                                         encode=query_cache.encode_vector, decode=query_cache.decode_vector)
+results_cache = query_cache.QueryCache(cache_backend, 'results', RESULTS_CACHE_TTL)
+
+# Concurrent requests for the same query share one embedding call and one
+# ranking per worker; waiters give up after SEARCH_TIMEOUT seconds
+SEARCH_TIMEOUT = float(os.environ.get("SEARCH_TIMEOUT", 15))
+embedding_flights = SingleFlight('embedding')
+ranking_flights = SingleFlight('ranking')
 
-def get_query_embedding_cached(query: str):
-    if query in embedding_cache:
-        return embedding_cache[query]
-    emb = get_embedding(query)
-    embedding_cache[query] = emb
+# Per-process metrics, scraped from /metrics; request stages also go out as Server-Timing
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram('mindsynth_stage_seconds', 'Time spent per request stage', ['stage'])
+REQUEST_SECONDS = metrics.histogram('mindsynth_request_seconds', 'Request handling time by endpoint', ['endpoint'])
+EMBED_UPSTREAM_SECONDS = metrics.histogram('mindsynth_embedding_upstream_seconds',
+                                           'Query embedding API latency (including batching delay)')
+EMBED_ERRORS = metrics.counter('mindsynth_embedding_errors_total', 'Failed query embedding API calls')
+
+def stage(name):
+    """Time a stage of the current request (no-op outside a request)."""
+    timer = g.get('timer') if g else None
+    return timer.stage(name) if timer is not None else nullcontext()
+
+# Sanitized HTML for /content, keyed by (generation, document); used when the
+# build did not pre-render it (legacy embeddings.json or older render rules)
+html_cache = LRUCache(maxsize=256)
+
+@snapshots.on_swap
+def _invalidate_results(snapshot):
+    # Search results are keyed by generation and simply stop being hit
+    html_cache.clear()
+    for cache in (embedding_cache, results_cache):
+        logging.info(f"Query cache {cache.stats()}")
+    for flights in (embedding_flights, ranking_flights):
+        logging.info(f"Coalesced {flights.stats()}")
+    if embedding_batcher:
+        logging.info(f"Embedding batches {embedding_batcher.stats()}")
+
+def rendered_html(snap, doc_id, content):
+    if snap.prerendered:
+        html_content = snap.store.html(doc_id)
+        if html_content is not None:
+            return html_content
+    key = (snap.generation, doc_id)
+    if key not in html_cache:
+        # For URL-based files, use the content directly without extra formatting
+        # The content already includes proper source information
+        with stage('render'):
+            html_content = render_html(content)
+        html_cache[key] = html_content
+    return html_cache[key]
+
+def normalize_query(text):
+    """Collapse runs of whitespace so trivially different spellings share caches and calls."""
+    return ' '.join(text.split())
+
+def get_query_embedding_cached(query: str, snap):
+    # Queries are embedded with the model and vector size the build recorded
+    model, dimensions = snap.store.model, snap.store.dimensions
+    key = embedding_cache.key(embedding_model_id(model, dimensions), query)
+    emb = embedding_cache.get(key)
+    if emb is None:
+        emb = embedding_flights.do(key, lambda: fetch_query_embedding(key, query, model, dimensions),
+                                   timeout=EMBEDDING_TIMEOUT)
     return emb
 
-def allowed_html():
-    tags = [
-        'p','ul','ol','li','strong','em','code','pre','a','blockquote','h1','h2','h3','h4','h5','h6','div','span','br'
-    ]
-    attrs = {
-        'a': ['href','title','target','rel'],
-        'blockquote': ['class','data-dnt','data-theme','align'],
-        'div': ['class'],
-        'span': ['class']
-    }
-    return tags, attrs
+def fetch_query_embedding(key, query, model, dimensions):
+    t0 = time.perf_counter()
+    try:
+        batcher = query_batcher()
+        if batcher:
+            emb = batcher.embed(query, model=model, dimensions=dimensions)
+        else:
+            emb = get_embedding(query, model=model, dimensions=dimensions)
+    except Exception:
+        EMBED_ERRORS.inc()
+        raise
+    finally:
+        EMBED_UPSTREAM_SECONDS.observe(time.perf_counter() - t0)
+    embedding_cache.set(key, emb)
+    return emb
 
 @app.route('/')
 def index():
     """Main page"""
     feature_toolbar = os.environ.get("FEATURE_TOOLBAR", "0") == "1"
-    return render_template('index.html', total_docs=len(knowledge_base), feature_toolbar=feature_toolbar)
+    return render_template('index.html', total_docs=len(snapshots.current()), feature_toolbar=feature_toolbar)
 
 @app.route('/tags')
 def list_tags():
@@ -100,180 +251,450 @@ def list_tags():
         limit = max(1, min(20, int(request.args.get('limit', 5))))
     except ValueError:
         limit = 5
-    q = (request.args.get('q') or '').strip()
+    q = normalize_query(request.args.get('q') or '')
 
+    snap = snapshots.current()
     # If no knowledge
-    if not knowledge_base:
+    if not len(snap):
         return jsonify([])
 
     if not q:
-        # Overall top by count
-        counts = {}
-        for item in knowledge_base:
-            for t in item.get('tags', []) or []:
-                if isinstance(t, str):
-                    key = t.strip().lower()
-                    if not key:
-                        continue
-                    counts[key] = counts.get(key, 0) + 1
-        ranked = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
-        return jsonify([{"tag": k, "count": v} for k, v in ranked[:limit]])
+        # Overall top by count (precomputed at load)
+        return jsonify([{"tag": k, "count": v} for k, v in snap.index.top_tags(limit)])
 
     # Query present: compute best-chunk similarity per doc and weight tag scores
     try:
-        qe = get_query_embedding_cached(q)
+        with stage('embed'):
+            qe = get_query_embedding_cached(q, snap)
     except Exception:
         qe = None
 
-    scores = {}
+    # Fallback: if no scores (e.g., qe None), use counts
+    ranked = []
     if qe is not None:
-        for item in knowledge_base:
-            best_sim = 0.0
-            if 'chunks' in item and item['chunks']:
-                for ch in item['chunks']:
-                    emb = ch.get('embedding') or []
-                    s = cosine_similarity(qe, emb)
-                    if s > best_sim:
-                        best_sim = s
-            elif 'embedding' in item:
-                best_sim = cosine_similarity(qe, item.get('embedding') or [])
-            if best_sim > 0:
-                for t in item.get('tags', []) or []:
-                    if isinstance(t, str) and t.strip():
-                        key = t.strip().lower()
-                        scores[key] = scores.get(key, 0.0) + float(best_sim)
+        with stage('score'):
+            best_sims, _ = snap.engine.score(qe, nprobe=SEARCH_NPROBE, rerank=SEARCH_RERANK)
+        with stage('sort'):
+            ranked = snap.index.weighted_tags(best_sims)
+
+    if not ranked:
+        return jsonify([{"tag": k, "count": v} for k, v in snap.index.top_tags(limit)])
 
-    # Fallback: if no scores (e.g., qe None), use counts
-    if not scores:
-        counts = {}
-        for item in knowledge_base:
-            for t in item.get('tags', []) or []:
-                if isinstance(t, str):
-                    # Normalize case to avoid duplicate tags like 'AI' and 'ai'
-                    key = t.strip().lower()
-                    if not key:
-                        continue
-                    counts[key] = counts.get(key, 0) + 1
-        ranked = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
-        return jsonify([{"tag": k, "count": v} for k, v in ranked[:limit]])
-
-    ranked = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
     return jsonify([{"tag": k, "score": v} for k, v in ranked[:limit]])
 
-@app.route('/search')
-@limiter.limit("60/minute")
-def search():
-    """Search endpoint"""
-    query = request.args.get('q', '').strip()
+# Cosine similarity a document's best chunk needs to count as a semantic match
+SEMANTIC_CUTOFF = 0.1
+
+def score_documents(snap, query, mode, query_embedding, candidates, nprobe, rerank, exact, bm25_stats=None,
+                    dedup=False):
+    """Matching documents as parallel arrays (doc_ids, similarity, score, chunk_index) in document order.
+
+    `similarity` is the 0..1 relevance shown by the UI (cosine similarity, or
+    BM25 relative to the best hit when there is no semantic score; hybrid
+    keyword-only hits are scaled below SEMANTIC_CUTOFF) and `score`
+    orders results by relevance (the fused rank score in hybrid mode).
+    `bm25_stats` overrides the BM25 collection statistics (for shards, see
+    rank_sharded); `dedup` drops documents build.py marked as near-duplicates.
+    """
+    matches = _score_documents(snap, query, mode, query_embedding, candidates, nprobe, rerank, exact, bm25_stats)
+    return drop_duplicates(snap, matches) if dedup else matches
+
+def drop_duplicates(snap, matches):
+    keep = ~snap.index.duplicate[matches[0]]
+    return tuple(column[keep] for column in matches)
+
+def _score_documents(snap, query, mode, query_embedding, candidates, nprobe, rerank, exact, bm25_stats):
+    doc_ids = candidates if candidates is not None else np.arange(len(snap))
+    if not query:
+        # Tag-only search: every candidate, in document order
+        best_sims, best_chunks = snap.engine.score(None, docs=candidates)
+        return doc_ids, best_sims[doc_ids], best_sims[doc_ids], best_chunks[doc_ids]
+
+    semantic = lexical = None
+    if query_embedding is not None:
+        # Calculate one score per document (best matching chunk)
+        best_sims, best_chunks = snap.engine.score(query_embedding, nprobe=nprobe, rerank=rerank, exact=exact,
+                                                   docs=candidates)
+        semantic = doc_ids[best_sims[doc_ids] > SEMANTIC_CUTOFF]
+    if mode != 'semantic':
+        bm25, bm25_chunks = snap.lexical.score(query, docs=candidates, stats=bm25_stats)
+        lexical = doc_ids[bm25[doc_ids] > 0]
+        top = float(bm25.max()) if len(lexical) else 1.0
+
+    if lexical is None:
+        return semantic, best_sims[semantic], best_sims[semantic], best_chunks[semantic]
+    if semantic is None:
+        return lexical, bm25[lexical] / top, bm25[lexical], bm25_chunks[lexical]
+
+    fused = fuse_rrf([
+        semantic[np.argsort(-best_sims[semantic], kind='stable')],
+        lexical[np.argsort(-bm25[lexical], kind='stable')],
+    ], len(snap))
+    ids = np.union1d(semantic, lexical)
+    in_semantic = np.isin(ids, semantic)
+    # Keyword-only hits stay below every semantic match on the UI's relevance scale
+    similarity = np.where(in_semantic, best_sims[ids], SEMANTIC_CUTOFF * bm25[ids] / top)
+    chunks = np.where(in_semantic, best_chunks[ids], bm25_chunks[ids])
+    return ids, similarity, fused[ids], chunks
+
+def sort_keys(snap, ids, score, sort):
+    """Keys putting matches in result order when sorted descending."""
+    # Optional sorting using timestamps from build (fallback to fs mtime)
+    if sort == 'newest':
+        return snap.index.modified_ts[ids]
+    if sort == 'oldest':
+        # Prefer created_ts; fallback to modified_ts
+        created = snap.index.created_ts[ids]
+        return -np.where(created > 0, created, snap.index.modified_ts[ids])
+    # Default: relevance
+    return score
+
+def rank_documents(snap, ids, similarity, score, chunks, sort, depth):
+    """The first `depth` matches in result order, plus the total match count.
+
+    Only this prefix is sorted (top_k), and it is what gets cached: later pages
+    of the same query are sliced from it until they run past its end.
+    """
+    order = top_k(sort_keys(snap, ids, score, sort), depth)
+    return {
+        'total': len(ids),
+        'ids': ids[order].tolist(),
+        'similarity': np.asarray(similarity, dtype=np.float64)[order].tolist(),
+        'score': np.asarray(score, dtype=np.float64)[order].tolist(),
+        'chunks': chunks[order].tolist(),
+    }
+
+def rank_shard(shard, candidates, query, mode, query_embedding, sort, depth, nprobe, rerank, exact, bm25_stats,
+               dedup):
+    """One shard's part of rank_sharded: its total, best BM25 score and top `depth` (shard-local ids)."""
+    matches = _score_documents(shard, query, mode, query_embedding, candidates, nprobe, rerank, exact, bm25_stats)
+    # Like score_documents, BM25 is scaled to the best hit before near-duplicates are dropped
+    top = float(matches[2].max()) if mode == 'lexical' and len(matches[0]) else 0.0
+    ids, similarity, score, chunks = drop_duplicates(shard, matches) if dedup else matches
+    return {'total': len(ids), 'top': top,
+            'ranking': ranked(sort_keys(shard, ids, score, sort), depth,
+                              ids=ids, similarity=similarity, score=score, chunks=chunks)}
+
+def rank_sharded(snap, query, mode, query_embedding, candidates, sort, depth, nprobe, rerank, exact, dedup=False):
+    """score_documents + rank_documents over a ShardedSnapshot.
+
+    Every shard ranks its own matches (in parallel) and the per-shard top
+    `depth` lists are heap-merged. BM25 uses the statistics of all shards and
+    its similarities are rescaled to the best hit of all shards. Reciprocal
+    rank fusion needs ranks over all shards, so hybrid search fuses the
+    per-document scores every shard computes in parallel (the engine and
+    lexical fan-out of ShardedSnapshot) instead.
+    """
+    if mode == 'hybrid' and query and query_embedding is not None:
+        matches = score_documents(snap, query, mode, query_embedding, candidates, nprobe, rerank, exact,
+                                  dedup=dedup)
+        return rank_documents(snap, *matches, sort, depth)
+    bm25_stats = snap.lexical_stats(query) if query and mode != 'semantic' else None
+    parts = snap.map(lambda shard, local: rank_shard(shard, local, query, mode, query_embedding, sort, depth,
+                                                     nprobe, rerank, exact, bm25_stats, dedup), candidates)
+    merged = merge_ranked([(offset, part['ranking']) for offset, part in parts], depth)
+    similarity = merged['similarity']
+    if mode == 'lexical' and query:
+        top = max(part['top'] for _, part in parts) or 1.0
+        similarity = [score / top for score in merged['score']]
+    return {'total': sum(part['total'] for _, part in parts), 'ids': merged['ids'], 'similarity': similarity,
+            'score': merged['score'], 'chunks': merged['chunks']}
+
+def diversify(snap, ranking):
+    """Re-rank the first SEARCH_MMR_CANDIDATES results by maximal marginal relevance (see diversity.py)."""
+    n = min(SEARCH_MMR_CANDIDATES, len(ranking['ids']))
+    if n < 3 or not snap.store.dim:
+        return ranking
+    order = mmr(ranking['similarity'][:n], snap.store.doc_vectors_for(ranking['ids'][:n]), lambda_=SEARCH_MMR_LAMBDA)
+    for column in ('ids', 'similarity', 'score', 'chunks'):
+        ranking[column] = [ranking[column][i] for i in order] + ranking[column][n:]
+    return ranking
+
+def materialize_page(snap, ranking, query, offset, limit):
+    """Result dicts for one page of a ranking; nothing outside the page is touched."""
+    page = []
+    window = slice(offset, offset + limit)
+    for doc_id, similarity, score, best_chunk_index in zip(ranking['ids'][window], ranking['similarity'][window],
+                                                            ranking['score'][window], ranking['chunks'][window]):
+        item = snap.docs[doc_id]
+        best_snippet = ''
+        if item['chunk_count']:
+            text = snap.store.chunk_text(doc_id, best_chunk_index)
+            best_snippet = text[:240] + ('...' if len(text) > 240 else '')
+        elif item.get('has_embedding') or query:
+            text = snap.store.content(doc_id)
+            best_snippet = text[:240] + ('...' if len(text) > 240 else '')
+        page.append({
+            'title': item['title'],
+            'snippet': best_snippet,
+            'similarity': similarity,
+            'score': score,
+            'file': item['file'],
+            'chunk_index': best_chunk_index,
+            'tags': snap.index.doc_tags[doc_id],
+            'created_ts': float(snap.index.created_ts[doc_id]),
+            'modified_ts': float(snap.index.modified_ts[doc_id])
+        })
+    return page
+
+def search_params():
+    """Query string of /search and /search/stream, validated and clamped."""
+    query = normalize_query(request.args.get('q', ''))
     # Optional filters
     raw_tags = request.args.get('tags', '').strip()
     req_tags = [t.lower() for t in raw_tags.split(',') if t.strip()]
     sort = request.args.get('sort', 'relevance').lower()
+    mode = request.args.get('mode', SEARCH_MODE).lower()
+    if mode not in SEARCH_MODES:
+        mode = SEARCH_MODE
     try:
         limit = max(1, min(50, int(request.args.get('limit', 20))))
         offset = max(0, int(request.args.get('offset', 0)))
     except ValueError:
         limit, offset = 20, 0
+    # Recall knobs: exact=1 forces the exhaustive scan, nprobe widens the IVF probe,
+    # rerank rescores more quantized candidates exactly
+    exact = request.args.get('exact', '0') == '1'
+    try:
+        nprobe = max(1, min(1024, int(request.args.get('nprobe', SEARCH_NPROBE))))
+    except ValueError:
+        nprobe = SEARCH_NPROBE
+    try:
+        rerank = max(1, min(100_000, int(request.args.get('rerank', SEARCH_RERANK))))
+    except ValueError:
+        rerank = SEARCH_RERANK
+    # Result shaping: hide near-duplicates, diversify the top results
+    dedup = request.args.get('dedup', '1' if SEARCH_DEDUP else '0') == '1'
+    mmr_rerank = request.args.get('mmr', '1' if SEARCH_MMR else '0') == '1'
+    return {'query': query, 'req_tags': req_tags, 'sort': sort, 'mode': mode, 'limit': limit, 'offset': offset,
+            'exact': exact, 'nprobe': nprobe, 'rerank': rerank, 'dedup': dedup, 'mmr': mmr_rerank}
+
+def cached_ranking(snap, params, mode, compute=True):
+    """Ranking of a search in `mode` deep enough for the requested page.
+
+    One cached ranking per query is shared by every page (offset/limit are not
+    part of the key). With compute=False a missing or too shallow entry gives None.
+    """
+    query, req_tags, sort = params['query'], params['req_tags'], params['sort']
+    nprobe, rerank, exact = params['nprobe'], params['rerank'], params['exact']
+    dedup, mmr_rerank = params['dedup'], params['mmr']
+    cache_key = results_cache.key(EMBEDDING_MODEL, snap.generation, query, ','.join(req_tags),
+                                  sort, mode, 'exact' if exact else f"{nprobe}:{rerank}",
+                                  f"dedup={dedup:d}", f"mmr={SEARCH_MMR_LAMBDA}" if mmr_rerank else 'mmr=0')
+    ranking = results_cache.get(cache_key)
+    needed = params['offset'] + params['limit']
+    if ranking is None or len(ranking['ids']) < min(needed, ranking['total']):
+        if not compute:
+            return None
+        depth = max(SEARCH_RANK_DEPTH, needed, 2 * len(ranking['ids']) if ranking else 0)
+        ranking = ranking_flights.do(
+            f"{cache_key}:{depth}",
+            lambda: compute_and_cache_ranking(snap, cache_key, query, req_tags, sort, mode, nprobe, rerank, exact,
+                                              depth, dedup, mmr_rerank),
+            timeout=SEARCH_TIMEOUT)
+    return ranking
+
+def search_payload(snap, params, ranking):
+    page = materialize_page(snap, ranking, params['query'], params['offset'], params['limit'])
+    return {"total": ranking['total'], "results": page, "mode": ranking['mode']}
+
+@app.route('/search')
+@limiter.limit("60/minute")
+def search():
+    """Search endpoint"""
+    params = search_params()
+    # One snapshot for the whole request, even if a reload swaps in a new build meanwhile
+    snap = snapshots.current()
     # Allow tag-only searches: only return empty if neither query nor tags
-    if (not query and not req_tags) or not knowledge_base:
+    if (not params['query'] and not params['req_tags']) or not len(snap):
         return jsonify({"total": 0, "results": []})
     
     try:
-        cache_key = f"{query}|{limit}|{offset}|{','.join(req_tags)}|{sort}"
-        if cache_key in results_cache:
-            return jsonify(results_cache[cache_key])
+        ranking = cached_ranking(snap, params, params['mode'])
+        with stage('serialize'):
+            return jsonify(search_payload(snap, params, ranking))
 
-        query_embedding = get_query_embedding_cached(query) if query else None
-
-        # Calculate one score per document (best matching chunk)
-        scored = []
-        for item in knowledge_base:
-            best_sim = -1.0
-            best_snippet = ''
-            best_chunk_index = 0
-
-            if 'chunks' in item and item['chunks']:
-                for idx, ch in enumerate(item['chunks']):
-                    sim = cosine_similarity(query_embedding, ch.get('embedding') or []) if query_embedding is not None else 0.0
-                    if sim > best_sim:
-                        best_sim = sim
-                        text = ch.get('text', '')
-                        best_snippet = text[:240] + ('...' if len(text) > 240 else '')
-                        best_chunk_index = idx
-            elif 'embedding' in item:
-                best_sim = cosine_similarity(query_embedding, item.get('embedding') or []) if query_embedding is not None else 0.0
-                text = item.get('content', '')
-                best_snippet = text[:240] + ('...' if len(text) > 240 else '')
-
-            # If no query, include the document (tag filtering happens below)
-            if query_embedding is None or best_sim > 0.1:
-                # Timestamps from build (fallback to filesystem)
-                try:
-                    fs_mtime = os.path.getmtime(os.path.join('knowledge', item['file']))
-                    fs_ctime = os.path.getctime(os.path.join('knowledge', item['file']))
-                except Exception:
-                    fs_mtime = 0
-                    fs_ctime = 0
-                scored.append({
-                    'title': item['title'],
-                    'snippet': best_snippet,
-                    'similarity': float(best_sim),
-                    'file': item['file'],
-                    'chunk_index': best_chunk_index,
-                    'tags': [t.strip().lower() for t in (item.get('tags', []) or []) if isinstance(t, str) and t.strip()],
-                    'created_ts': float(item.get('created_ts') or fs_ctime or 0),
-                    'modified_ts': float(item.get('modified_ts') or fs_mtime or 0)
-                })
-
-        # Optional tag filtering (AND semantics)
-        if req_tags:
-            def has_all_tags(r):
-                item_tags = {t.lower() for t in (r.get('tags') or [])}
-                return all(t in item_tags for t in req_tags)
-            scored = [r for r in scored if has_all_tags(r)]
-
-        # Optional sorting using timestamps from build (fallback to fs mtime)
-        if sort in ('newest', 'oldest'):
-            if sort == 'newest':
-                scored.sort(key=lambda x: x.get('modified_ts', 0), reverse=True)
-            else:  # oldest
-                # Prefer created_ts; fallback to modified_ts
-                scored.sort(key=lambda x: (x.get('created_ts') or x.get('modified_ts') or 0))
-        else:
-            # Default: relevance
-            scored.sort(key=lambda x: x['similarity'], reverse=True)
-        total = len(scored)
-        page = scored[offset:offset+limit]
-        payload = {"total": total, "results": page}
-        results_cache[cache_key] = payload
-        return jsonify(payload)
-        
+    except TimeoutError:
+        logging.warning(f"Search timed out waiting for a shared ranking after {SEARCH_TIMEOUT}s")
+        return jsonify({"total": 0, "results": [], "error": "timeout"}), 504
     except Exception as e:
         logging.error(f"Search error: {e}")
         return jsonify({"total": 0, "results": []}), 500
 
+@app.route('/search/stream')
+@limiter.limit("60/minute")
+def search_stream():
+    """Progressive search: keyword results first, then the refined ranking.
+
+    Same parameters as /search, answered as newline-delimited JSON (or
+    server-sent events with format=sse). Each message is a /search payload
+    plus a "phase": "lexical" for the BM25 ranking, which needs no embedding
+    call, then "final" for the requested mode. A cached final ranking, a
+    lexical or tag-only search is answered with "final" alone. Failures end
+    the stream with an "error" message.
+    """
+    params = search_params()
+    sse = request.args.get('format') == 'sse'
+    snap = snapshots.current()
+
+    def encode(phase, payload):
+        body = json.dumps({"phase": phase, **payload}, separators=(',', ':'))
+        return f"event: {phase}\ndata: {body}\n\n" if sse else body + "\n"
+
+    def generate():
+        if (not params['query'] and not params['req_tags']) or not len(snap):
+            yield encode('final', {"total": 0, "results": []})
+            return
+        mode = params['mode']
+        try:
+            ranking = cached_ranking(snap, params, mode, compute=False)
+            if ranking is None and mode != 'lexical' and params['query']:
+                lexical = cached_ranking(snap, params, 'lexical')
+                with stage('serialize'):
+                    message = encode('lexical', search_payload(snap, params, lexical))
+                yield message
+            if ranking is None:
+                ranking = cached_ranking(snap, params, mode)
+            with stage('serialize'):
+                message = encode('final', search_payload(snap, params, ranking))
+            yield message
+        except TimeoutError:
+            logging.warning(f"Streaming search timed out waiting for a shared ranking after {SEARCH_TIMEOUT}s")
+            yield encode('error', {"error": "timeout"})
+        except Exception as e:
+            logging.error(f"Search error: {e}")
+            yield encode('error', {"error": "search failed"})
+
+    resp = app.response_class(stream_with_context(generate()),
+                              mimetype='text/event-stream' if sse else 'application/x-ndjson')
+    resp.cache_control.no_cache = True
+    # Ask proxies (nginx) not to buffer the stream
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+def compute_and_cache_ranking(snap, cache_key, query, req_tags, sort, mode, nprobe, rerank, exact, depth,
+                              dedup=False, mmr_rerank=False):
+    ranking, cacheable = compute_ranking(snap, query, req_tags, sort, mode, nprobe, rerank, exact, depth,
+                                         dedup, mmr_rerank)
+    if cacheable:
+        results_cache.set(cache_key, ranking)
+    return ranking
+
+def compute_ranking(snap, query, req_tags, sort, mode, nprobe, rerank, exact, depth, dedup=False, mmr_rerank=False):
+    """Score and rank a query; returns (ranking, cacheable)."""
+    # Optional tag filtering (AND semantics), resolved from the tag index before scoring
+    with stage('filter'):
+        candidates = snap.index.docs_with_tags(req_tags) if req_tags else None
+    if candidates is not None and not len(candidates):
+        return {'total': 0, 'ids': [], 'similarity': [], 'score': [], 'chunks': [], 'mode': mode}, True
+
+    query_embedding = None
+    degraded = False
+    if query and mode != 'lexical':
+        try:
+            with stage('embed'):
+                query_embedding = get_query_embedding_cached(query, snap)
+        except Exception as e:
+            # Keyword results beat an error page while the embedding API is unavailable
+            logging.warning(f"Query embedding failed, serving lexical results: {e}")
+            mode, degraded = 'lexical', True
+
+    if isinstance(snap, ShardedSnapshot):
+        # Each shard scores and sorts its own matches
+        with stage('score'):
+            ranking = rank_sharded(snap, query, mode, query_embedding, candidates, sort, depth, nprobe, rerank,
+                                   exact, dedup)
+    else:
+        with stage('score'):
+            matches = score_documents(snap, query, mode, query_embedding, candidates, nprobe, rerank, exact,
+                                      dedup=dedup)
+        with stage('sort'):
+            ranking = rank_documents(snap, *matches, sort, depth)
+    # Diversity only applies to relevance order
+    if mmr_rerank and query and sort not in ('newest', 'oldest'):
+        with stage('diversify'):
+            ranking = diversify(snap, ranking)
+    ranking['mode'] = mode
+    return ranking, not degraded
+
 @app.route('/content/<path:filename>')
 def get_content(filename):
     """Get full content of a knowledge file"""
-    for item in knowledge_base:
-        if item['file'] == filename:
-            content_to_display = item['content']
-            
-            # For URL-based files, use the content directly without extra formatting
-            # The content already includes proper source information
-            
-            html_content = markdown.markdown(content_to_display)
-            tags, attrs = allowed_html()
-            html_content = bleach.clean(html_content, tags=tags, attributes=attrs, strip=True)
-            return jsonify({
-                'title': item['title'],
-                'content': html_content,
-                'file': filename,
-                'is_url': item.get('is_url', False),
-                'source_url': item.get('source_url'),
-                'tags': item.get('tags', [])
-            })
-    return jsonify({'error': 'Content not found'}), 404
+    snap = snapshots.current()
+    doc_id = snap.index.doc_ids.get(filename)
+    if doc_id is None:
+        return jsonify({'error': 'Content not found'}), 404
+    item = snap.docs[doc_id]
+    content_to_display = snap.store.content(doc_id)
+
+    # Conditional requests: repeat fetches of unchanged documents become 304s
+    etag = content_etag(item, content_to_display)
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = jsonify({
+            'title': item['title'],
+            'content': rendered_html(snap, doc_id, content_to_display),
+            'file': filename,
+            'is_url': item.get('is_url', False),
+            'source_url': item.get('source_url'),
+            'tags': item.get('tags', [])
+        })
+    resp.set_etag(etag)
+    if item.get('modified_ts'):
+        resp.last_modified = float(item['modified_ts'])
+    resp.cache_control.no_cache = True
+    return resp
+
+@app.route('/healthz')
+@limiter.exempt
+def healthz():
+    """Liveness: answers without rendering templates or touching the knowledge base."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+@limiter.exempt
+def readyz():
+    """Readiness: a knowledge base is loaded, with its search indexes if a warm-up was asked for."""
+    snap = snapshots.current()
+    warm = snap.loaded('engine') and snap.loaded('lexical')
+    ready = warm or not WARM_START
+    return jsonify({'status': 'ready' if ready else 'warming', 'generation': snap.generation,
+                    'documents': len(snap), 'warm': warm}), 200 if ready else 503
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    """Prometheus text exposition of this worker's metrics."""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@metrics.collector
+def _collect_caches():
+    yield ('mindsynth_cache_requests_total', 'counter', 'Query cache lookups by result',
+           [({'cache': c.namespace, 'result': result}, getattr(c, attr))
+            for c in (embedding_cache, results_cache)
+            for result, attr in (('hit', 'hits'), ('miss', 'misses'), ('error', 'errors'))])
+    yield ('mindsynth_coalesced_calls_total', 'counter', 'Single-flight calls by role (leader ran, shared waited)',
+           [({'group': f.name, 'role': role}, f.stats()[role])
+            for f in (embedding_flights, ranking_flights) for role in ('leaders', 'shared', 'timeouts')])
+    if embedding_batcher:
+        stats = embedding_batcher.stats()
+        yield ('mindsynth_embedding_batches_total', 'counter', 'Batched query embedding API calls',
+               [({}, stats['batches'])])
+        yield ('mindsynth_embedding_batched_requests_total', 'counter', 'Query embeddings sent through the batcher',
+               [({}, stats['requests'])])
+
+@app.before_request
+def start_timer():
+    g.timer = StageTimer(STAGE_SECONDS)
+
+@app.after_request
+def record_timing(resp):
+    timer = g.get('timer')
+    if timer is not None and request.endpoint not in (None, 'static', 'metrics_endpoint', 'healthz', 'readyz'):
+        REQUEST_SECONDS.observe(time.perf_counter() - timer.started, endpoint=request.endpoint)
+        resp.headers['Server-Timing'] = timer.header()
+    return resp
 
 @app.after_request
 def set_security_headers(resp):
@@ -285,6 +706,15 @@ def set_security_headers(resp):
     resp.headers['Content-Security-Policy'] = csp
     return resp
 
+def warm_up():
+    t0 = time.perf_counter()
+    snapshots.current().warm()
+    query_batcher() or embedding_client()
+    logging.info(f"Warmed search indexes and embedding client in {time.perf_counter() - t0:.2f}s")
+
+if WARM_START:
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
 if __name__ == '__main__':
     # Use environment PORT for deployment platforms, fallback to 5000
     port = int(os.environ.get('PORT', 5000))
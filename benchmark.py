@@ -0,0 +1,499 @@
+"""
+Reproducible performance benchmarks for search, tags, content and build.
+
+For every requested size a synthetic knowledge base is generated (records in
+the embeddings.json schema: random unit chunk vectors, Zipf-distributed words
+and tags), written as a store in a temporary directory and served by app.py in
+a fresh subprocess. That process reports its startup time, then drives
+/search, /tags and /content through the Flask test client and reports latency
+percentiles and peak RSS. Query embeddings are stubbed with noisy copies of
+chunk vectors, so semantic search finds realistic matches without an API key.
+
+The build benchmark writes synthetic markdown notes and times build.py end to
+end (cold, then an unchanged incremental rebuild) against fake_openai.
+
+The startup benchmark measures a cold start as a serverless instance sees it:
+importing app, the first /, /tags and /content requests, and the first search
+(which loads the search indexes), in fresh processes. It reports the import
+time per top-level package from ``python -X importtime``. It also fails if
+openai, markdown or bleach got imported before the first search, or if the
+median import exceeds --max-import-ms.
+
+Results are one JSON document; `compare` prints the change between two runs.
+
+Usage:
+    python benchmark.py run [--sizes 1000 10000 100000] [--requests 200] [--out results.json]
+    python benchmark.py startup [--size 10000] [--repeat 5] [--max-import-ms 600]
+    python benchmark.py compare old.json new.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = (1000, 10000, 100000)
+PERCENTILES = (50, 95, 99)
+# Must not be imported by a cold start until a search needs them
+LAZY_MODULES = ('openai', 'markdown', 'bleach')
+
+
+def peak_rss_mb():
+    # Linux carries ru_maxrss over exec, so a child started by a large parent
+    # would report the parent's peak; VmHWM belongs to this process alone
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def latency_summary(seconds):
+    ms = np.asarray(seconds) * 1000
+    summary = {f'p{p}_ms': round(float(np.percentile(ms, p)), 3) for p in PERCENTILES}
+    summary['mean_ms'] = round(float(ms.mean()), 3)
+    summary['n'] = len(ms)
+    return summary
+
+
+class SyntheticCorpus:
+    """Words, tags and chunk-count distributions shared by every generator."""
+
+    def __init__(self, seed=0, vocab_size=5000, num_tags=200):
+        self.rng = np.random.default_rng(seed)
+        self.vocab = np.array([f"w{i}" for i in range(vocab_size)])
+        self.word_p = self._zipf(vocab_size, 1.1)
+        self.tags = np.array([f"tag{i}" for i in range(num_tags)])
+        self.tag_p = self._zipf(num_tags, 1.2)
+
+    @staticmethod
+    def _zipf(n, s):
+        weights = 1.0 / np.arange(1, n + 1) ** s
+        return weights / weights.sum()
+
+    def text(self, words):
+        return ' '.join(self.rng.choice(self.vocab, size=words, p=self.word_p))
+
+    def doc_tags(self):
+        count = int(self.rng.integers(0, 5))
+        return sorted(set(self.rng.choice(self.tags, size=count, p=self.tag_p).tolist()))
+
+    def chunk_counts(self, num_chunks):
+        """Chunks per document (geometric, mean ~4) summing to exactly `num_chunks`."""
+        counts = []
+        remaining = num_chunks
+        while remaining > 0:
+            c = min(remaining, int(self.rng.geometric(0.25)))
+            counts.append(c)
+            remaining -= c
+        return counts
+
+    def records(self, num_chunks, dim, words_per_chunk=60):
+        """Knowledge base records (embeddings.json schema) with `num_chunks` unit chunk vectors."""
+        from rendering import render_html
+        records = []
+        for d, count in enumerate(self.chunk_counts(num_chunks)):
+            vectors = self.rng.standard_normal((count, dim)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            chunks = [{'text': self.text(words_per_chunk), 'embedding': v} for v in vectors]
+            title = f"Note {d}: {self.text(3)}"
+            content = f"# {title}\n\n" + '\n\n'.join(ch['text'] for ch in chunks)
+            records.append({
+                'file': f"note-{d}.md", 'title': title, 'content': content, 'original_content': content,
+                'is_url': False, 'source_url': None, 'tags': self.doc_tags(), 'chunks': chunks,
+                'embedding': vectors.mean(axis=0), 'content_hash': str(d),
+                'created_ts': 1.7e9 + d, 'modified_ts': 1.7e9 + 2 * d, 'html': render_html(content),
+            })
+        return records
+
+    def markdown(self, words):
+        tags = self.doc_tags()
+        front = f"---\ntags: [{', '.join(tags)}]\n---\n" if tags else ''
+        return f"{front}# {self.text(3)}\n\n{self.text(words)}\n"
+
+
+def write_synthetic_store(path, num_chunks, dim, seed=0):
+    """Generate and write a store (with BM25 index, like build.py) under `path`."""
+    from lexical_index import write_index as write_lexical_index
+    from rendering import RENDER_VERSION
+    from vector_store import write_store
+
+    records = SyntheticCorpus(seed).records(num_chunks, dim)
+
+    def extras(meta, chunk_vectors, doc_vectors):
+        meta['render_version'] = RENDER_VERSION
+        write_lexical_index(path, meta, records)
+
+    return write_store(records, path, extras=extras, keep_previous=False)
+
+
+def _import_app(workdir):
+    """Import app.py in this (fresh) process, serving the store in `workdir`; returns (module, seconds)."""
+    os.environ.setdefault('QUERY_CACHE', 'memory')
+    os.environ.setdefault('RELOAD_INTERVAL', '0')
+    os.environ.setdefault('EMBED_BATCH_WINDOW_MS', '0')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Measure the indexes' loading explicitly instead of racing a warm-up thread
+    os.environ.setdefault('WARM_START', '0')
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+
+    t0 = time.perf_counter()
+    import app as app_module
+    seconds = time.perf_counter() - t0
+    app_module.limiter.enabled = False
+    return app_module, seconds
+
+
+def _stub_embeddings(app_module, seed=0):
+    vectors = app_module.snapshots.current().store.chunk_vectors
+    rng = np.random.default_rng(seed)
+
+    def stub_embedding(text, model=None, dimensions=None):
+        # A query "about" a stored chunk: its vector plus noise
+        row = int.from_bytes(text.encode('utf-8')[-4:].rjust(4, b'\0'), 'little') % len(vectors)
+        v = np.asarray(vectors[row], dtype=np.float32) + rng.normal(size=vectors.shape[1]).astype(np.float32) * 0.02
+        return (v / np.linalg.norm(v)).tolist()
+
+    app_module.get_embedding = stub_embedding
+
+
+def serve_benchmark(workdir, requests, seed=0):
+    """Run inside a fresh process whose cwd holds the store: startup, endpoint latencies, RSS."""
+    app_module, startup = _import_app(workdir)
+    rss_startup = peak_rss_mb()
+    snap = app_module.snapshots.current()
+    t0 = time.perf_counter()
+    snap.warm()
+    warm = time.perf_counter() - t0
+    _stub_embeddings(app_module, seed)
+    rng = np.random.default_rng(seed)
+    client = app_module.app.test_client()
+    words = SyntheticCorpus(seed).vocab[:200]
+    tags = [t for t, _ in snap.index.top_tags(20)]
+    files = snap.index.files
+
+    def timed(paths):
+        times = []
+        for path in paths:
+            t = time.perf_counter()
+            resp = client.get(path)
+            resp.get_data()
+            times.append(time.perf_counter() - t)
+            if resp.status_code >= 400:
+                raise RuntimeError(f"{path} -> {resp.status_code}")
+        return latency_summary(times)
+
+    def query(i):
+        return f"{words[i % len(words)]}%20{words[(7 * i) % len(words)]}%20q{i}"
+
+    endpoints = {
+        # Unique queries: embedding, scoring and ranking on every request
+        'search_cold': timed(f"/search?q={query(i)}" for i in range(requests)),
+        # Repeats of the same queries: served from the results cache
+        'search_warm': timed(f"/search?q={query(i % 20)}" for i in range(requests)),
+        'search_lexical': timed(f"/search?q={query(i)}x&mode=lexical" for i in range(requests)),
+        'search_exact': timed(f"/search?q={query(i)}y&mode=semantic&exact=1" for i in range(requests)),
+        'search_tags': timed(f"/search?q={query(i)}z&tags={tags[i % len(tags)]}" for i in range(requests)),
+        'tags_top': timed("/tags?limit=5" for _ in range(requests)),
+        'tags_query': timed(f"/tags?q={query(i)}t&limit=5" for i in range(requests)),
+        'content': timed(f"/content/{files[int(rng.integers(len(files)))]}" for _ in range(requests)),
+    }
+    return {
+        'chunks': int(snap.store.meta['num_chunks']),
+        'docs': len(snap),
+        'dim': int(snap.store.dim),
+        'startup_s': round(startup, 4),
+        'warm_s': round(warm, 4),
+        'rss_startup_mb': round(rss_startup, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'endpoints': endpoints,
+    }
+
+
+def build_benchmark(workdir, num_docs, words, seed=0):
+    """Time build.py end to end against fake_openai: a cold build, then an unchanged rebuild."""
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    corpus = SyntheticCorpus(seed)
+    os.makedirs('knowledge', exist_ok=True)
+    for d in range(num_docs):
+        with open(os.path.join('knowledge', f"note-{d}.md"), 'w', encoding='utf-8') as f:
+            f.write(corpus.markdown(words))
+
+    import build
+    from fake_openai import FakeOpenAI
+    client = FakeOpenAI()
+    build.openai_client = client
+    result = {'docs': num_docs, 'words_per_doc': words}
+    for run in ('cold', 'incremental'):
+        sys.argv = ['build.py', '--no-cache', '--prune']
+        t0 = time.perf_counter()
+        build.main()
+        result[f'{run}_s'] = round(time.perf_counter() - t0, 3)
+    with open(os.path.join('embeddings', 'meta.json'), encoding='utf-8') as f:
+        result['chunks'] = json.load(f)['num_chunks']
+    result['embedding_calls'] = client.calls
+    result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    return result
+
+
+def startup_benchmark(workdir, seed=0):
+    """Run inside a fresh process: import, first cheap requests, then the first search."""
+    app_module, import_s = _import_app(workdir)
+    client = app_module.app.test_client()
+    snap = app_module.snapshots.current()
+
+    def first(path):
+        t0 = time.perf_counter()
+        resp = client.get(path)
+        resp.get_data()
+        if resp.status_code >= 400:
+            raise RuntimeError(f"{path} -> {resp.status_code}")
+        return round((time.perf_counter() - t0) * 1000, 3)
+
+    first_ms = {
+        'index': first('/'),
+        'tags_top': first('/tags?limit=5'),
+        'content': first(f"/content/{snap.index.files[0]}") if len(snap) else None,
+    }
+    # What the cheap requests pulled in; a search may load the rest
+    lazy_loaded = [m for m in LAZY_MODULES if m in sys.modules]
+    search_loaded = [name for name in ('engine', 'lexical') if snap.loaded(name)]
+    _stub_embeddings(app_module, seed)
+    first_ms['search'] = first('/search?q=w1%20w2')
+    return {
+        'import_s': round(import_s, 4),
+        'first_ms': first_ms,
+        'lazy_modules_before_search': lazy_loaded,
+        'indexes_before_search': search_loaded,
+        'lazy_load_s': {k: round(v, 4) for k, v in snap.load_seconds.items()},
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def import_breakdown(workdir, top=15):
+    """Cumulative import time of app.py per top-level package, from python -X importtime."""
+    env = dict(os.environ, QUERY_CACHE='memory', RELOAD_INTERVAL='0', WARM_START='0', LOG_LEVEL='WARNING',
+               PYTHONPATH=ROOT)
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=workdir, env=env,
+                         capture_output=True, text=True, check=True)
+    totals = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        head, _, name = line.split('|')
+        package = name.strip().split('.')[0]
+        totals[package] = totals.get(package, 0) + int(head.split(':')[1])
+    ranked = sorted(totals.items(), key=lambda kv: -kv[1])[:top]
+    return [{'package': name, 'ms': round(us / 1000, 1)} for name, us in ranked]
+
+
+def _child(args):
+    """Entry point of the per-size subprocesses; prints one JSON object."""
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.child == 'serve':
+        result = serve_benchmark(args.workdir, args.requests, seed=args.seed)
+    elif args.child == 'startup':
+        result = startup_benchmark(args.workdir, seed=args.seed)
+    else:
+        result = build_benchmark(args.workdir, args.build_docs, args.build_words, seed=args.seed)
+    print(json.dumps(result))
+
+
+def _run_child(kind, workdir, args):
+    cmd = [sys.executable, os.path.abspath(__file__), 'run', '--child', kind, '--workdir', workdir,
+           '--requests', str(args.requests), '--seed', str(args.seed),
+           '--build-docs', str(args.build_docs), '--build-words', str(args.build_words)]
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('child', 'workdir', 'func')},
+        },
+        'serve': [],
+        'build': None,
+    }
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp(prefix=f'mindsynth-bench-{size}-')
+        try:
+            t0 = time.perf_counter()
+            write_synthetic_store(os.path.join(workdir, 'embeddings'), size, args.dim, seed=args.seed)
+            logging.info(f"Generated {size:,} chunks in {time.perf_counter() - t0:.1f}s; serving...")
+            result = _run_child('serve', workdir, args)
+            result['cold_start'] = _run_child('startup', workdir, args)
+            report['serve'].append(result)
+            logging.info(f"{size:,} chunks: startup {result['startup_s']:.2f}s, peak RSS {result['peak_rss_mb']} MB, "
+                         f"search_cold p50 {result['endpoints']['search_cold']['p50_ms']} ms")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.build_docs:
+        workdir = tempfile.mkdtemp(prefix='mindsynth-bench-build-')
+        try:
+            report['build'] = _run_child('build', workdir, args)
+            logging.info(f"Build of {args.build_docs} notes: cold {report['build']['cold_s']}s, "
+                         f"incremental {report['build']['incremental_s']}s")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        logging.info(f"Wrote {args.out}")
+    else:
+        print(text)
+
+
+def startup(args):
+    """Cold-start report over `repeat` fresh processes; exits non-zero when a budget is broken."""
+    workdir = tempfile.mkdtemp(prefix='mindsynth-bench-startup-')
+    try:
+        write_synthetic_store(os.path.join(workdir, 'embeddings'), args.size, args.dim, seed=args.seed)
+        runs = [_run_child('startup', workdir, args) for _ in range(args.repeat)]
+        breakdown = import_breakdown(workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    def median(values):
+        return round(float(np.median(values)), 3)
+
+    report = {
+        'chunks': args.size,
+        'runs': args.repeat,
+        'import_ms': median([r['import_s'] * 1000 for r in runs]),
+        'first_ms': {k: median([r['first_ms'][k] for r in runs]) for k in runs[0]['first_ms']
+                     if runs[0]['first_ms'][k] is not None},
+        'lazy_load_ms': {k: median([r['lazy_load_s'].get(k, 0) * 1000 for r in runs]) for k in runs[0]['lazy_load_s']},
+        'peak_rss_mb': median([r['peak_rss_mb'] for r in runs]),
+        'lazy_modules_before_search': sorted({m for r in runs for m in r['lazy_modules_before_search']}),
+        'indexes_before_search': sorted({m for r in runs for m in r['indexes_before_search']}),
+        'import_breakdown': breakdown,
+    }
+    print(f"import app: {report['import_ms']:.1f} ms (median of {args.repeat}), peak RSS {report['peak_rss_mb']} MB")
+    for name, ms in report['first_ms'].items():
+        print(f"  first {name:<10} {ms:>9.2f} ms")
+    for name, ms in report['lazy_load_ms'].items():
+        print(f"  load {name:<11} {ms:>9.2f} ms (on first search)")
+    print("import time by package:")
+    for row in breakdown:
+        print(f"  {row['package']:<24} {row['ms']:>8.1f} ms")
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(report, indent=2) + '\n')
+
+    failures = []
+    if report['lazy_modules_before_search']:
+        failures.append(f"imported before the first search: {', '.join(report['lazy_modules_before_search'])}")
+    if report['indexes_before_search']:
+        failures.append(f"loaded before the first search: {', '.join(report['indexes_before_search'])}")
+    if args.max_import_ms and report['import_ms'] > args.max_import_ms:
+        failures.append(f"import took {report['import_ms']:.0f} ms (budget {args.max_import_ms:.0f} ms)")
+    for failure in failures:
+        logging.error(f"Startup regression: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+def compare(args):
+    """Print p50/p95 changes per size and endpoint, plus startup, RSS and build time."""
+    with open(args.old, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+
+    def change(a, b):
+        return f"{a:>9.2f} -> {b:>9.2f} ({(b - a) / a * 100:+6.1f}%)" if a else f"{a:>9.2f} -> {b:>9.2f}"
+
+    old_runs = {r['chunks']: r for r in old.get('serve', [])}
+    for run_new in new.get('serve', []):
+        run_old = old_runs.get(run_new['chunks'])
+        if run_old is None:
+            continue
+        print(f"== {run_new['chunks']:,} chunks")
+        print(f"  {'startup_s':<20} {change(run_old['startup_s'], run_new['startup_s'])}")
+        print(f"  {'peak_rss_mb':<20} {change(run_old['peak_rss_mb'], run_new['peak_rss_mb'])}")
+        if run_old.get('cold_start') and run_new.get('cold_start'):
+            cold_old, cold_new = run_old['cold_start'], run_new['cold_start']
+            print(f"  {'cold import_s':<20} {change(cold_old['import_s'], cold_new['import_s'])}")
+            for name, ms in cold_new['first_ms'].items():
+                if cold_old['first_ms'].get(name) is not None and ms is not None:
+                    print(f"  {'cold first ' + name:<20} {change(cold_old['first_ms'][name], ms)}")
+        for name, stats in run_new['endpoints'].items():
+            before = run_old['endpoints'].get(name)
+            if before:
+                for key in ('p50_ms', 'p95_ms'):
+                    print(f"  {name + ' ' + key[:3]:<20} {change(before[key], stats[key])}")
+    if old.get('build') and new.get('build'):
+        print("== build")
+        for key in ('cold_s', 'incremental_s', 'peak_rss_mb'):
+            print(f"  {key:<20} {change(old['build'][key], new['build'][key])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark search, tags, content and build")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_run = sub.add_parser('run', help="generate knowledge bases and measure")
+    p_run.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="chunk counts")
+    p_run.add_argument('--dim', type=int, default=1536)
+    p_run.add_argument('--requests', type=int, default=200, help="requests per endpoint")
+    p_run.add_argument('--build-docs', type=int, default=200, help="notes for the build benchmark (0 skips it)")
+    p_run.add_argument('--build-words', type=int, default=400, help="words per generated note")
+    p_run.add_argument('--seed', type=int, default=0)
+    p_run.add_argument('--out', default=None, help="write JSON here instead of stdout")
+    p_run.add_argument('--child', choices=['serve', 'build', 'startup'], help=argparse.SUPPRESS)
+    p_run.add_argument('--workdir', help=argparse.SUPPRESS)
+    p_run.set_defaults(func=run)
+    p_start = sub.add_parser('startup', help="cold-start report and regression check")
+    p_start.add_argument('--size', type=int, default=10000, help="chunks in the synthetic store")
+    p_start.add_argument('--dim', type=int, default=1536)
+    p_start.add_argument('--repeat', type=int, default=5, help="fresh processes to take the median over")
+    p_start.add_argument('--max-import-ms', type=float, default=None, help="fail if the median import is slower")
+    p_start.add_argument('--seed', type=int, default=0)
+    p_start.add_argument('--out', default=None, help="also write the JSON report here")
+    p_start.set_defaults(func=startup, requests=0, build_docs=0, build_words=0)
+    p_cmp = sub.add_parser('compare', help="compare two result files")
+    p_cmp.add_argument('old')
+    p_cmp.add_argument('new')
+    p_cmp.set_defaults(func=compare)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', stream=sys.stderr)
+    if getattr(args, 'child', None):
+        _child(args)
+    else:
+        args.func(args)
+
+
+if __name__ == '__main__':
+    main()
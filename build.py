@@ -4,12 +4,20 @@ Build script to process .md files and generate embeddings
 Run this script to update the knowledge base when adding new .md files
 """
 import os
+import sys
 import json
+import argparse
 import logging
 import re
 import hashlib
+import random
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
-from openai import OpenAI
+from openai import OpenAI, AuthenticationError, BadRequestError, NotFoundError, PermissionDeniedError
 import trafilatura
 import yaml
 from urllib.parse import urlparse, quote
@@ -17,6 +25,15 @@ from urllib.request import urlopen, Request
 from urllib.error import URLError, HTTPError
 import html as html_lib
 from dotenv import load_dotenv
+from vector_store import STORE_DIR, LEGACY_PATH, embedding_model_id, remove_store, write_store
+from shards import STRATEGIES as SHARD_STRATEGIES, open_store, remove_shards, write_shards
+from ann_index import write_index
+from quantize import DEFAULT_PREFIX_DIM, KINDS as QUANT_KINDS, write_codes
+from lexical_index import write_index as write_lexical_index
+from rendering import RENDER_VERSION, render_html
+from chunker import CHUNKER_VERSION, chunk_markdown, default_counter as default_chunk_counter
+from chunk_cache import CACHE_PATH, DEFAULT_MAX_MB as CACHE_MAX_MB, ChunkCache
+from diversity import DEFAULT_THRESHOLD as DEDUP_DEFAULT, mark_duplicates
 
 # Load environment variables
 load_dotenv()
@@ -28,13 +45,131 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "your-openai-api-key")
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
-def get_embedding(text):
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Stored vector size; text-embedding-3 models return shortened (Matryoshka)
+# vectors on request. None keeps the model's native size. Recorded in meta.json,
+# which the app reads to embed queries the same way.
+EMBEDDING_DIMENSIONS = int(os.environ["EMBEDDING_DIMENSIONS"]) if os.environ.get("EMBEDDING_DIMENSIONS") else None
+# Request bounds: the endpoint accepts up to 2048 inputs and ~300k tokens per call
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 256))
+EMBED_BATCH_TOKENS = int(os.environ.get("EMBED_BATCH_TOKENS", 100_000))
+EMBED_MAX_RETRIES = int(os.environ.get("EMBED_MAX_RETRIES", 5))
+EMBED_BACKOFF_BASE = float(os.environ.get("EMBED_BACKOFF_BASE", 1.0))
+EMBED_BACKOFF_MAX = 30.0
+# Chunks buffered between the fetch/chunk stages and the embedding stage
+EMBED_QUEUE_SIZE = int(os.environ.get("EMBED_QUEUE_SIZE", 1024))
+
+# Chunk size and overlap in tokens (tiktoken if installed, else estimated)
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", 300))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", 32))
+
+# Split the knowledge base into this many shards (0: one store), by a hash of
+# the file name or of the first tag; see shards.py
+KB_SHARDS = int(os.environ.get("KB_SHARDS", 0))
+KB_SHARD_BY = os.environ.get("KB_SHARD_BY", "hash")
+
+# Documents whose vectors are at least this similar (cosine) and whose text
+# matches are near-duplicates of the earliest one; the app hides them with
+# SEARCH_DEDUP=1 (0 disables marking, see diversity.py)
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", DEDUP_DEFAULT))
+
+# URL preview fetching concurrency
+FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", 8))
+FETCH_PER_HOST = int(os.environ.get("FETCH_PER_HOST", 2))
+
+def estimate_tokens(text):
+    """Conservative token estimate (~3 characters per token) used for batch sizing."""
+    return len(text) // 3 + 1
+
+def iter_batches(texts, max_batch=None, max_tokens=None):
+    """Yield lists of input indices bounded by count and estimated tokens."""
+    max_batch = max_batch or EMBED_BATCH_SIZE
+    max_tokens = max_tokens or EMBED_BATCH_TOKENS
+    batch, batch_tokens = [], 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= max_batch or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def _backoff(attempt):
+    delay = min(EMBED_BACKOFF_MAX, EMBED_BACKOFF_BASE * 2 ** attempt)
+    return delay * (0.5 + random.random() / 2)
+
+class EmbeddingUnavailable(RuntimeError):
+    """The embedding API fails for reasons unrelated to the inputs (credentials, outage): the build stops."""
+
+
+def _embed_batch(client, model, texts, indices, results, dimensions=None):
+    """Embed texts[indices] into results, retrying failed or missing inputs with backoff.
+
+    Only failures tied to the inputs (a 400, or inputs missing from the
+    response) split the batch in half after the retries, so one bad input
+    cannot sink its neighbours; inputs that fail on their own stay None.
+    Credential and permission errors raise EmbeddingUnavailable at once, and
+    so do other errors (connection, 5xx) once the retries are used up.
+    """
+    pending = list(indices)
+    error = None
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        input_error = False
+        try:
+            kwargs = {'dimensions': dimensions} if dimensions else {}
+            response = client.embeddings.create(model=model, input=[texts[i] for i in pending], **kwargs)
+            for item in response.data:
+                results[pending[item.index]] = item.embedding
+            pending = [i for i in pending if results[i] is None]
+            if not pending:
+                return
+            error, input_error = f"{len(pending)} inputs missing from response", True
+        except (AuthenticationError, PermissionDeniedError, NotFoundError) as e:
+            # No retry or split can fix the key, its permissions or the model name
+            raise EmbeddingUnavailable(f"Embedding request rejected: {e}") from e
+        except BadRequestError as e:
+            # Retrying the same payload cannot succeed; isolate the offending input
+            error, input_error = e, True
+            break
+        except Exception as e:
+            error = e
+        if attempt < EMBED_MAX_RETRIES:
+            delay = _backoff(attempt)
+            logging.warning(f"Embedding batch of {len(pending)} failed ({error}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+    if not input_error:
+        raise EmbeddingUnavailable(f"Embedding API still failing after {EMBED_MAX_RETRIES} retries: {error}") \
+            from (error if isinstance(error, Exception) else None)
+    if len(pending) > 1:
+        mid = len(pending) // 2
+        _embed_batch(client, model, texts, pending[:mid], results, dimensions)
+        _embed_batch(client, model, texts, pending[mid:], results, dimensions)
+    else:
+        logging.error(f"Giving up on embedding input {pending[0]}: {error}")
+
+def embed_texts(texts, client=None, model=EMBEDDING_MODEL, max_batch=None, max_tokens=None, dimensions=None):
+    """Embed many texts in as few requests as possible.
+
+    Returns one vector per input, in input order; inputs that could not be
+    embedded are None. `client` defaults to the module's OpenAI client and can
+    be any object with a compatible `embeddings.create` (see fake_openai).
+    """
+    client = client or openai_client
+    results = [None] * len(texts)
+    batches = list(iter_batches(texts, max_batch, max_tokens))
+    for batch in batches:
+        _embed_batch(client, model, texts, batch, results, dimensions)
+    logging.info(f"Embedded {len(texts)} texts in {len(batches)} batches")
+    return results
+
+def get_embedding(text, client=None, dimensions=None):
     """Get embedding for text using OpenAI text-embedding-3-small model"""
-    response = openai_client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text
-    )
-    return response.data[0].embedding
+    embedding = embed_texts([text], client=client, dimensions=dimensions)[0]
+    if embedding is None:
+        raise RuntimeError("Embedding request failed")
+    return embedding
 
 def is_url_only(content):
     """Check if content is just a URL"""
@@ -173,25 +308,16 @@ def parse_frontmatter_and_body(raw_text: str):
     return {}, raw_text
 
 
-def chunk_text(text: str, max_chars: int = 1200, overlap: int = 150):
-    """Simple chunking by paragraphs, merging until ~max_chars with overlap."""
-    paragraphs = [p.strip() for p in re.split(r"\n{2,}", text) if p.strip()]
-    chunks = []
-    current = []
-    current_len = 0
-    for p in paragraphs:
-        if current_len + len(p) + 2 <= max_chars or not current:
-            current.append(p)
-            current_len += len(p) + 2
-        else:
-            chunks.append('\n\n'.join(current))
-            # start next with overlap
-            tail = ('\n\n'.join(current))[-overlap:]
-            current = [tail, p]
-            current_len = len(tail) + len(p) + 2
-    if current:
-        chunks.append('\n\n'.join(current))
-    return chunks
+def chunk_text(text: str, max_tokens: int = None, overlap: int = None):
+    """Split a document into token-bounded chunks along its blocks (see chunker.py)."""
+    return chunk_markdown(text, max_tokens=max_tokens or CHUNK_MAX_TOKENS,
+                          overlap=CHUNK_OVERLAP_TOKENS if overlap is None else overlap)
+
+
+def chunking_settings():
+    """Recorded in meta.json; documents are re-chunked when it changes."""
+    return {'version': CHUNKER_VERSION, 'max_tokens': CHUNK_MAX_TOKENS, 'overlap': CHUNK_OVERLAP_TOKENS,
+            'tokenizer': default_chunk_counter().name}
 
 
 def average_vectors(vectors):
@@ -207,8 +333,256 @@ def average_vectors(vectors):
     return [x/n for x in summed]
 
 
-def process_md_files():
-    """Process all .md files in knowledge directory"""
+def read_document(md_file):
+    """Read and parse one file. Returns None for empty files."""
+    logging.info(f"Processing {md_file.name}")
+    with open(md_file, 'r', encoding='utf-8') as f:
+        raw_text = f.read().strip()
+    meta, content = parse_frontmatter_and_body(raw_text)
+    
+    if not content:
+        logging.warning(f"Skipping empty file: {md_file.name}")
+        return None
+    
+    tags = meta.get('tags', []) if isinstance(meta, dict) else []
+    if isinstance(tags, str):
+        tags = [t.strip() for t in tags.split(',') if t.strip()]
+    return {
+        'path': md_file,
+        'meta': meta if isinstance(meta, dict) else {},
+        'content': content,
+        'tags': tags,
+        # Check if content is just a URL
+        'url': content.strip() if is_url_only(content) else None,
+        'preview': None,
+    }
+
+
+def fetch_preview(parsed, host_limiter=None):
+    """Fetch the preview of a URL-only note, holding a per-host slot while fetching."""
+    url = parsed['url']
+    if host_limiter is None:
+        parsed['preview'] = create_url_preview(url)
+    else:
+        with host_limiter.slot(url):
+            parsed['preview'] = create_url_preview(url)
+    return parsed
+
+
+def finalize_document(parsed, prev_map):
+    """Turn a parsed (and previewed) file into a knowledge base entry.
+
+    Returns (entry, texts): `texts` lists the chunks still to be embedded, or is
+    None when the previous build's embeddings were reused.
+    """
+    md_file = parsed['path']
+    meta = parsed['meta']
+    content = parsed['content']
+    tags = parsed['tags']
+    original_content = content
+    web_title = None
+    is_url = False
+    url = None
+    preview_text = None
+    
+    if parsed['url']:
+        is_url = True
+        url = parsed['url']
+        web_title, preview_content, preview_text = parsed['preview'] or (None, None, None)
+        if preview_content:
+            # Use preview content for display, but embed text extracted from preview
+            content = preview_content
+            # Replace original_content with the URL only for clarity
+            original_content = url
+            logging.info(f"Created preview for {url}")
+        else:
+            logging.warning(f"Could not create preview for {url}, using URL as content")
+    
+    # Extract title (frontmatter title overrides)
+    title = meta.get('title') or extract_title(content, web_title)
+    
+    base_text_for_embedding = preview_text if is_url and preview_text else content
+    content_hash = hashlib.sha256(base_text_for_embedding.encode('utf-8')).hexdigest()
+
+    prev = prev_map.get(md_file.name)
+    # File timestamps
+    try:
+        modified_ts = os.path.getmtime(md_file)
+        created_ts = os.path.getctime(md_file)
+    except Exception:
+        modified_ts = 0
+        created_ts = 0
+    if prev and prev.get('content_hash') == content_hash:
+        # Reuse previous entry as-is (fast path)
+        prev['title'] = title
+        prev['content'] = content
+        prev['original_content'] = original_content
+        prev['is_url'] = is_url
+        prev['source_url'] = url if is_url else None
+        prev['tags'] = tags
+        # Preserve created_ts if present, otherwise set
+        if 'created_ts' not in prev or not prev['created_ts']:
+            prev['created_ts'] = created_ts
+        # Always update modified_ts from filesystem
+        prev['modified_ts'] = modified_ts
+        logging.info(f"✓ Unchanged {md_file.name}, reused embeddings")
+        return prev, None
+
+    # Chunking; a document without chunkable text is embedded whole
+    text_chunks = chunk_text(base_text_for_embedding)
+    entry = {
+        'file': md_file.name,
+        'title': title,
+        'content': content,
+        'original_content': original_content,
+        'is_url': is_url,
+        'source_url': url if is_url else None,
+        'tags': tags,
+        'chunks': [{'text': ch} for ch in text_chunks],
+        'content_hash': content_hash,
+        'created_ts': created_ts,
+        'modified_ts': modified_ts
+    }
+    return entry, text_chunks or [base_text_for_embedding]
+
+
+class StageTimer:
+    """Accumulates busy time per pipeline stage across threads."""
+
+    def __init__(self):
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            with self._lock:
+                self.totals[name] = self.totals.get(name, 0.0) + elapsed
+
+    def summary(self):
+        return ', '.join(f"{name} {secs:.2f}s" for name, secs in self.totals.items())
+
+
+class HostLimiter:
+    """Caps the number of concurrent fetches against any one host."""
+
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def slot(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self._semaphores[host]
+
+
+class EmbeddingStage(threading.Thread):
+    """Consumes chunk texts from a bounded queue and embeds them in batches.
+
+    Producers call submit() as documents become ready, so embedding overlaps
+    with URL fetching; close() flushes the last partial batch and waits.
+    """
+
+    def __init__(self, client, timer, model=EMBEDDING_MODEL, cache=None, dimensions=None):
+        super().__init__(name='embedding-stage', daemon=True)
+        self.client = client
+        self.timer = timer
+        self.model = model
+        self.dimensions = dimensions
+        self.cache = cache
+        self.queue = queue.Queue(maxsize=EMBED_QUEUE_SIZE)
+        self.results = {}
+        self.texts = 0
+        self.batches = 0
+        # Set when the API is unavailable; later batches are skipped and close() raises it
+        self.error = None
+
+    def submit(self, doc_index, texts):
+        """Queue a document's chunks; chunks found in the cache are resolved immediately."""
+        if self.cache is not None:
+            with self.timer.stage('cache'):
+                self.results[doc_index] = self.cache.get_many(texts)
+        else:
+            self.results[doc_index] = [None] * len(texts)
+        for chunk_index, text in enumerate(texts):
+            if self.results[doc_index][chunk_index] is None:
+                self.queue.put((doc_index, chunk_index, text))
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+        logging.info(f"Embedded {self.texts} texts in {self.batches} batches")
+
+    def _flush(self, batch):
+        texts = [text for _, _, text in batch]
+        vectors = [None] * len(texts)
+        if self.error is not None:
+            # Keep draining the queue so producers never block on a stopped build
+            return
+        with self.timer.stage('embed'):
+            try:
+                _embed_batch(self.client, self.model, texts, list(range(len(texts))), vectors, self.dimensions)
+            except EmbeddingUnavailable as e:
+                logging.error(f"Stopping the build: {e}")
+                self.error = e
+                return
+            except Exception as e:
+                logging.error(f"Embedding batch failed: {e}")
+        for (doc_index, chunk_index, _), vector in zip(batch, vectors):
+            self.results[doc_index][chunk_index] = vector
+        if self.cache is not None:
+            self.cache.put_many(texts, vectors)
+        self.texts += len(texts)
+        self.batches += 1
+
+    def run(self):
+        batch, batch_tokens = [], 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            tokens = estimate_tokens(item[2])
+            if batch and (len(batch) >= EMBED_BATCH_SIZE or batch_tokens + tokens > EMBED_BATCH_TOKENS):
+                self._flush(batch)
+                batch, batch_tokens = [], 0
+            batch.append(item)
+            batch_tokens += tokens
+        if batch:
+            self._flush(batch)
+
+
+def attach_embeddings(entry, embeddings):
+    """Fill in chunk and document embeddings from the batched results."""
+    if entry['chunks']:
+        for ch, emb in zip(entry['chunks'], embeddings):
+            ch['embedding'] = emb
+        # Document-level embedding as average of chunks
+        entry['embedding'] = average_vectors(embeddings)
+    else:
+        entry['embedding'] = embeddings[0]
+
+
+def process_md_files(client=None, workers=None, cache=None, dimensions=None):
+    """Process all .md files in knowledge directory
+
+    Runs as a staged pipeline: files are read and parsed on a thread pool,
+    URL-only notes are fetched on a second pool with per-host concurrency
+    limits, and chunks stream through a bounded queue into the batched
+    embedding stage (see EmbeddingStage). Entries are assembled in file order,
+    so the result is identical to a sequential build (workers=1). `client`
+    overrides the OpenAI client; `cache` is an optional chunk_cache.ChunkCache
+    consulted before any chunk is sent for embedding. `dimensions` requests
+    shortened vectors; the previous build is only reused if it matches.
+    """
     knowledge_dir = Path('knowledge')
     if not knowledge_dir.exists():
         knowledge_dir.mkdir()
@@ -219,138 +593,199 @@ def process_md_files():
         logging.warning("No .md files found in knowledge directory")
         return []
     
-    knowledge_base = []
+    timer = StageTimer()
+    started = time.perf_counter()
 
     # Load existing to support incremental with content hash
     prev_map = {}
     try:
-        with open('embeddings.json', 'r', encoding='utf-8') as pf:
-            prev_data = json.load(pf)
-            for entry in prev_data:
+        with timer.stage('load'):
+            prev_store = open_store()
+            if prev_store is not None and (prev_store.model != EMBEDDING_MODEL
+                                           or prev_store.dimensions != dimensions):
+                logging.info("Embedding model or dimensions changed; re-embedding every document")
+                prev_store = None
+            if prev_store is not None and prev_store.meta.get('chunking') != chunking_settings():
+                # Unchanged chunk texts still come from the chunk cache
+                logging.info("Chunking changed; re-chunking every document")
+                prev_store = None
+            for entry in (prev_store.to_records() if prev_store is not None else []):
                 prev_map[entry.get('file')] = entry
     except Exception:
         prev_map = {}
     
-    for md_file in md_files:
-        logging.info(f"Processing {md_file.name}")
-        
-        with open(md_file, 'r', encoding='utf-8') as f:
-            raw_text = f.read().strip()
-        meta, content = parse_frontmatter_and_body(raw_text)
-        
-        if not content:
-            logging.warning(f"Skipping empty file: {md_file.name}")
-            continue
-        
-        original_content = content
-        web_title = None
-        is_url = False
-        tags = meta.get('tags', []) if isinstance(meta, dict) else []
-        if isinstance(tags, str):
-            tags = [t.strip() for t in tags.split(',') if t.strip()]
-        
-        # Check if content is just a URL
-        if is_url_only(content):
-            is_url = True
-            url = content.strip()
-            web_title, preview_content, preview_text = create_url_preview(url)
-            if preview_content:
-                # Use preview content for display, but embed text extracted from preview
-                content = preview_content
-                # Replace original_content with the URL only for clarity
-                original_content = url
-                logging.info(f"Created preview for {url}")
-            else:
-                logging.warning(f"Could not create preview for {url}, using URL as content")
-        
-        # Extract title (frontmatter title overrides)
-        title = meta.get('title') or extract_title(content, web_title)
-        
-        # Generate embedding
+    workers = workers or FETCH_WORKERS
+    host_limiter = HostLimiter(FETCH_PER_HOST)
+    embedder = EmbeddingStage(client or openai_client, timer, cache=cache, dimensions=dimensions)
+    embedder.start()
+    entries = [None] * len(md_files)
+
+    def timed(stage, fn, *args):
+        with timer.stage(stage):
+            return fn(*args)
+
+    def finalize(index, future):
+        md_file = md_files[index]
         try:
-            base_text_for_embedding = preview_text if is_url and 'preview_text' in locals() and preview_text else content
-            content_hash = hashlib.sha256(base_text_for_embedding.encode('utf-8')).hexdigest()
-
-            prev = prev_map.get(md_file.name)
-            # File timestamps
-            try:
-                modified_ts = os.path.getmtime(md_file)
-                created_ts = os.path.getctime(md_file)
-            except Exception:
-                modified_ts = 0
-                created_ts = 0
-            if prev and prev.get('content_hash') == content_hash:
-                # Reuse previous entry as-is (fast path)
-                prev['title'] = title
-                prev['content'] = content
-                prev['original_content'] = original_content
-                prev['is_url'] = is_url
-                prev['source_url'] = url if is_url else None
-                prev['tags'] = tags
-                # Preserve created_ts if present, otherwise set
-                if 'created_ts' not in prev or not prev['created_ts']:
-                    prev['created_ts'] = created_ts
-                # Always update modified_ts from filesystem
-                prev['modified_ts'] = modified_ts
-                knowledge_base.append(prev)
-                logging.info(f"✓ Unchanged {md_file.name}, reused embeddings")
-                continue
-
-            # Chunking
-            text_chunks = chunk_text(base_text_for_embedding)
-            chunk_embeddings = []
-            chunk_objs = []
-            for ch in text_chunks:
-                emb = get_embedding(ch)
-                chunk_embeddings.append(emb)
-                chunk_objs.append({
-                    'text': ch,
-                    'embedding': emb
-                })
-
-            # Document-level embedding as average of chunks
-            doc_embedding = average_vectors(chunk_embeddings) if chunk_embeddings else get_embedding(base_text_for_embedding)
-
-            knowledge_base.append({
-                'file': md_file.name,
-                'title': title,
-                'content': content,
-                'original_content': original_content,
-                'is_url': is_url,
-                'source_url': url if is_url else None,
-                'tags': tags,
-                'chunks': chunk_objs,
-                'embedding': doc_embedding,
-                'content_hash': content_hash,
-                'created_ts': created_ts,
-                'modified_ts': modified_ts
-            })
-            
-            logging.info(f"✓ Processed {md_file.name}: {title}")
-            
+            parsed = future.result()
+            if parsed is None:
+                return None
+            if parsed['url'] and parsed['preview'] is None:
+                return parsed
+            entry, texts = timed('chunk', finalize_document, parsed, prev_map)
         except Exception as e:
             logging.error(f"Failed to process {md_file.name}: {e}")
+            return None
+        entries[index] = entry
+        if texts is not None:
+            embedder.submit(index, texts)
+        return None
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(workers, 4), thread_name_prefix='read') as read_pool, \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetch') as fetch_pool:
+            reads = {read_pool.submit(timed, 'read', read_document, md_file): i
+                     for i, md_file in enumerate(md_files)}
+            fetches = {}
+            for future in as_completed(reads):
+                parsed = finalize(reads[future], future)
+                if parsed is not None:
+                    fetches[fetch_pool.submit(timed, 'fetch', fetch_preview, parsed, host_limiter)] = reads[future]
+            for future in as_completed(fetches):
+                finalize(fetches[future], future)
+    finally:
+        embedder.close()
+
+    knowledge_base = []
+    for index, entry in enumerate(entries):
+        if entry is None:
+            continue
+        if index in embedder.results:
+            doc_embeddings = embedder.results[index]
+            if any(emb is None for emb in doc_embeddings):
+                logging.error(f"Failed to process {md_files[index].name}: embedding request failed")
+                continue
+            attach_embeddings(entry, doc_embeddings)
+            logging.info(f"✓ Processed {md_files[index].name}: {entry['title']}")
+        knowledge_base.append(entry)
     
+    logging.info(f"Stage timings (busy): {timer.summary()}; wall {time.perf_counter() - started:.2f}s")
     return knowledge_base
 
+def store_extras(args, knowledge_base, path=STORE_DIR):
+    """Artifacts written next to each store generation (or shard), before it is committed."""
+    def extras(meta, chunk_vectors, doc_vectors):
+        meta['render_version'] = RENDER_VERSION
+        meta['dimensions'] = args.dimensions
+        meta['chunking'] = chunking_settings()
+        meta['dedup_threshold'] = args.dedup_threshold
+        lexical = write_lexical_index(path, meta, knowledge_base)
+        logging.info(f"Generated BM25 index ({len(lexical.terms)} terms over {lexical.num_units} chunks)")
+        if args.ann and meta['num_chunks']:
+            index = write_index(path, meta, chunk_vectors, n_lists=args.ann_lists)
+            logging.info(f"Generated IVF index ({index.num_lists} lists)")
+        for kind in args.quantize or ():
+            if kind == 'prefix' and args.prefix_dim >= meta['dim']:
+                logging.info(f"Skipping prefix codes: vectors are already {meta['dim']}-d")
+            elif meta['num_chunks']:
+                codes = write_codes(path, meta, chunk_vectors, kind=kind, prefix_dim=args.prefix_dim)
+                logging.info(f"Generated {kind} codes ({codes.nbytes:,} bytes vs "
+                             f"{chunk_vectors.nbytes:,} float32)")
+    return extras
+
 def main():
     """Main build function"""
+    parser = argparse.ArgumentParser(description="Build the MindSynth knowledge base")
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32',
+                        help="stored vector precision (float16 halves the file and the shared memory map)")
+    parser.add_argument('--json', action='store_true',
+                        help=f"also write the legacy {LEGACY_PATH}")
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f"URL fetch concurrency (default {FETCH_WORKERS}; 1 runs sequentially)")
+    parser.add_argument('--prune', action='store_true',
+                        help="keep only the new generation's files (for committing the store; "
+                             "running servers may still be reading the previous one)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help=f"do not read or write the chunk embedding cache ({CACHE_PATH})")
+    parser.add_argument('--cache-max-mb', type=int, default=CACHE_MAX_MB,
+                        help="evict least recently used cached vectors beyond this size")
+    parser.add_argument('--ann', action='store_true',
+                        help="build an IVF approximate nearest-neighbour index next to the store")
+    parser.add_argument('--ann-lists', type=int, default=None,
+                        help="number of IVF lists (default sqrt(chunks))")
+    parser.add_argument('--quantize', choices=QUANT_KINDS, nargs='+', default=None,
+                        help="also write int8, 1-bit and/or leading-dimension codes for a cheap first search pass")
+    parser.add_argument('--prefix-dim', type=int, default=DEFAULT_PREFIX_DIM,
+                        help="dimensions scored by --quantize prefix before exact re-ranking")
+    parser.add_argument('--dimensions', type=int, default=EMBEDDING_DIMENSIONS,
+                        help="request shortened embeddings of this size (default: the model's native size)")
+    parser.add_argument('--shards', type=int, default=KB_SHARDS,
+                        help="split the knowledge base into this many shards, each rewritten only when "
+                             "its documents change (0: a single store)")
+    parser.add_argument('--shard-by', choices=SHARD_STRATEGIES, default=KB_SHARD_BY,
+                        help="assign documents to shards by a hash of the file name or of the first tag")
+    parser.add_argument('--dedup-threshold', type=float, default=DEDUP_THRESHOLD,
+                        help="cosine similarity at which documents with matching text count as "
+                             "near-duplicates (0 disables)")
+    args = parser.parse_args()
+
     logging.info("Starting knowledge base build...")
     
     # Process markdown files
-    knowledge_base = process_md_files()
+    cache = None if args.no_cache else ChunkCache(CACHE_PATH, model=embedding_model_id(EMBEDDING_MODEL, args.dimensions))
+    try:
+        try:
+            knowledge_base = process_md_files(workers=args.workers, cache=cache, dimensions=args.dimensions)
+        except EmbeddingUnavailable as e:
+            # Nothing is written: the previous build keeps being served
+            logging.error(f"Build failed: {e}")
+            sys.exit(1)
+        if cache is not None:
+            logging.info(f"Chunk cache: {cache.stats()}")
+            cache.gc(args.cache_max_mb)
+    finally:
+        if cache is not None:
+            cache.close()
     
     if not knowledge_base:
         logging.error("No valid markdown files processed")
         return
     
-    # Save embeddings
-    with open('embeddings.json', 'w', encoding='utf-8') as f:
-        json.dump(knowledge_base, f, ensure_ascii=False, separators=(',', ':'))
-    
-    # Calculate file sizes
-    embeddings_size = os.path.getsize('embeddings.json')
-    logging.info(f"Generated embeddings.json ({embeddings_size:,} bytes)")
+    # Pre-render sanitized HTML so /content never runs markdown/bleach per request
+    for entry in knowledge_base:
+        entry['html'] = render_html(entry['content'])
+
+    # Near-duplicate clusters are resolved here, so searches only check a flag
+    duplicates = mark_duplicates(knowledge_base, args.dedup_threshold)
+    if duplicates:
+        logging.info(f"Marked {duplicates} near-duplicate documents (similarity >= {args.dedup_threshold})")
+
+    # Save embeddings as a memory-mappable store, or as shards
+    if args.shards > 0:
+        # Everything besides the documents that shapes a shard's files
+        settings = {'model': embedding_model_id(EMBEDDING_MODEL, args.dimensions), 'dtype': args.dtype,
+                    'chunking': chunking_settings(), 'render_version': RENDER_VERSION, 'ann': args.ann,
+                    'ann_lists': args.ann_lists, 'quantize': args.quantize, 'prefix_dim': args.prefix_dim,
+                    'dedup_threshold': args.dedup_threshold}
+        manifest = write_shards(knowledge_base, STORE_DIR, args.shards, by=args.shard_by, settings=settings,
+                                extras=lambda records, path: store_extras(args, records, path),
+                                keep_previous=not args.prune, dtype=args.dtype)
+        if args.prune:
+            remove_store(STORE_DIR)
+        sizes = ', '.join(str(s['num_docs']) for s in manifest['shards'])
+        logging.info(f"Generated {STORE_DIR}/ ({args.shards} shards by {args.shard_by}: {sizes} documents, "
+                     f"{args.dtype})")
+    else:
+        meta = write_store(knowledge_base, STORE_DIR, dtype=args.dtype, extras=store_extras(args, knowledge_base),
+                           keep_previous=not args.prune)
+        remove_shards(STORE_DIR, remove_files=args.prune)
+        store_size = sum(os.path.getsize(os.path.join(STORE_DIR, name))
+                         for name in ['meta.json', *meta['files'].values()])
+        logging.info(f"Generated {STORE_DIR}/ ({store_size:,} bytes, {meta['num_chunks']} chunks, {args.dtype})")
+    if args.json:
+        with open(LEGACY_PATH, 'w', encoding='utf-8') as f:
+            json.dump(knowledge_base, f, ensure_ascii=False, separators=(',', ':'))
+        logging.info(f"Generated {LEGACY_PATH} ({os.path.getsize(LEGACY_PATH):,} bytes)")
     logging.info(f"Processed {len(knowledge_base)} documents")
     
     # Show size breakdown
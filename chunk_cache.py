@@ -0,0 +1,104 @@
+"""
+Persistent, content-addressed cache of chunk embeddings for incremental builds.
+
+Vectors are keyed by sha256(model + chunk text), so a chunk seen before in any
+file (including renamed or partially edited ones) is never embedded twice.
+Entries live in a small SQLite database under the build directory; `gc()` keeps
+it under a byte budget by evicting the least recently used vectors.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+
+CACHE_DIR = '.build'
+CACHE_PATH = os.path.join(CACHE_DIR, 'chunk_cache.sqlite')
+DEFAULT_MAX_MB = int(os.environ.get("CHUNK_CACHE_MAX_MB", 512))
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{text}".encode('utf-8')).hexdigest()
+
+
+class ChunkCache:
+    """Thread-safe SQLite map of cache_key -> float32 vector, with hit/miss counters."""
+
+    def __init__(self, path=CACHE_PATH, model='text-embedding-3-small'):
+        self.path = path
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+
+    def get_many(self, texts):
+        """Cached vectors for `texts` (None where missing); refreshes last_used on hits."""
+        keys = [cache_key(self.model, t) for t in texts]
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                     [(now, k) for k in found])
+                self._db.commit()
+        vectors = [np.frombuffer(found[k], dtype=np.float32).tolist() if k in found else None for k in keys]
+        hits = sum(v is not None for v in vectors)
+        self.hits += hits
+        self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, texts, vectors):
+        now = time.time()
+        rows = [(cache_key(self.model, t), np.asarray(v, dtype=np.float32).tobytes(), now)
+                for t, v in zip(texts, vectors) if v is not None]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._db.commit()
+        self.writes += len(rows)
+
+    def gc(self, max_mb=DEFAULT_MAX_MB):
+        """Evict least recently used vectors until the cache holds at most `max_mb` of vectors."""
+        budget = max_mb * 1024 * 1024
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, length(vector) FROM embeddings ORDER BY last_used DESC"
+            ).fetchall()
+            kept = 0
+            evict = []
+            for key, size in rows:
+                kept += size
+                if kept > budget:
+                    evict.append((key,))
+            if evict:
+                self._db.executemany("DELETE FROM embeddings WHERE key = ?", evict)
+                self._db.commit()
+                self._db.execute("VACUUM")
+        if evict:
+            logging.info(f"Chunk cache: evicted {len(evict)} least recently used vectors")
+        return len(evict)
+
+    def stats(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({ratio:.0%} hit ratio), {self.writes} new"
+
+    def close(self):
+        with self._lock:
+            self._db.close()
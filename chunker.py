@@ -0,0 +1,269 @@
+"""
+Token-aware, linear-time markdown chunker with stable boundaries.
+
+Text is read as a stream of lines and grouped into blocks: paragraphs
+(runs of non-blank lines), fenced code blocks (kept whole, blank lines
+included) and ATX headings. Blocks are packed into chunks of at most
+`max_tokens`, a section's heading included:
+
+- a heading always starts a new chunk, so every section is chunked on its
+  own and an edit never moves boundaries outside its section;
+- inside a section a chunk also closes before an "anchor" block (one whose
+  CRC is 0 modulo ANCHOR_EVERY) once it holds `min_tokens`. Anchors depend
+  only on the block's own text, so after an insertion or deletion the
+  boundaries fall back into step at the next anchor instead of shifting
+  through the rest of the section;
+- a block larger than `max_tokens` is split by sentences (lines for code)
+  and, if still too large, by tokens.
+
+Each chunk after the first in a section starts with the last `overlap`
+tokens of the previous block. Every block is measured once and every chunk
+joined once, so chunking is linear in the document size; memory is bounded
+by one chunk plus one block, so `chunk_file` streams arbitrarily large files.
+
+Tokens are counted with tiktoken's cl100k_base encoding (the text-embedding-3
+tokenizer) when tiktoken is installed, otherwise estimated conservatively at
+~3 characters per token. The two chunk differently, so build.py records the
+counter's name with its chunking settings.
+
+Usage:
+    python chunker.py knowledge/*.md [--max-tokens 300] [--overlap 32]
+"""
+import re
+import sys
+import zlib
+import logging
+import argparse
+
+DEFAULT_MAX_TOKENS = 300
+DEFAULT_OVERLAP = 32
+# Bump when chunk boundaries change, so builds re-chunk unchanged documents
+CHUNKER_VERSION = 3
+# One block in ANCHOR_EVERY (by content) may end a chunk early
+ANCHOR_EVERY = 4
+
+_FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_HEADING = re.compile(r"^ {0,3}#{1,6}(\s|$)")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken if available, else by a conservative estimate."""
+
+    def __init__(self, encoding='cl100k_base'):
+        self._enc = None
+        if encoding:
+            try:
+                import tiktoken
+                self._enc = tiktoken.get_encoding(encoding)
+            except Exception:
+                logging.debug("tiktoken unavailable; estimating chunk tokens from length")
+        self.name = encoding if self._enc is not None else 'estimate'
+
+    def count(self, text):
+        if self._enc is not None:
+            return len(self._enc.encode(text, disallowed_special=()))
+        return len(text) // 3 + 1
+
+    def split(self, text, max_tokens):
+        """Cut `text` into pieces of at most `max_tokens`, preferring whitespace."""
+        if self._enc is not None:
+            ids = self._enc.encode(text, disallowed_special=())
+            return [self._enc.decode(ids[i:i + max_tokens]).strip() for i in range(0, len(ids), max_tokens)]
+        width = max(1, (max_tokens - 1) * 3)
+        pieces = []
+        while len(text) > width:
+            cut = text.rfind(' ', 0, width)
+            cut = cut if cut > width // 2 else width
+            pieces.append(text[:cut].strip())
+            text = text[cut:].lstrip()
+        pieces.append(text)
+        return [p for p in pieces if p]
+
+    def tail(self, text, n_tokens):
+        """Roughly the last `n_tokens` of `text`, starting at a word boundary."""
+        if n_tokens <= 0:
+            return ''
+        if self._enc is not None:
+            ids = self._enc.encode(text, disallowed_special=())
+            if len(ids) <= n_tokens:
+                return text
+            tail = self._enc.decode(ids[-n_tokens:])
+        else:
+            width = n_tokens * 3
+            if len(text) <= width:
+                return text
+            tail = text[-width:]
+        space = tail.find(' ')
+        return tail[space + 1:] if 0 <= space < len(tail) - 1 else tail
+
+
+_default_counter = None
+
+
+def default_counter():
+    global _default_counter
+    if _default_counter is None:
+        _default_counter = TokenCounter()
+    return _default_counter
+
+
+def iter_blocks(lines):
+    """Yield (kind, text) blocks from an iterable of lines; kind is 'heading', 'code' or 'text'."""
+    buf = []
+    fence = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if fence is not None:
+            buf.append(line)
+            if line.strip().startswith(fence):
+                yield 'code', '\n'.join(buf)
+                buf, fence = [], None
+            continue
+        match = _FENCE.match(line)
+        if match:
+            if buf:
+                yield 'text', '\n'.join(buf).strip()
+            buf, fence = [line], match.group(1)[0] * len(match.group(1))
+        elif _HEADING.match(line):
+            if buf:
+                yield 'text', '\n'.join(buf).strip()
+                buf = []
+            yield 'heading', line.strip()
+        elif not line.strip():
+            if buf:
+                yield 'text', '\n'.join(buf).strip()
+                buf = []
+        else:
+            buf.append(line)
+    if buf:
+        # An unterminated fence runs to the end of the document, as in markdown
+        if fence is not None:
+            yield 'code', '\n'.join(buf)
+        else:
+            yield 'text', '\n'.join(buf).strip()
+
+
+def _is_anchor(text):
+    return zlib.crc32(text.encode('utf-8')) % ANCHOR_EVERY == 0
+
+
+def _pieces(kind, text, tokens, max_tokens, counter):
+    """(text, tokens) parts of one block, each within max_tokens."""
+    if tokens <= max_tokens:
+        yield text, tokens
+        return
+    units = text.split('\n') if kind == 'code' else _SENTENCE_END.split(text)
+    sep = '\n' if kind == 'code' else ' '
+    part, part_tokens = [], 0
+    for unit in units:
+        n = counter.count(unit)
+        if n > max_tokens:
+            if part:
+                yield sep.join(part), part_tokens
+                part, part_tokens = [], 0
+            for piece in counter.split(unit, max_tokens):
+                yield piece, counter.count(piece)
+            continue
+        if part and part_tokens + n + 1 > max_tokens:
+            yield sep.join(part), part_tokens
+            part, part_tokens = [], 0
+        part.append(unit)
+        part_tokens += n + (1 if len(part) > 1 else 0)
+    if part:
+        yield sep.join(part), part_tokens
+
+
+def iter_chunks(lines, max_tokens=DEFAULT_MAX_TOKENS, overlap=DEFAULT_OVERLAP, min_tokens=None, counter=None):
+    """Yield chunk strings from an iterable of markdown lines (see module docstring)."""
+    counter = counter or default_counter()
+    min_tokens = max_tokens // 3 if min_tokens is None else min_tokens
+    # Room left for the overlap prefix
+    budget = max(1, max_tokens - overlap)
+    current, current_tokens = [], 0
+    carry = ''
+
+    def flush():
+        text = '\n\n'.join(current)
+        return f"{carry}\n\n{text}" if carry else text
+
+    heading_only = False
+    for kind, text in iter_blocks(lines):
+        if not text:
+            continue
+        tokens = counter.count(text)
+        if kind == 'heading':
+            if current:
+                yield flush()
+            current, current_tokens, carry, heading_only = [text], tokens, '', True
+            continue
+        anchor = _is_anchor(text)
+        # The first block of a section shares its chunk with the heading (and no overlap)
+        limit = min(budget, max(1, max_tokens - current_tokens - 2)) if heading_only else budget
+        for piece, n in _pieces(kind, text, tokens, limit, counter):
+            # A heading stays with the first block of its section
+            if current and not heading_only and (current_tokens + n + 2 > budget
+                                                 or (anchor and current_tokens >= min_tokens)):
+                yield flush()
+                carry = counter.tail(current[-1], overlap)
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += n + (2 if len(current) > 1 else 0)
+            anchor = heading_only = False
+    if current:
+        yield flush()
+
+
+def chunk_markdown(text, max_tokens=DEFAULT_MAX_TOKENS, overlap=DEFAULT_OVERLAP, counter=None):
+    """Chunks of an in-memory markdown document."""
+    return list(iter_chunks(text.splitlines(), max_tokens=max_tokens, overlap=overlap, counter=counter))
+
+
+def _skip_frontmatter(f):
+    first = f.readline()
+    if first.strip() != '---':
+        yield first
+        yield from f
+        return
+    held = [first]
+    for line in f:
+        held.append(line)
+        if line.strip() == '---':
+            break
+    else:
+        # No closing delimiter: it was not frontmatter
+        yield from held
+        return
+    yield from f
+
+
+def chunk_file(path, max_tokens=DEFAULT_MAX_TOKENS, overlap=DEFAULT_OVERLAP, counter=None):
+    """Stream the chunks of a markdown file (frontmatter skipped) without reading it whole."""
+    with open(path, encoding='utf-8') as f:
+        yield from iter_chunks(_skip_frontmatter(f), max_tokens=max_tokens, overlap=overlap, counter=counter)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show how markdown files are chunked")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--max-tokens', type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument('--overlap', type=int, default=DEFAULT_OVERLAP)
+    parser.add_argument('--show', action='store_true', help="print every chunk")
+    args = parser.parse_args()
+
+    counter = default_counter()
+    print(f"tokenizer: {counter.name}")
+    for path in args.files:
+        sizes = []
+        for i, chunk in enumerate(chunk_file(path, args.max_tokens, args.overlap, counter)):
+            sizes.append(counter.count(chunk))
+            if args.show:
+                print(f"--- {path} #{i} ({sizes[-1]} tokens)\n{chunk}")
+        if not sizes:
+            print(f"{path}: no chunks")
+            continue
+        print(f"{path}: {len(sizes)} chunks, mean {sum(sizes) / len(sizes):.0f} tokens, max {max(sizes)}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
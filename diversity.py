@@ -0,0 +1,167 @@
+"""
+Near-duplicate detection (build time) and maximal marginal relevance (query time).
+
+Several notes often carry the same text, e.g. the same article saved twice.
+build.py marks a document as a near-duplicate when both of these hold:
+
+- its document vector (the mean of its chunk vectors) has cosine similarity
+  >= `threshold` with an earlier document's;
+- their text matches too. URL documents must point to the same page, because
+  previews of different pages can read the same (a failed embed is "View
+  Tweet" for every tweet). Other notes need the same content hash or
+  `TEXT_THRESHOLD` overlap of word trigrams.
+
+Documents are visited earliest first. Each becomes the representative of a
+new group, or a duplicate of the most similar representative it matches, so a
+chain of pairwise matches never merges documents that are not alike
+themselves. Duplicates record the representative's file name as
+`duplicate_of`, and searches can drop them with one mask lookup per match
+(see KnowledgeIndex.duplicate). Candidate pairs come from tiled matrix
+products, so memory stays at `block` x `block` similarities: quadratic time,
+but only once per build.
+
+`mmr` re-orders a result list so that each next result is relevant but unlike
+the results above it, from the same stored document vectors. All pairwise
+similarities of the candidates come from one matrix product.
+
+Usage:
+    python diversity.py [--threshold 0.97]    # list near-duplicates in the current build
+"""
+import re
+import sys
+import logging
+import argparse
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.97
+DEFAULT_LAMBDA = 0.7
+# Word-trigram overlap (Jaccard) at which two notes' texts count as the same
+TEXT_THRESHOLD = 0.9
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def near_duplicate_pairs(vectors, threshold=DEFAULT_THRESHOLD, block=1024):
+    """Yield (i, j, similarity) for every pair of rows i < j with cosine similarity >= threshold.
+
+    `vectors` are unit rows (zero rows never match). Both axes are tiled, so
+    each product is at most `block` x `block`.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    for start in range(0, len(vectors), block):
+        rows = vectors[start:start + block]
+        # This block against itself and every later block: each pair once
+        for other in range(start, len(vectors), block):
+            sims = rows @ vectors[other:other + block].T
+            i, j = np.nonzero(sims >= threshold)
+            keep = i + start < j + other
+            for a, b, sim in zip((i[keep] + start).tolist(), (j[keep] + other).tolist(), sims[i, j][keep].tolist()):
+                yield a, b, sim
+
+
+def _trigrams(text):
+    words = _WORD.findall((text or '').lower())
+    return set(zip(words, words[1:], words[2:])) if len(words) >= 3 else {tuple(words)}
+
+
+def same_text(a, b, text_threshold=TEXT_THRESHOLD):
+    """Whether two build records hold the same text (the check behind similar vectors)."""
+    if a.get('is_url') or b.get('is_url'):
+        url_a, url_b = (a.get('source_url') or '').rstrip('/'), (b.get('source_url') or '').rstrip('/')
+        return bool(a.get('is_url') and b.get('is_url') and url_a and url_a == url_b)
+    if a.get('content_hash') and a.get('content_hash') == b.get('content_hash'):
+        return True
+    grams_a, grams_b = _trigrams(a.get('content')), _trigrams(b.get('content'))
+    return len(grams_a & grams_b) >= text_threshold * len(grams_a | grams_b)
+
+
+def mark_duplicates(records, threshold=DEFAULT_THRESHOLD, block=1024):
+    """Set `duplicate_of` on build records (None for kept documents); returns the number of duplicates.
+
+    The earliest created document (then the first by file name) is kept, so
+    adding another copy later never hides the one already shown.
+    """
+    for record in records:
+        record['duplicate_of'] = None
+    if not records or threshold <= 0:
+        return 0
+    dim = next((len(r['embedding']) for r in records if r.get('embedding')), 0)
+    if not dim:
+        return 0
+    vectors = np.zeros((len(records), dim), dtype=np.float32)
+    for i, record in enumerate(records):
+        if record.get('embedding'):
+            vectors[i] = record['embedding']
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    order = sorted(range(len(records)), key=lambda i: (records[i].get('created_ts') or 0, records[i]['file']))
+    rank = np.empty(len(records), dtype=np.int64)
+    rank[order] = np.arange(len(records))
+    # Matches of every document among the documents visited before it
+    earlier = {}
+    for i, j, sim in near_duplicate_pairs(vectors, threshold, block):
+        if same_text(records[i], records[j]):
+            later, first = (i, j) if rank[i] > rank[j] else (j, i)
+            earlier.setdefault(later, []).append((sim, -rank[first], first))
+
+    duplicates = 0
+    for i in order:
+        representatives = [match for match in earlier.get(i, ()) if records[match[2]]['duplicate_of'] is None]
+        if representatives:
+            records[i]['duplicate_of'] = records[max(representatives)[2]]['file']
+            duplicates += 1
+    return duplicates
+
+
+def mmr(relevance, vectors, lambda_=DEFAULT_LAMBDA, k=None):
+    """Maximal marginal relevance order of candidates: positions into `relevance`.
+
+    Each pick maximizes lambda_ * relevance - (1 - lambda_) * (highest cosine
+    similarity to an earlier pick); lambda_=1 keeps the relevance order.
+    `vectors` are the candidates' unit document vectors; `k` limits the picks
+    (default: all candidates).
+    """
+    relevance = np.asarray(relevance, dtype=np.float64)
+    n = len(relevance)
+    k = n if k is None else min(k, n)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    pairwise = (vectors @ vectors.T).astype(np.float64)
+    redundancy = np.zeros(n, dtype=np.float64)
+    available = np.ones(n, dtype=bool)
+    order = []
+    for _ in range(k):
+        gain = lambda_ * relevance - (1 - lambda_) * redundancy
+        gain[~available] = -np.inf
+        pick = int(np.argmax(gain))
+        order.append(pick)
+        available[pick] = False
+        redundancy = np.maximum(redundancy, pairwise[pick])
+    return order
+
+
+def main():
+    from snapshot import load_snapshot
+    parser = argparse.ArgumentParser(description="List near-duplicates in the current build")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    snap = load_snapshot()
+    records = [{'file': doc['file'], 'created_ts': snap.index.created_ts[i], 'is_url': doc.get('is_url'),
+                'source_url': doc.get('source_url'), 'content_hash': doc.get('content_hash'),
+                'content': snap.store.content(i),
+                'embedding': snap.store.doc_vectors_for([i])[0].tolist() if doc.get('has_embedding') else None}
+               for i, doc in enumerate(snap.docs)]
+    found = mark_duplicates(records, args.threshold)
+    groups = {}
+    for record in records:
+        if record['duplicate_of']:
+            groups.setdefault(record['duplicate_of'], []).append(record['file'])
+    for kept, others in sorted(groups.items()):
+        print(f"{kept}: {', '.join(sorted(others))}")
+    print(f"{found} near-duplicates of {len(groups)} documents among {len(records)} at >= {args.threshold}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Micro-batching of query embeddings across concurrent requests.
+
+Under load many /search requests miss the embedding cache at the same moment,
+each wanting a single-input embeddings call. An EmbeddingBatcher collects those
+misses for a short window (or until a batch is full), sends them upstream as one
+list and hands each caller its own vector back:
+
+    batcher = EmbeddingBatcher(FakeOpenAI(), window_ms=5, max_batch=64)
+    vector = batcher.embed("what is attention")
+
+Requests for different models or vector sizes (``dimensions``) share a window
+but go upstream as separate calls. Requests are queued to a dispatcher thread
+that owns the window; each batch goes to a small pool so a slow upstream call
+does not hold up the next window. A batch the API refuses (400) is split and
+retried, so one bad input only fails its own caller. Threads are started lazily
+per process, so a batcher created before a fork (e.g. gunicorn --preload) works
+in the workers. Callers wait at most `timeout` seconds. Counters cover batch
+sizes, queueing delay and upstream latency.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from openai import BadRequestError
+
+DEFAULT_WINDOW_MS = 5
+DEFAULT_MAX_BATCH = 64
+
+
+class EmbeddingBatcher:
+    """Coalesces single-text embedding requests into batched `client.embeddings.create` calls."""
+
+    def __init__(self, client, model='text-embedding-3-small', window_ms=DEFAULT_WINDOW_MS,
+                 max_batch=DEFAULT_MAX_BATCH, timeout=None, workers=4):
+        self.client = client
+        self.model = model
+        self.window = max(0.0, window_ms / 1000.0)
+        self.max_batch = max(1, max_batch)
+        self.timeout = timeout
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._pid = None
+        self._pool = None
+        # Metrics (per process)
+        self.requests = 0
+        self.sent = 0
+        self.batches = 0
+        self.upstream_inputs = 0
+        self.errors = 0
+        self.max_batch_seen = 0
+        self.queue_seconds = 0.0
+        self.upstream_seconds = 0.0
+        self.max_upstream_seconds = 0.0
+
+    def embed(self, text, model=None, dimensions=None):
+        """Embedding vector for `text`, sent upstream together with concurrent requests."""
+        future = Future()
+        with self._cond:
+            self._ensure_started()
+            self._queue.append(((model or self.model, dimensions, text), future, time.perf_counter()))
+            self.requests += 1
+            self._cond.notify()
+        return future.result(timeout=self.timeout)
+
+    def _ensure_started(self):
+        if self._pid != os.getpid():
+            self._queue.clear()
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='embed-batch')
+            threading.Thread(target=self._dispatch, name='embed-dispatch', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                # The first request opens the window; collect until it closes or the batch is full
+                deadline = self._queue[0][2] + self.window
+                while len(self._queue) < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+            self._pool.submit(self._send, batch)
+
+    def _send(self, batch):
+        started = time.perf_counter()
+        # Identical requests in one window share an input; one call per (model, dimensions)
+        groups = {}
+        for request in dict.fromkeys(request for request, _, _ in batch):
+            groups.setdefault(request[:2], []).append(request)
+        vectors, errors = {}, {}
+        inputs = sum(self._create(requests, vectors, errors) for requests in groups.values())
+        error = next(iter(errors.values()), None)
+        elapsed = time.perf_counter() - started
+        with self._cond:
+            self.batches += 1
+            self.sent += len(batch)
+            self.upstream_inputs += inputs
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.queue_seconds += sum(started - queued for _, _, queued in batch)
+            self.upstream_seconds += elapsed
+            self.max_upstream_seconds = max(self.max_upstream_seconds, elapsed)
+            if error is not None:
+                self.errors += 1
+        if error is not None:
+            logging.warning(f"Query embedding batch of {len(batch)} failed for {len(errors)} inputs: {error}")
+        for request, future, _ in batch:
+            if request in vectors:
+                future.set_result(vectors[request])
+            elif request in errors:
+                future.set_exception(errors[request])
+            else:
+                future.set_exception(RuntimeError("embedding missing from batched response"))
+
+    def _create(self, requests, vectors, errors):
+        """Upstream call for requests sharing (model, dimensions), split in half if refused.
+
+        Returns the number of inputs sent, retries included.
+        """
+        model, dimensions = requests[0][:2]
+        kwargs = {'dimensions': dimensions} if dimensions else {}
+        try:
+            response = self.client.embeddings.create(model=model, input=[r[2] for r in requests], **kwargs)
+            vectors.update((requests[item.index], item.embedding) for item in response.data)
+        except BadRequestError as e:
+            if len(requests) == 1:
+                errors[requests[0]] = e
+            else:
+                mid = len(requests) // 2
+                return (len(requests) + self._create(requests[:mid], vectors, errors)
+                        + self._create(requests[mid:], vectors, errors))
+        except Exception as e:
+            errors.update((request, e) for request in requests)
+        return len(requests)
+
+    def stats(self):
+        with self._cond:
+            batches = self.batches or 1
+            return {
+                'requests': self.requests,
+                'batches': self.batches,
+                'upstream_inputs': self.upstream_inputs,
+                'errors': self.errors,
+                'mean_batch': round(self.sent / batches, 2),
+                'max_batch': self.max_batch_seen,
+                'mean_queue_ms': round(1000 * self.queue_seconds / max(1, self.sent), 3),
+                'mean_upstream_ms': round(1000 * self.upstream_seconds / batches, 3),
+                'max_upstream_ms': round(1000 * self.max_upstream_seconds, 3),
+                'queued': len(self._queue),
+            }
@@ -0,0 +1,236 @@
+"""
+Local stand-in for the OpenAI embeddings client.
+
+`FakeOpenAI` exposes the one call MindSynth makes, ``client.embeddings.create``,
+and returns deterministic unit vectors derived from a hash of each input, so
+builds and searches can be exercised without network access or an API key:
+
+    import build
+    from fake_openai import FakeOpenAI
+    build.process_md_files(client=FakeOpenAI())
+
+Failures can be injected to exercise retry paths: `fail_first` fails that many
+calls outright, `drop_rate` omits a fraction of inputs from a response, and any
+call containing one of the `reject` texts fails with a 400, like an input the
+API refuses. `latency` (seconds) delays every call like a network round trip
+would.
+
+The same vectors are also served over HTTP as a stand-in for the embeddings
+endpoint, so the app, build.py and load tests run unchanged against it:
+
+    python fake_openai.py --port 8765 --latency 0.08 --jitter 0.04 --error-rate 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python app.py
+"""
+import json
+import time
+import base64
+import hashlib
+import logging
+import argparse
+import threading
+import numpy as np
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_DIM = 1536
+
+
+def fake_embedding(text, model='text-embedding-3-small', dim=DEFAULT_DIM):
+    """Deterministic unit vector for (model, text)."""
+    seed = int.from_bytes(hashlib.sha256(f"{model}\0{text}".encode('utf-8')).digest()[:8], 'little')
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+def api_error(kind, message):
+    """An openai status error (e.g. 'BadRequestError') as the client would raise it.
+
+    Their constructors want the HTTP response, which a fake call does not
+    have, so the exception is created without one.
+    """
+    import openai
+    error_class = getattr(openai, kind)
+    error = error_class.__new__(error_class)
+    Exception.__init__(error, message)
+    return error
+
+
+class _Embeddings:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, input, dimensions=None, **kwargs):
+        return self._owner._create(model, input, dimensions)
+
+
+class FakeOpenAI:
+    """Drop-in for `openai.OpenAI` as far as embeddings are concerned."""
+
+    def __init__(self, dim=DEFAULT_DIM, fail_first=0, drop_rate=0.0, seed=0, latency=0.0, reject=()):
+        self.dim = dim
+        self.reject = set(reject)
+        self.latency = latency
+        self.fail_first = fail_first
+        self.drop_rate = drop_rate
+        self.embeddings = _Embeddings(self)
+        self.calls = 0
+        self.inputs = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def _create(self, model, input, dimensions):
+        texts = [input] if isinstance(input, str) else list(input)
+        with self._lock:
+            self.calls += 1
+            self.inputs += len(texts)
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                raise RuntimeError("fake upstream error")
+            if self.reject.intersection(texts):
+                raise api_error('BadRequestError', "fake rejected input")
+            keep = self._rng.random(len(texts)) >= self.drop_rate
+        if self.latency:
+            time.sleep(self.latency)
+        data = []
+        for i, text in enumerate(texts):
+            if not keep[i]:
+                continue
+            vector = fake_embedding(text, model, self.dim)
+            if dimensions:
+                v = np.asarray(vector[:dimensions])
+                vector = (v / np.linalg.norm(v)).tolist()
+            data.append(SimpleNamespace(index=i, embedding=vector, object='embedding'))
+        usage = SimpleNamespace(prompt_tokens=sum(len(t) // 4 for t in texts), total_tokens=sum(len(t) // 4 for t in texts))
+        return SimpleNamespace(data=data, model=model, object='list', usage=usage)
+
+
+class FakeEmbeddingsServer(ThreadingHTTPServer):
+    """HTTP server answering ``POST /v1/embeddings`` like the OpenAI API.
+
+    Every response is delayed by `latency` plus up to `jitter` seconds; a
+    fraction `error_rate` of requests fails with a 500 and `rate_limit_rate`
+    with a 429, which the OpenAI client retries like the real thing.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, dim=DEFAULT_DIM, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 seed=0):
+        super().__init__(address, _EmbeddingsHandler)
+        self.dim = dim
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.requests = 0
+        self.inputs = 0
+        self.errors = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def draw(self):
+        """(delay, status) for one request."""
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self.jitter * self._rng.random()
+            roll = self._rng.random()
+        if roll < self.error_rate:
+            return delay, 500
+        if roll < self.error_rate + self.rate_limit_rate:
+            return delay, 429
+        return delay, 200
+
+
+class _EmbeddingsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logging.debug("fake_openai: " + format % args)
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('', '/health'):
+            return self._reply(200, {'status': 'ok', 'requests': self.server.requests, 'inputs': self.server.inputs,
+                                     'errors': self.server.errors})
+        self._reply(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._reply(400, {'error': {'message': 'invalid JSON', 'type': 'invalid_request_error'}})
+        if self.path.rstrip('/') not in ('/v1/embeddings', '/embeddings'):
+            return self._reply(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+
+        server = self.server
+        delay, status = server.draw()
+        if delay:
+            time.sleep(delay)
+        if status != 200:
+            with server._lock:
+                server.errors += 1
+            kind = 'rate_limit_exceeded' if status == 429 else 'server_error'
+            return self._reply(status, {'error': {'message': f'fake {kind}', 'type': kind}})
+
+        model = request.get('model', 'text-embedding-3-small')
+        texts = request.get('input', [])
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        dimensions = request.get('dimensions')
+        as_base64 = request.get('encoding_format') == 'base64'
+        data = []
+        for i, text in enumerate(texts):
+            v = np.asarray(fake_embedding(str(text), model, server.dim), dtype=np.float32)
+            if dimensions:
+                v = v[:dimensions] / np.linalg.norm(v[:dimensions])
+            embedding = base64.b64encode(v.astype('<f4').tobytes()).decode('ascii') if as_base64 else v.tolist()
+            data.append({'object': 'embedding', 'index': i, 'embedding': embedding})
+        with server._lock:
+            server.inputs += len(texts)
+        tokens = sum(len(str(t)) // 4 for t in texts)
+        self._reply(200, {'object': 'list', 'data': data, 'model': model,
+                          'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}})
+
+
+def serve(host='127.0.0.1', port=8765, **options):
+    """Start a FakeEmbeddingsServer on a background thread and return it (port 0 picks a free one)."""
+    server = FakeEmbeddingsServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name='fake-openai', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve deterministic fake embeddings over the OpenAI HTTP API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--dim', type=int, default=DEFAULT_DIM)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random delay, up to this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="fraction answered with a 429")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    server = FakeEmbeddingsServer((args.host, args.port), dim=args.dim, latency=args.latency, jitter=args.jitter,
+                                  error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+    logging.info(f"Fake embeddings at {server.base_url} (set OPENAI_BASE_URL to this)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+gunicorn settings for production serving: ``gunicorn wsgi:application``.
+
+gunicorn reads this file from the working directory by default. The app is
+preloaded: the master imports wsgi.py, which loads the knowledge base and its
+search indexes once, and the forked workers share that memory (see wsgi.py).
+
+Search is NumPy scoring (CPU, mostly outside the GIL) and query embedding is
+a network call, so the default is one process per core with a few threads
+each. Everything is tunable through the environment:
+
+    PORT                   listen port (default 5000)
+    WEB_CONCURRENCY        worker processes (default: CPU count)
+    GUNICORN_THREADS       threads per worker (default 4)
+    GUNICORN_TIMEOUT       seconds before a silent worker is restarted (default 30)
+    GUNICORN_MAX_REQUESTS  recycle workers after this many requests (default 0, never)
+    GUNICORN_ACCESS_LOG    1 to log every request to stdout
+    BLAS_THREADS           BLAS threads per worker (default 1; workers already use every core)
+"""
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+accesslog = '-' if os.environ.get('GUNICORN_ACCESS_LOG') == '1' else None
+
+# Read by NumPy's BLAS when the master imports the app, so this must be set
+# before preloading: N workers with a thread per core each would oversubscribe
+for _var in ('OPENBLAS_NUM_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(_var, os.environ.get('BLAS_THREADS', '1'))
+
+
+def when_ready(server):
+    server.log.info(f"Serving with {workers} workers x {threads} threads")
@@ -0,0 +1,80 @@
+"""
+Load-time metadata index over the knowledge base documents.
+
+Everything /search and /tags used to recompute per request is resolved once:
+normalized tag lists, a tag -> sorted document-id inverted index, global tag
+counts, created/modified timestamps (build values, falling back to the
+filesystem) and the near-duplicate flags set by build.py. AND tag filters
+become sorted-array intersections done before scoring, and tag-only queries
+never touch the embeddings.
+"""
+import os
+import numpy as np
+
+
+def normalize_tags(tags):
+    """Lowercased, stripped string tags in their original order."""
+    return [t.strip().lower() for t in (tags or []) if isinstance(t, str) and t.strip()]
+
+
+class KnowledgeIndex:
+    """Per-document metadata arrays plus a tag inverted index for a list of document dicts."""
+
+    def __init__(self, docs, knowledge_dir='knowledge'):
+        self.num_docs = len(docs)
+        self.files = [d['file'] for d in docs]
+        self.doc_ids = {name: i for i, name in enumerate(self.files)}
+        self.doc_tags = [normalize_tags(d.get('tags')) for d in docs]
+        # Near-duplicates of another document (marked by build.py, see diversity.py)
+        self.duplicate = np.array([bool(d.get('duplicate_of')) for d in docs], dtype=bool)
+        self.created_ts = np.zeros(self.num_docs, dtype=np.float64)
+        self.modified_ts = np.zeros(self.num_docs, dtype=np.float64)
+        for i, d in enumerate(docs):
+            self.created_ts[i], self.modified_ts[i] = self._resolve_timestamps(d, knowledge_dir)
+
+        # Occurrence lists (one entry per tag mention) drive counts and weighted scores
+        self.tags = sorted({t for tags in self.doc_tags for t in tags})
+        tag_ids = {t: i for i, t in enumerate(self.tags)}
+        self.occ_doc = np.array([i for i, tags in enumerate(self.doc_tags) for _ in tags], dtype=np.int64)
+        self.occ_tag = np.array([tag_ids[t] for tags in self.doc_tags for t in tags], dtype=np.int64)
+        self.tag_docs = {
+            t: np.unique(self.occ_doc[self.occ_tag == i]).astype(np.int64) for i, t in enumerate(self.tags)
+        }
+        counts = np.bincount(self.occ_tag, minlength=len(self.tags))
+        self.tag_counts = sorted(zip(self.tags, counts.tolist()), key=lambda kv: (-kv[1], kv[0]))
+
+    @staticmethod
+    def _resolve_timestamps(doc, knowledge_dir):
+        """Timestamps from build (fallback to filesystem)."""
+        created, modified = doc.get('created_ts'), doc.get('modified_ts')
+        if created and modified:
+            return float(created), float(modified)
+        try:
+            fs_mtime = os.path.getmtime(os.path.join(knowledge_dir, doc['file']))
+            fs_ctime = os.path.getctime(os.path.join(knowledge_dir, doc['file']))
+        except Exception:
+            fs_mtime = 0
+            fs_ctime = 0
+        return float(created or fs_ctime or 0), float(modified or fs_mtime or 0)
+
+    def docs_with_tags(self, tags):
+        """Sorted ids of documents carrying every tag in `tags` (AND semantics)."""
+        result = None
+        for t in tags:
+            docs = self.tag_docs.get(t)
+            if docs is None:
+                return np.empty(0, dtype=np.int64)
+            result = docs if result is None else np.intersect1d(result, docs, assume_unique=True)
+        return np.arange(self.num_docs, dtype=np.int64) if result is None else result
+
+    def top_tags(self, limit):
+        return self.tag_counts[:limit]
+
+    def weighted_tags(self, doc_weights):
+        """Tags ranked by the summed weight of the documents mentioning them (positive weights only)."""
+        weights = np.where(doc_weights > 0, doc_weights, 0.0).astype(np.float64)
+        contributes = np.bincount(self.occ_tag, weights=(weights[self.occ_doc] > 0), minlength=len(self.tags))
+        scores = np.bincount(self.occ_tag, weights=weights[self.occ_doc], minlength=len(self.tags))
+        ranked = [(t, s) for t, s, c in zip(self.tags, scores.tolist(), contributes.tolist()) if c]
+        ranked.sort(key=lambda kv: (-kv[1], kv[0]))
+        return ranked
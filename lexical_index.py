@@ -0,0 +1,238 @@
+"""
+BM25 keyword index over the knowledge base chunks.
+
+The index is a CSR inverted index over "units": every chunk of every document
+(the title is folded into a document's first unit), or the whole content for
+documents stored without chunks. Terms are kept sorted, as one UTF-8 blob plus
+offsets (a fixed-width string array would pad every term to the longest URL or
+base64 run), so lookups are a binary search with no per-process dict to build,
+and scoring a query is a handful of postings slices accumulated with bincount.
+Per-document scores are the best unit's score, mirroring how semantic search
+uses the best chunk.
+
+build.py writes the index next to each store generation (``lexical-<gen>.npz``,
+registered in meta['files']); stores without one (legacy embeddings.json,
+older builds) are indexed at load time.
+
+`fuse_rrf` combines ranked lists with reciprocal rank fusion for hybrid search.
+"""
+import os
+import re
+import bisect
+import logging
+import numpy as np
+from vector_store import artifact_name, load_npz
+
+INDEX_FILE = 'lexical'
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have in is it its of on or that the this to was were
+will with not no do does you your we our they their i me my he she his her them than then so
+""".split())
+
+
+def tokenize(text):
+    """Lowercased word tokens, minus stopwords and single letters."""
+    return [t for t in _TOKEN.findall((text or '').lower())
+            if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+def units_from_records(records):
+    """(doc_id, chunk_index, text) for every indexed unit of build records."""
+    for doc_id, item in enumerate(records):
+        chunks = [ch.get('text', '') for ch in item.get('chunks') or []] or [item.get('content', '')]
+        for chunk_index, text in enumerate(chunks):
+            yield doc_id, chunk_index, f"{item.get('title', '')}\n{text}" if chunk_index == 0 else text
+
+
+def units_from_store(store):
+    for doc_id, doc in enumerate(store.docs):
+        count = doc['chunk_count']
+        chunks = [store.chunk_text(doc_id, i) for i in range(count)] if count else [store.content(doc_id)]
+        for chunk_index, text in enumerate(chunks):
+            yield doc_id, chunk_index, f"{doc.get('title', '')}\n{text}" if chunk_index == 0 else text
+
+
+class Vocabulary:
+    """Sorted terms stored as concatenated UTF-8 bytes and their start offsets.
+
+    Byte order of UTF-8 matches code point order, so the blob stays sorted
+    for binary search on the encoded query term.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_terms(cls, terms):
+        encoded = [t.encode('utf-8') for t in terms]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def index(self, term):
+        """Position of `term`, or None."""
+        key = term.encode('utf-8')
+        i = bisect.bisect_left(self, key)
+        return i if i < len(self) and self[i] == key else None
+
+
+class LexicalIndex:
+    """Sorted vocabulary + postings (unit, term frequency) + per-unit lengths."""
+
+    def __init__(self, terms, offsets, postings, freqs, unit_doc, unit_chunk, unit_len, num_docs, generation=0):
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+        self.freqs = freqs
+        self.unit_doc = unit_doc
+        self.unit_chunk = unit_chunk
+        self.unit_len = unit_len
+        self.num_docs = num_docs
+        self.generation = generation
+        self.avg_len = float(unit_len.mean()) if len(unit_len) else 0.0
+
+    @property
+    def num_units(self):
+        return len(self.unit_doc)
+
+    @classmethod
+    def build(cls, units, num_docs, generation=0):
+        unit_doc, unit_chunk, unit_len = [], [], []
+        pairs = {}
+        for unit, (doc_id, chunk_index, text) in enumerate(units):
+            tokens = tokenize(text)
+            unit_doc.append(doc_id)
+            unit_chunk.append(chunk_index)
+            unit_len.append(len(tokens))
+            for t in tokens:
+                key = (t, unit)
+                pairs[key] = pairs.get(key, 0) + 1
+        ordered = sorted(pairs.items())
+        vocab = sorted({t for (t, _), _ in ordered})
+        term_ids = {t: i for i, t in enumerate(vocab)}
+        counts = np.bincount([term_ids[t] for (t, _), _ in ordered], minlength=len(vocab))
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(
+            Vocabulary.from_terms(vocab),
+            offsets,
+            np.array([u for (_, u), _ in ordered], dtype=np.int32),
+            np.array([f for _, f in ordered], dtype=np.int32),
+            np.array(unit_doc, dtype=np.int32),
+            np.array(unit_chunk, dtype=np.int32),
+            np.array(unit_len, dtype=np.int32),
+            num_docs,
+            generation,
+        )
+
+    def save(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, term_bytes=self.terms.blob, term_offsets=self.terms.offsets,
+                     offsets=self.offsets, postings=self.postings, freqs=self.freqs,
+                     unit_doc=self.unit_doc, unit_chunk=self.unit_chunk, unit_len=self.unit_len,
+                     num_docs=np.int64(self.num_docs), generation=np.int64(self.generation))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        data = load_npz(path)
+        if 'term_bytes' in data:
+            terms = Vocabulary(data['term_bytes'], data['term_offsets'])
+        else:
+            # Indexes written before the byte vocabulary
+            terms = Vocabulary.from_terms(data['terms'].tolist())
+        return cls(terms, data['offsets'], data['postings'], data['freqs'], data['unit_doc'],
+                   data['unit_chunk'], data['unit_len'], int(data['num_docs']), int(data['generation']))
+
+    def _term_id(self, term):
+        return self.terms.index(term)
+
+    def doc_freq(self, term):
+        """Number of units containing `term`."""
+        i = self._term_id(term)
+        return 0 if i is None else int(self.offsets[i + 1] - self.offsets[i])
+
+    def unit_scores(self, query, stats=None):
+        """BM25 score of every unit for a query string.
+
+        `stats` = (units, mean unit length, {term: units containing it}) replaces
+        this index's own collection statistics, so the shards of a knowledge
+        base score exactly as one index over all of them would (see shards.py).
+        """
+        scores = np.zeros(self.num_units, dtype=np.float64)
+        if not self.num_units:
+            return scores
+        num_units, avg_len, doc_freqs = stats or (self.num_units, self.avg_len, None)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.unit_len / max(avg_len, 1e-9))
+        for term in set(tokenize(query)):
+            i = self._term_id(term)
+            if i is None:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            units, tf = self.postings[start:end], self.freqs[start:end]
+            df = len(units) if doc_freqs is None else doc_freqs[term]
+            idf = np.log(1 + (num_units - df + 0.5) / (df + 0.5))
+            scores += np.bincount(units, weights=idf * tf * (BM25_K1 + 1) / (tf + norm[units]),
+                                  minlength=self.num_units)
+        return scores
+
+    def score(self, query, docs=None, stats=None):
+        """(best BM25 score per document, chunk index of that unit); 0.0 means no match.
+
+        `docs` restricts scoring to a sorted array of document ids; `stats` as in unit_scores.
+        """
+        scores = self.unit_scores(query, stats=stats)
+        if docs is not None:
+            keep = np.zeros(self.num_docs, dtype=bool)
+            keep[docs] = True
+            scores[~keep[self.unit_doc]] = 0.0
+        best = np.zeros(self.num_docs, dtype=np.float64)
+        best_chunk = np.zeros(self.num_docs, dtype=np.int64)
+        hit = np.flatnonzero(scores > 0)
+        if len(hit):
+            # Visit hits by ascending score so each document keeps its best unit
+            order = hit[np.argsort(scores[hit], kind='stable')]
+            best[self.unit_doc[order]] = scores[order]
+            best_chunk[self.unit_doc[order]] = self.unit_chunk[order]
+        return best, best_chunk
+
+
+def write_index(store_dir, meta, records):
+    """Build the BM25 index for a store generation from its records and register it in meta['files']."""
+    index = LexicalIndex.build(units_from_records(records), len(records), generation=meta['generation'])
+    filename = artifact_name('lexical', meta['generation'], 'npz')
+    index.save(os.path.join(store_dir, filename))
+    meta.setdefault('files', {})[INDEX_FILE] = filename
+    return index
+
+
+def load_index(store):
+    """The BM25 index registered with a store, built in memory if absent or stale."""
+    path = store.artifact_path(INDEX_FILE)
+    if path is not None and os.path.exists(path):
+        index = LexicalIndex.load(path)
+        if index.generation == store.generation:
+            return index
+        logging.warning(f"Ignoring stale {path} (generation {index.generation} != {store.generation})")
+    return LexicalIndex.build(units_from_store(store), len(store.docs), generation=store.generation)
+
+
+def fuse_rrf(rankings, num_docs, k=RRF_K):
+    """Reciprocal rank fusion of ranked document-id arrays; returns a fused score per document (0 if unranked)."""
+    fused = np.zeros(num_docs, dtype=np.float64)
+    for ranking in rankings:
+        fused[ranking] += 1.0 / (k + np.arange(1, len(ranking) + 1))
+    return fused
@@ -0,0 +1,222 @@
+"""
+Open-loop load driver that replays query logs against a running app.
+
+Queries are read from log files: JSON lines with a ``q``, ``query`` or
+``title`` field (``--field`` picks another; a ``path`` field is requested
+as-is), or plain text lines, one query each (lines starting with ``/`` are
+paths). They are sent at a fixed target rate, independent of how fast
+responses come back, so latency is measured from each request's scheduled
+start and queueing inside the app is not hidden.
+
+The report covers achieved throughput, p50/p95/p99/max latency, status counts
+and error rate, with 429s (the limiter's 200/minute global and 60/minute
+/search caps) counted separately from failures.
+
+With ``--spawn`` the driver starts fake_openai's HTTP server and app.py
+itself, wired together through OPENAI_BASE_URL, so a capacity test needs
+neither an API key nor money:
+
+    python loadtest.py --spawn --log requests.jsonl --qps 20 --duration 60 --latency 0.08
+    python loadtest.py --url http://127.0.0.1:5000 --log queries.txt --qps 5 --out run.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+QUERY_FIELDS = ('q', 'query', 'title')
+
+
+def load_paths(files, field=None, template='/search?q={q}'):
+    """Request paths from query log files (JSON lines or plain text)."""
+    paths = []
+    for name in files:
+        with open(name, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = line
+                if isinstance(record, dict):
+                    if record.get('path'):
+                        paths.append(record['path'])
+                        continue
+                    fields = (field,) if field else QUERY_FIELDS
+                    query = next((record[k] for k in fields if isinstance(record.get(k), str)), None)
+                else:
+                    query = str(record)
+                if not query:
+                    continue
+                if query.startswith('/'):
+                    paths.append(query)
+                else:
+                    paths.append(template.format(q=urllib.parse.quote(query.strip())))
+    return paths
+
+
+class LoadResult:
+    """Thread-safe collection of (latency, status) samples."""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def add(self, latency, status):
+        with self._lock:
+            self.latencies.append(latency)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self, elapsed):
+        ms = np.asarray(self.latencies) * 1000
+        total = len(ms)
+        ok = sum(n for s, n in self.statuses.items() if isinstance(s, int) and s < 400)
+        limited = self.statuses.get(429, 0)
+        report = {
+            'requests': total,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(total / elapsed, 2) if elapsed else 0.0,
+            'ok_rps': round(ok / elapsed, 2) if elapsed else 0.0,
+            'statuses': {str(k): v for k, v in sorted(self.statuses.items(), key=lambda kv: str(kv[0]))},
+            'error_rate': round((total - ok - limited) / total, 4) if total else 0.0,
+            'rate_limited_rate': round(limited / total, 4) if total else 0.0,
+        }
+        if total:
+            for p in (50, 95, 99):
+                report[f'p{p}_ms'] = round(float(np.percentile(ms, p)), 2)
+            report['max_ms'] = round(float(ms.max()), 2)
+        return report
+
+
+def run_load(base_url, paths, qps, duration=None, max_requests=None, concurrency=64, timeout=30.0, shuffle=False,
+             seed=0):
+    """Replay `paths` (cycling) at `qps` requests per second; returns a summary dict."""
+    if shuffle:
+        paths = paths[:]
+        random.Random(seed).shuffle(paths)
+    total = max_requests or int(qps * (duration or 60))
+    result = LoadResult()
+
+    def fire(path, scheduled):
+        status = 'error'
+        try:
+            with urllib.request.urlopen(base_url.rstrip('/') + path, timeout=timeout) as resp:
+                resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception as e:
+            status = type(e).__name__
+        result.add(time.perf_counter() - scheduled, status)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(total):
+            scheduled = start + i / qps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, paths[i % len(paths)], scheduled)
+    report = result.summary(time.perf_counter() - start)
+    report['target_qps'] = qps
+    return report
+
+
+def wait_until_up(url, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2) as resp:
+                if resp.status == 200:
+                    return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def spawn_stack(args):
+    """Start the fake embeddings server in-process and app.py as a child; returns (base_url, app_process, server)."""
+    import fake_openai
+
+    server = fake_openai.serve(port=0, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                               rate_limit_rate=args.rate_limit_rate)
+    env = dict(os.environ, OPENAI_BASE_URL=server.base_url, OPENAI_API_KEY='fake', PORT=str(args.app_port),
+               FLASK_ENV='production', LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING'))
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    # The werkzeug access log would drown the report; keep it in a file if asked for
+    log = open(args.app_log, 'w') if args.app_log else subprocess.DEVNULL
+    proc = subprocess.Popen([sys.executable, 'app.py'], cwd=app_dir, env=env, stdout=log, stderr=log)
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    try:
+        wait_until_up(base_url + '/')
+    except Exception:
+        proc.terminate()
+        raise
+    logging.info(f"Started app.py at {base_url} against fake embeddings at {server.base_url}")
+    return base_url, proc, server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay query logs against the app at a target rate")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="app base URL (ignored with --spawn)")
+    parser.add_argument('--log', nargs='+', required=True, help="query log files (JSON lines or plain text)")
+    parser.add_argument('--field', default=None, help=f"JSON field holding the query (default: {', '.join(QUERY_FIELDS)})")
+    parser.add_argument('--template', default='/search?q={q}', help="path for plain queries, e.g. /tags?q={q}")
+    parser.add_argument('--qps', type=float, default=5.0)
+    parser.add_argument('--duration', type=float, default=60.0, help="seconds (unless --requests)")
+    parser.add_argument('--requests', type=int, default=None)
+    parser.add_argument('--concurrency', type=int, default=64, help="maximum requests in flight")
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--shuffle', action='store_true')
+    parser.add_argument('--out', default=None, help="also write the JSON report here")
+    spawn = parser.add_argument_group('--spawn: run app.py against a local fake embeddings server')
+    spawn.add_argument('--spawn', action='store_true')
+    spawn.add_argument('--app-port', type=int, default=5055)
+    spawn.add_argument('--app-log', default=None, help="write the app's output to this file")
+    spawn.add_argument('--latency', type=float, default=0.08, help="fake upstream latency (s)")
+    spawn.add_argument('--jitter', type=float, default=0.04, help="extra random upstream latency, up to (s)")
+    spawn.add_argument('--error-rate', type=float, default=0.0, help="fraction of upstream 500s")
+    spawn.add_argument('--rate-limit-rate', type=float, default=0.0, help="fraction of upstream 429s")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+    paths = load_paths(args.log, field=args.field, template=args.template)
+    if not paths:
+        logging.error("No queries found in the given logs")
+        sys.exit(1)
+    proc = server = None
+    base_url = args.url
+    if args.spawn:
+        base_url, proc, server = spawn_stack(args)
+    try:
+        logging.info(f"Replaying {len(paths)} queries at {args.qps} req/s against {base_url}")
+        report = run_load(base_url, paths, args.qps, duration=args.duration, max_requests=args.requests,
+                          concurrency=args.concurrency, timeout=args.timeout, shuffle=args.shuffle)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+    if server is not None:
+        report['upstream'] = {'requests': server.requests, 'inputs': server.inputs, 'errors': server.errors}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
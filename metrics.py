@@ -0,0 +1,167 @@
+"""
+Minimal Prometheus-style metrics without extra dependencies.
+
+Histograms and counters live in a Registry and are rendered in the Prometheus
+text exposition format for a /metrics endpoint. Values that are already
+counted elsewhere (cache hit/miss counters, batcher stats) are pulled at
+scrape time through collector callbacks instead of being mirrored.
+
+`StageTimer` times the stages of one request: every stage is observed in a
+histogram and also kept for the request's ``Server-Timing`` header:
+
+    timer = StageTimer(STAGE_SECONDS)
+    with timer.stage('score'):
+        ...
+    resp.headers['Server-Timing'] = timer.header()
+
+Metrics are per process; with several workers each one reports its own.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # An unlabeled counter reports 0 before its first increment
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    out.append((f"{self.name}_bucket",
+                                _format_labels(self.labelnames, key, [('le', _format_value(bound))]), cumulative))
+                out.append((f"{self.name}_bucket", _format_labels(self.labelnames, key, [('le', '+Inf')]), count))
+                out.append((f"{self.name}_sum", _format_labels(self.labelnames, key), total))
+                out.append((f"{self.name}_count", _format_labels(self.labelnames, key), count))
+        return out
+
+
+class Registry:
+    """Metrics plus scrape-time collectors, rendered as Prometheus text."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, fn):
+        """Register fn() -> iterable of (name, kind, help, [(labels_dict, value), ...])."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in metric.samples())
+        for fn in self._collectors:
+            for name, kind, help, values in fn():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values:
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """Times the stages of one request into a histogram and a Server-Timing header."""
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram
+        self.started = time.perf_counter()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def record(self, name, seconds):
+        self.stages.append((name, seconds))
+        if self.histogram is not None:
+            self.histogram.observe(seconds, stage=name)
+
+    def header(self, total=True):
+        """Server-Timing value, e.g. ``embed;dur=12.3, score;dur=0.8, total;dur=14.0`` (milliseconds)."""
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages]
+        if total:
+            parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ', '.join(parts)
@@ -0,0 +1,295 @@
+"""
+Quantized chunk codes for a cheap first search pass with exact re-ranking.
+
+Three code types can be written next to a store generation, one file each
+(``quant-<kind>-<gen>.npz``), so a build can carry several:
+
+- ``int8``:   every unit vector scaled by its own max |x| / 127 and rounded,
+              1 byte per dimension plus one float32 scale per row (~4x smaller
+              than float32)
+- ``binary``: the sign of every dimension packed into bits, compared by
+              Hamming distance (32x smaller than float32)
+- ``prefix``: the first `prefix_dim` dimensions, renormalized. text-embedding-3
+              vectors are Matryoshka-trained, so a leading slice is itself a
+              usable embedding (256 of 1536 dimensions: 6x smaller and faster)
+
+A query scores every chunk on the codes, keeps the best `rerank` rows and
+only those are rescored exactly against the float32 vectors, so the full
+matrix is never read per query (for memory-mapped stores it need not even be
+resident). Binary and prefix codes are also faster to scan. NumPy has no int8
+matrix kernel (integer matmul and einsum with int32 accumulation are no faster
+than the float32 scan), so int8 only saves memory: the app searches int8
+codes only when asked to (SEARCH_QUANT=int8), see FAST_KINDS. With several
+kinds built, the first enabled one is searched (`load_codes`). Codes combine
+with the IVF index: the shortlist is then taken from the probed lists.
+`report` measures recall@k of the document ranking against exact search, code
+size and latency.
+
+Usage:
+    python quantize.py build  [--kind int8|binary|prefix] [--prefix-dim 256]   (add one kind to embeddings/)
+    python quantize.py report [--synthetic N] [--k 10] [--queries 200]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+from search_engine import normalize_rows, normalize_vector
+from vector_store import artifact_name, load_npz, write_meta
+
+INDEX_FILE = 'quant'
+KINDS = ('int8', 'binary', 'prefix')
+# Codes whose first pass is faster than the exact float32 scan
+FAST_KINDS = ('binary', 'prefix')
+DEFAULT_RERANK = 512
+DEFAULT_PREFIX_DIM = 256
+
+# Rows per block while quantizing and Hamming-scoring
+_SCORE_BATCH = 16384
+# int8 rows upcast per block for the dot product; small enough to stay in cache
+_DECODE_BATCH = 256
+# Bits set per byte, for NumPy < 2 (no np.bitwise_count)
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1, dtype=np.uint8)
+_bitwise_count = getattr(np, 'bitwise_count', None) or _POPCOUNT.__getitem__
+
+
+def quantize_int8(vectors):
+    """(codes, scales) with vectors[i] ~= codes[i] * scales[i]."""
+    codes = np.empty(vectors.shape, dtype=np.int8)
+    scales = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), _SCORE_BATCH):
+        block = np.asarray(vectors[start:start + _SCORE_BATCH], dtype=np.float32)
+        peak = np.abs(block).max(axis=1) if block.shape[1] else np.zeros(len(block), dtype=np.float32)
+        scale = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+        codes[start:start + len(block)] = np.rint(block / scale[:, None]).astype(np.int8)
+        scales[start:start + len(block)] = scale
+    return codes, scales
+
+
+def binary_codes(vectors):
+    """Sign bits of every row, packed 8 dimensions per byte."""
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+
+def prefix_codes(vectors, dim=DEFAULT_PREFIX_DIM):
+    """First `dim` dimensions of every row, renormalized to unit length."""
+    codes = np.empty((len(vectors), min(dim, vectors.shape[1])), dtype=np.float32)
+    for start in range(0, len(vectors), _SCORE_BATCH):
+        codes[start:start + _SCORE_BATCH] = normalize_rows(vectors[start:start + _SCORE_BATCH, :codes.shape[1]])
+    return codes
+
+
+class QuantizedIndex:
+    """Compressed copies of the chunk vectors; row `i` codes chunk row `i` of the store."""
+
+    def __init__(self, kind, codes, scales=None, generation=0):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown quantization: {kind}")
+        self.kind = kind
+        self.codes = codes
+        self.scales = scales
+        self.generation = generation
+
+    @classmethod
+    def build(cls, vectors, kind='int8', generation=0, prefix_dim=DEFAULT_PREFIX_DIM):
+        if kind == 'binary':
+            return cls(kind, binary_codes(vectors), generation=generation)
+        if kind == 'prefix':
+            return cls(kind, prefix_codes(vectors, prefix_dim), generation=generation)
+        codes, scales = quantize_int8(vectors)
+        return cls(kind, codes, scales, generation=generation)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def save(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, kind=np.array(self.kind), codes=self.codes,
+                     scales=self.scales if self.scales is not None else np.empty(0, dtype=np.float32),
+                     generation=np.int64(self.generation))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        data = load_npz(path)
+        kind = str(data['kind'])
+        scales = data['scales'] if kind == 'int8' else None
+        return cls(kind, data['codes'], scales, int(data['generation']))
+
+    def approx_scores(self, query, rows=None):
+        """First-pass score of a unit query against every row (or `rows`); higher is closer."""
+        codes = self.codes if rows is None else self.codes[rows]
+        scores = np.empty(len(codes), dtype=np.float32)
+        if self.kind == 'binary':
+            bits = np.packbits(np.asarray(query) > 0)
+            for start in range(0, len(codes), _SCORE_BATCH):
+                block = codes[start:start + _SCORE_BATCH]
+                scores[start:start + len(block)] = -_bitwise_count(block ^ bits).sum(axis=1, dtype=np.int32)
+            return scores
+        if self.kind == 'prefix':
+            q = normalize_vector(np.asarray(query)[:self.codes.shape[1]])
+            for start in range(0, len(codes), _SCORE_BATCH):
+                scores[start:start + _SCORE_BATCH] = codes[start:start + _SCORE_BATCH] @ q
+            return scores
+        scales = self.scales if rows is None else self.scales[rows]
+        for start in range(0, len(codes), _DECODE_BATCH):
+            block = np.asarray(codes[start:start + _DECODE_BATCH], dtype=np.float32)
+            scores[start:start + len(block)] = (block @ query) * scales[start:start + len(block)]
+        return scores
+
+    def shortlist(self, query, k=DEFAULT_RERANK, rows=None):
+        """Sorted rows of the `k` best first-pass scores, among `rows` (sorted) if given."""
+        scores = self.approx_scores(query, rows)
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        picked = top if rows is None else rows[top]
+        return np.sort(picked)
+
+
+def codes_file(kind):
+    """meta['files'] key of one code type; each kind has its own file, so several can be built."""
+    return f"{INDEX_FILE}-{kind}"
+
+
+def write_codes(store_dir, meta, chunk_vectors, kind='int8', prefix_dim=DEFAULT_PREFIX_DIM):
+    """Quantize a store generation's chunk vectors and register the codes in meta['files'].
+
+    Codes of other kinds already registered are kept. Each kind (and its
+    dimensions) is recorded in meta['quantize'] too, so tools can tell what the
+    app will search with without opening the files.
+    """
+    index = QuantizedIndex.build(chunk_vectors, kind=kind, generation=meta['generation'], prefix_dim=prefix_dim)
+    filename = artifact_name(codes_file(kind), meta['generation'], 'npz')
+    index.save(os.path.join(store_dir, filename))
+    meta.setdefault('files', {})[codes_file(kind)] = filename
+    recorded = meta.get('quantize') or {}
+    if 'kind' in recorded:
+        # One-kind record from older builds
+        recorded = {recorded['kind']: {'dim': recorded.get('dim')}}
+    recorded[kind] = {'dim': int(index.codes.shape[1]) if kind == 'prefix' else meta.get('dim')}
+    meta['quantize'] = recorded
+    return index
+
+
+def _codes_path(store, kind):
+    path = store.artifact_path(codes_file(kind))
+    if path is None and (store.meta.get('quantize') or {}).get('kind') == kind:
+        # Older builds registered their single code file as 'quant'
+        path = store.artifact_path(INDEX_FILE)
+    return path
+
+
+def built_kinds(store):
+    """Code types registered with a store, read from meta.json only."""
+    return [kind for kind in KINDS if _codes_path(store, kind)]
+
+
+def load_codes(store, kinds=KINDS):
+    """Load the first of `kinds` whose codes are registered with a store, or None if none is (fresh)."""
+    for kind in kinds:
+        path = _codes_path(store, kind)
+        if path is None or not os.path.exists(path):
+            continue
+        index = QuantizedIndex.load(path)
+        if index.generation != store.generation:
+            logging.warning(f"Ignoring stale {path} (generation {index.generation} != {store.generation})")
+            continue
+        return index
+    skipped = [kind for kind in built_kinds(store) if kind not in kinds]
+    if skipped:
+        logging.info(f"Not searching {', '.join(skipped)} codes (enabled: {', '.join(kinds) or 'none'})")
+    return None
+
+
+def recall_report(engine, kinds=KINDS, reranks=(32, 128, 512, 2048), k=10, n_queries=200, seed=0,
+                  prefix_dim=DEFAULT_PREFIX_DIM):
+    """Recall@k of quantized + re-ranked document rankings against exact search, with code size and latency."""
+    from search_engine import SearchEngine
+
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(len(engine.vectors), size=n_queries)
+    noise = rng.normal(size=(n_queries, engine.dim)).astype(np.float32) * (0.5 / np.sqrt(engine.dim))
+    queries = normalize_rows(np.asarray(engine.vectors[rows]) + noise)
+
+    def top_docs(best):
+        k_eff = min(k, len(best))
+        return set(np.argpartition(-best, k_eff - 1)[:k_eff].tolist())
+
+    def timed(fn):
+        results, times = [], []
+        for q in queries:
+            t0 = time.perf_counter()
+            best, _ = fn(q)
+            times.append((time.perf_counter() - t0) * 1000)
+            results.append(top_docs(best))
+        return results, np.array(times)
+
+    exact = SearchEngine(engine.vectors, engine.doc_offsets)
+    truth, exact_ms = timed(exact.score)
+    report = [{'mode': 'exact', 'rerank': None, 'recall': 1.0, 'bytes': int(np.asarray(engine.vectors).nbytes),
+               'p50_ms': float(np.percentile(exact_ms, 50)), 'p95_ms': float(np.percentile(exact_ms, 95))}]
+    for kind in kinds:
+        index = QuantizedIndex.build(engine.vectors, kind=kind, prefix_dim=prefix_dim)
+        approx = SearchEngine(engine.vectors, engine.doc_offsets, quantized=index)
+        for rerank in reranks:
+            found, ms = timed(lambda q: approx.score(q, rerank=rerank))
+            recall = float(np.mean([len(f & t) / len(t) for f, t in zip(found, truth)]))
+            report.append({'mode': kind, 'rerank': rerank, 'recall': recall, 'bytes': index.nbytes,
+                           'p50_ms': float(np.percentile(ms, 50)), 'p95_ms': float(np.percentile(ms, 95))})
+    return report
+
+
+def main():
+    from ann_index import _synthetic_corpus
+    from search_engine import SearchEngine
+    from vector_store import STORE_DIR, load_store
+
+    parser = argparse.ArgumentParser(description="Build or evaluate quantized chunk codes")
+    parser.add_argument('command', choices=['build', 'report'])
+    parser.add_argument('--store', default=STORE_DIR)
+    parser.add_argument('--kind', choices=KINDS, default='int8')
+    parser.add_argument('--prefix-dim', type=int, default=DEFAULT_PREFIX_DIM)
+    parser.add_argument('--synthetic', type=int, default=0, help="report on N synthetic chunks instead of the store")
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+    if args.synthetic:
+        vectors, offsets = _synthetic_corpus(args.synthetic, args.dim)
+        engine = SearchEngine(vectors, offsets)
+    else:
+        store = load_store(args.store, legacy_path=None)
+        if store is None:
+            logging.error(f"No store found in {args.store}/. Run build.py first.")
+            sys.exit(1)
+        engine = SearchEngine.from_store(store)
+
+    if args.command == 'build':
+        if args.synthetic:
+            logging.error("build needs a real store; use report with --synthetic")
+            sys.exit(1)
+        t0 = time.perf_counter()
+        index = write_codes(args.store, store.meta, store.chunk_vectors, kind=args.kind, prefix_dim=args.prefix_dim)
+        write_meta(args.store, store.meta)
+        logging.info(f"Wrote {store.artifact_path(codes_file(args.kind))} ({args.kind}, {index.nbytes:,} bytes for "
+                     f"{len(index):,} chunks in {time.perf_counter() - t0:.2f}s)")
+        return
+
+    print(f"{'mode':<6} {'rerank':>6} {'recall@' + str(args.k):>10} {'MB':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in recall_report(engine, k=args.k, n_queries=args.queries, prefix_dim=args.prefix_dim):
+        print(f"{row['mode']:<6} {str(row['rerank'] or '-'):>6} {row['recall']:>10.3f} "
+              f"{row['bytes'] / 2**20:>8.2f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
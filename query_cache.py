@@ -0,0 +1,246 @@
+"""
+Query-embedding and search-results caches shared across workers.
+
+A QueryCache is a namespaced view over a byte-valued backend:
+
+- ``MemoryBackend``: per-process LRU, what the app used before.
+- ``SQLiteBackend``: one database file that every worker on the host reads and
+  writes, and that survives restarts and cold starts on the same machine.
+
+Entries carry a TTL and the SQLite backend is kept under a byte budget by
+evicting expired entries first, then the least recently used ones. Reads only
+write when an entry's last use is more than TOUCH_INTERVAL seconds old, so
+hot keys do not take SQLite's write lock on every hit. Keys are
+hashes of their parts, so callers put everything the value depends on (model,
+knowledge-base generation, request parameters) into the key. Each QueryCache
+counts hits and misses for its own process.
+
+Backend errors (a locked or unwritable database) are logged and treated as
+misses; the cache never fails a request.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from cachetools import LRUCache
+
+# A per-user cache directory rather than the world-writable temp directory,
+# where another local user could create or poison the file first
+DEFAULT_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                            'mindsynth', 'query-cache.sqlite')
+DEFAULT_MAX_MB = 64
+
+
+def make_key(*parts):
+    return hashlib.sha256('\0'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU of key -> (expires_at, bytes)."""
+
+    def __init__(self, maxsize=512):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        with self._lock:
+            return {'backend': 'memory', 'entries': len(self._entries)}
+
+
+class SQLiteBackend:
+    """SQLite table of key -> bytes with expiry and last-use times, safe to share between processes.
+
+    Connections are opened lazily per process, so a backend created before a
+    fork (e.g. gunicorn --preload) is still safe to use in the workers.
+    """
+
+    PRUNE_EVERY = 64
+    # Recency for LRU eviction only needs minute resolution
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path=DEFAULT_PATH, max_mb=DEFAULT_MAX_MB):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._writes = 0
+
+    def _conn(self):
+        if self._db is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', mode=0o700, exist_ok=True)
+            # Owner-only; SQLite gives its -wal and -shm files the same mode
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+            db = sqlite3.connect(self.path, timeout=1.0, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            row = db.execute("SELECT value, expires, last_used FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                return None
+            if now - row[2] > self.TOUCH_INTERVAL:
+                db.execute("UPDATE cache SET last_used = ? WHERE key = ?", (now, key))
+                db.commit()
+            return row[0]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (key, value, now + ttl, now))
+            db.commit()
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune(db, now)
+
+    def _prune(self, db, now):
+        """Drop expired entries, then least recently used ones beyond the byte budget."""
+        db.execute("DELETE FROM cache WHERE expires < ?", (now,))
+        rows = db.execute("SELECT key, length(value) FROM cache ORDER BY last_used DESC").fetchall()
+        kept = 0
+        evict = []
+        for key, size in rows:
+            kept += size
+            if kept > self.max_bytes:
+                evict.append((key,))
+        if evict:
+            db.executemany("DELETE FROM cache WHERE key = ?", evict)
+            logging.info(f"Query cache: evicted {len(evict)} least recently used entries")
+        db.commit()
+
+    def clear(self):
+        with self._lock:
+            db = self._conn()
+            db.execute("DELETE FROM cache")
+            db.commit()
+
+    def info(self):
+        with self._lock:
+            entries, size = self._conn().execute("SELECT count(*), coalesce(sum(length(value)), 0) FROM cache").fetchone()
+        return {'backend': 'sqlite', 'path': self.path, 'entries': entries, 'bytes': size}
+
+
+def open_backend(kind='sqlite', path=DEFAULT_PATH, max_mb=DEFAULT_MAX_MB, maxsize=512):
+    """Backend by name; falls back to memory if the SQLite file cannot be opened."""
+    if kind == 'sqlite':
+        backend = SQLiteBackend(path, max_mb=max_mb)
+        try:
+            backend._conn()
+            return backend
+        except (sqlite3.Error, OSError) as e:
+            logging.warning(f"Query cache: cannot open {path} ({e}); using a per-process memory cache")
+    elif kind != 'memory':
+        raise ValueError(f"Unknown query cache backend: {kind}")
+    return MemoryBackend(maxsize=maxsize)
+
+
+def encode_vector(vector):
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def decode_vector(value):
+    return np.frombuffer(value, dtype=np.float32)
+
+
+def encode_json(payload):
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def decode_json(value):
+    return json.loads(value)
+
+
+class QueryCache:
+    """Namespaced, TTL'd view over a backend with per-process hit/miss counters."""
+
+    def __init__(self, backend, namespace, ttl, encode=encode_json, decode=decode_json):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.encode = encode
+        self.decode = decode
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        # Counters are shared by the worker's request threads
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def key(self, *parts):
+        return make_key(self.namespace, *parts)
+
+    def get(self, key):
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            self._count('errors')
+            logging.warning(f"Query cache ({self.namespace}) read failed: {e}")
+            value = None
+        if value is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return self.decode(value)
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, self.encode(value), self.ttl)
+        except Exception as e:
+            self._count('errors')
+            logging.warning(f"Query cache ({self.namespace}) write failed: {e}")
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {'namespace': self.namespace, 'hits': self.hits, 'misses': self.misses,
+                'errors': self.errors, 'hit_ratio': round(self.hit_ratio(), 4)}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Inspect or clear the shared query cache")
+    parser.add_argument('command', choices=['info', 'clear'])
+    parser.add_argument('--path', default=os.environ.get("QUERY_CACHE_PATH", DEFAULT_PATH))
+    args = parser.parse_args()
+    backend = SQLiteBackend(args.path)
+    if args.command == 'clear':
+        backend.clear()
+    print(json.dumps(backend.info()))
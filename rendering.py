@@ -0,0 +1,49 @@
+"""
+Markdown -> sanitized HTML rendering shared by the app and the build.
+
+build.py pre-renders every document so /content serves stored HTML instead of
+running markdown and bleach per request. RENDER_VERSION is recorded in the
+store; bump it whenever the allow-list or markdown settings change so stale
+pre-rendered HTML is ignored and rendered afresh.
+
+markdown and bleach are imported on first use: the app only needs them for
+builds without pre-rendered HTML, and skipping them shortens cold starts.
+"""
+import hashlib
+import json
+
+RENDER_VERSION = 1
+
+
+def allowed_html():
+    tags = [
+        'p','ul','ol','li','strong','em','code','pre','a','blockquote','h1','h2','h3','h4','h5','h6','div','span','br'
+    ]
+    attrs = {
+        'a': ['href','title','target','rel'],
+        'blockquote': ['class','data-dnt','data-theme','align'],
+        'div': ['class'],
+        'span': ['class']
+    }
+    return tags, attrs
+
+
+def render_html(content):
+    """Render markdown content and sanitize it for the content panel."""
+    import markdown
+    import bleach
+
+    html_content = markdown.markdown(content)
+    tags, attrs = allowed_html()
+    return bleach.clean(html_content, tags=tags, attributes=attrs, strip=True)
+
+
+def content_etag(doc, content):
+    """Strong validator for a /content response, derived from the build's content_hash.
+
+    Legacy documents without a content_hash are validated on the content itself.
+    """
+    content_hash = doc.get('content_hash') or hashlib.sha256(content.encode('utf-8')).hexdigest()
+    parts = [RENDER_VERSION, content_hash, doc.get('title'), doc.get('tags'),
+             doc.get('is_url'), doc.get('source_url')]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()[:32]
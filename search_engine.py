@@ -0,0 +1,179 @@
+"""
+Vectorized scoring engine for the knowledge base.
+
+All chunk embeddings are packed once into a contiguous, L2-normalized float32
+matrix together with a chunk -> document offset table, so scoring a query is a
+single matrix-vector product followed by a per-document max-reduce. float16
+stores stay memory-mapped as float16 and are upcast a block at a time.
+"""
+import numpy as np
+
+# Rows of a float16 matrix upcast at once while scoring
+_UPCAST_BATCH = 16384
+
+
+def normalize_rows(matrix):
+    """Return a float32 copy of `matrix` with unit-length rows (zero rows stay zero)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def normalize_vector(vector):
+    """Return a float32 unit vector (or the zero vector unchanged)."""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+def matvec(matrix, q):
+    """float32 `matrix @ q`; float16 rows are converted per block, never as a whole copy."""
+    if matrix.dtype == np.float32:
+        return matrix @ q
+    out = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), _UPCAST_BATCH):
+        out[start:start + _UPCAST_BATCH] = np.asarray(matrix[start:start + _UPCAST_BATCH], dtype=np.float32) @ q
+    return out
+
+
+def top_k(keys, k):
+    """Positions of the `k` largest keys in descending order, ties in position order.
+
+    Same result as ``np.argsort(-keys, kind='stable')[:k]`` but only the
+    selected prefix is sorted (argpartition, then a small stable sort).
+    """
+    keys = np.asarray(keys)
+    if k >= len(keys):
+        return np.argsort(-keys, kind='stable')
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    threshold = keys[np.argpartition(-keys, k - 1)[k - 1]]
+    above = np.flatnonzero(keys > threshold)
+    ties = np.flatnonzero(keys == threshold)[:k - len(above)]
+    selected = np.sort(np.concatenate([above, ties]))
+    return selected[np.argsort(-keys[selected], kind='stable')]
+
+
+class SearchEngine:
+    """Scores a query against every chunk and reduces to one best chunk per document.
+
+    `vectors` is an (n_chunks, dim) matrix of unit rows; the chunks of document
+    `d` are rows `doc_offsets[d]:doc_offsets[d + 1]`. Documents without any
+    vector score -1.0, matching the behaviour of the original per-chunk loop.
+
+    With an `ann` index (see ann_index.IVFIndex) only the candidate chunks it
+    returns are scored; documents without candidates score -1.0 as well.
+    With `quantized` codes (see quantize.QuantizedIndex) candidates are first
+    scored on the codes and only the best `rerank` are scored exactly.
+    """
+
+    def __init__(self, vectors, doc_offsets, ann=None, quantized=None):
+        self.vectors = vectors
+        self.ann = ann
+        self.quantized = quantized
+        self.doc_offsets = np.asarray(doc_offsets, dtype=np.int64)
+        self.doc_counts = np.diff(self.doc_offsets)
+        self.chunk_doc = np.repeat(np.arange(len(self.doc_counts), dtype=np.int32), self.doc_counts)
+        self._has_rows = self.doc_counts > 0
+        self._row_starts = self.doc_offsets[:-1][self._has_rows]
+
+    @classmethod
+    def from_store(cls, store, ann=None, quantized=None):
+        """Score a VectorStore's chunk vectors in place (float32 or float16, no copy).
+
+        Documents embedded without chunks are scored on their document vector,
+        which requires packing a combined matrix; builds never produce these.
+        """
+        counts = np.diff(store.chunk_offsets)
+        fallback = (counts == 0) & np.array([bool(d.get('has_embedding')) for d in store.docs], dtype=bool)
+        if not fallback.any():
+            return cls(store.chunk_vectors, store.chunk_offsets, ann=ann, quantized=quantized)
+        rows = []
+        for doc_id in range(len(store.docs)):
+            if fallback[doc_id]:
+                rows.append(store.doc_vectors[doc_id:doc_id + 1])
+            else:
+                rows.append(store.chunk_vectors[store.chunk_offsets[doc_id]:store.chunk_offsets[doc_id + 1]])
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(r) for r in rows], out=offsets[1:])
+        # Row numbers no longer match the store, so a prebuilt ANN index or codes cannot be used
+        return cls(np.concatenate(rows).astype(np.float32, copy=False), offsets)
+
+    @property
+    def num_docs(self):
+        return len(self.doc_counts)
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def chunk_similarities(self, query_embedding):
+        """Cosine similarity of the query against every chunk."""
+        q = normalize_vector(query_embedding)
+        return matvec(self.vectors, q)
+
+    def reduce_best(self, sims):
+        """Per-document max of chunk scores and the (document-local) index of the first best chunk."""
+        best = np.full(self.num_docs, -1.0, dtype=np.float32)
+        best_chunk = np.zeros(self.num_docs, dtype=np.int64)
+        if not len(sims):
+            return best, best_chunk
+        best[self._has_rows] = np.maximum.reduceat(sims, self._row_starts)
+        hit_rows = np.flatnonzero(sims == best[self.chunk_doc])
+        docs, first = np.unique(self.chunk_doc[hit_rows], return_index=True)
+        best_chunk[docs] = hit_rows[first] - self.doc_offsets[docs]
+        return best, best_chunk
+
+    def reduce_rows(self, rows, sims):
+        """Like reduce_best, but for scores of a sorted subset of chunk rows."""
+        best = np.full(self.num_docs, -1.0, dtype=np.float32)
+        best_chunk = np.zeros(self.num_docs, dtype=np.int64)
+        if not len(rows):
+            return best, best_chunk
+        docs = self.chunk_doc[rows]
+        new_doc = np.empty(len(docs), dtype=bool)
+        new_doc[0] = True
+        np.not_equal(docs[1:], docs[:-1], out=new_doc[1:])
+        starts = np.flatnonzero(new_doc)
+        seg_max = np.maximum.reduceat(sims, starts)
+        segment = np.cumsum(new_doc) - 1
+        hits = np.flatnonzero(sims == seg_max[segment])
+        seg_hit, first = np.unique(segment[hits], return_index=True)
+        seg_docs = docs[starts]
+        best[seg_docs] = seg_max
+        best_chunk[seg_docs[seg_hit]] = rows[hits[first]] - self.doc_offsets[seg_docs[seg_hit]]
+        return best, best_chunk
+
+    def rows_for_docs(self, doc_ids):
+        """Sorted chunk rows belonging to sorted `doc_ids`."""
+        counts = self.doc_counts[doc_ids]
+        shift = self.doc_offsets[doc_ids] - (np.cumsum(counts) - counts)
+        return np.repeat(shift, counts) + np.arange(int(counts.sum()), dtype=np.int64)
+
+    def score(self, query_embedding, nprobe=None, exact=False, docs=None, rerank=None):
+        """Return (best_similarity, best_chunk_index) arrays with one entry per document.
+
+        With no query embedding every document that has vectors scores 0.0 and
+        its first chunk is reported, as the tag-only search path expects. The
+        ANN index and quantized codes are used unless `exact` is set; `nprobe`
+        and `rerank` (chunks rescored exactly) tune their recall.
+        `docs` (sorted ids, e.g. from a tag filter) restricts scoring to those
+        documents, which are scanned exactly; all others score -1.0.
+        """
+        if query_embedding is None or self.dim == 0:
+            best = np.where(self._has_rows, 0.0, -1.0).astype(np.float32)
+            return best, np.zeros(self.num_docs, dtype=np.int64)
+        if docs is not None:
+            q = normalize_vector(query_embedding)
+            rows = self.rows_for_docs(docs)
+            return self.reduce_rows(rows, matvec(self.vectors[rows], q))
+        if exact or (self.ann is None and self.quantized is None):
+            return self.reduce_best(self.chunk_similarities(query_embedding))
+        q = normalize_vector(query_embedding)
+        rows = None
+        if self.ann is not None:
+            rows = self.ann.candidates(q, nprobe) if nprobe else self.ann.candidates(q)
+        if self.quantized is not None:
+            rows = self.quantized.shortlist(q, rerank, rows=rows) if rerank else self.quantized.shortlist(q, rows=rows)
+        return self.reduce_rows(rows, matvec(self.vectors[rows], q))
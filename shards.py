@@ -0,0 +1,401 @@
+"""
+Sharded knowledge base: partitioned at build time, searched by fan-out.
+
+`build.py --shards N` splits the documents into N shards, by a hash of the
+file name (even sizes) or of the first tag (documents sharing a tag are
+co-located, so tag-filtered searches skip the other shards). Each shard is an
+ordinary store directory, embeddings/shards/<i>/, with its own BM25, IVF and
+quantized artifacts. A shard is rewritten only if its documents or the build
+settings changed (see `fingerprint`): an incremental build rewrites the shards
+whose documents changed and leaves the others, files and generation, as they
+are. shards.json, replaced last, lists the shards; when present it takes
+precedence over a single-store meta.json.
+
+A ShardedSnapshot presents the shards as one knowledge base. Documents are
+numbered shard after shard (global id = shard offset + local id), so the tag
+index, /content and result pages work unchanged. A search runs on every shard
+holding candidates, in parallel on a thread pool (scoring is NumPy, which
+releases the GIL), each shard returns its own top `depth` matches in result
+order, and the lists are combined by a k-way heap merge on the same sort keys.
+BM25 is scored with the statistics of all shards (document frequencies summed
+per query), so rankings are the unsharded ones; only ties and tag-only
+results, which follow document order, come out in shard order. Reciprocal rank
+fusion needs ranks over all shards, so hybrid search fuses per-document
+scores, still computed by every shard in parallel, rather than merging lists.
+"""
+import os
+import json
+import time
+import zlib
+import heapq
+import shutil
+import bisect
+import hashlib
+import logging
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from kb_index import KnowledgeIndex, normalize_tags
+from lexical_index import tokenize
+from search_engine import top_k
+from snapshot import Snapshot
+from vector_store import STORE_DIR, LEGACY_PATH, DEFAULT_MODEL, DOC_FIELDS, VectorStore, load_store, write_store
+
+MANIFEST = 'shards.json'
+SHARDS_DIR = 'shards'
+STRATEGIES = ('hash', 'tag')
+# File times change with every checkout, not with the document
+_UNFINGERPRINTED = ('modified_ts',)
+
+
+def shard_key(record, by='hash'):
+    """Partition key of a document: its file name, or its first tag (untagged documents go by file name)."""
+    if by == 'tag':
+        tags = normalize_tags(record.get('tags'))
+        if tags:
+            return f"tag:{tags[0]}"
+    return record['file']
+
+
+def shard_of(record, num_shards, by='hash'):
+    # crc32 is stable across processes and Python versions, unlike hash()
+    return zlib.crc32(shard_key(record, by).encode('utf-8')) % num_shards
+
+
+def partition(records, num_shards, by='hash'):
+    """Records split into `num_shards` lists, each in file name order."""
+    parts = [[] for _ in range(num_shards)]
+    for record in records:
+        parts[shard_of(record, num_shards, by)].append(record)
+    for part in parts:
+        part.sort(key=lambda r: r['file'])
+    return parts
+
+
+def fingerprint(records, settings):
+    """Digest of everything a shard is built from; an unchanged digest means an unchanged shard.
+
+    Chunk texts and vectors follow from content_hash (the embedded text) and
+    the chunking and model settings, so they are not hashed themselves;
+    neither is the modification time, so a fresh clone rewrites nothing.
+    """
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+    for record in records:
+        fields = {k: record.get(k) for k in DOC_FIELDS if k not in _UNFINGERPRINTED}
+        digest.update(json.dumps(fields, sort_keys=True, default=str).encode('utf-8'))
+        for k in ('content', 'original_content'):
+            digest.update(hashlib.sha256((record.get(k) or '').encode('utf-8')).digest())
+    return digest.hexdigest()
+
+
+def shard_path(path, name):
+    return os.path.join(path, SHARDS_DIR, name)
+
+
+def read_manifest(path=STORE_DIR):
+    try:
+        with open(os.path.join(path, MANIFEST), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(path, manifest):
+    target = os.path.join(path, MANIFEST)
+    with open(f"{target}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{target}.tmp", target)
+
+
+def write_shards(records, path=STORE_DIR, num_shards=4, by='hash', settings=None, extras=None,
+                 keep_previous=True, **store_options):
+    """Write records as `num_shards` shard stores and commit them with shards.json; returns the manifest.
+
+    `extras(records, shard_dir)` gives the write_store extras callback of one
+    shard; `settings` (build options that change the files) go into every
+    fingerprint. Shards whose fingerprint is unchanged are not rewritten, and
+    if none changed the manifest is left alone, so servers do not reload.
+    Shard directories referenced by neither the new nor (unless
+    `keep_previous` is False) the previous manifest are removed.
+    """
+    previous = read_manifest(path) or {}
+    old = {s['name']: s for s in previous.get('shards', [])}
+    shards = []
+    for i, part in enumerate(partition(records, num_shards, by)):
+        name = str(i)
+        digest = fingerprint(part, settings or {})
+        entry = old.get(name)
+        if entry is not None and entry.get('fingerprint') == digest and \
+                os.path.exists(os.path.join(shard_path(path, name), 'meta.json')):
+            shards.append(entry)
+            continue
+        shard_dir = shard_path(path, name)
+        meta = write_store(part, shard_dir, extras=extras(part, shard_dir) if extras else None,
+                           keep_previous=keep_previous, **store_options)
+        shards.append({'name': name, 'generation': meta['generation'], 'num_docs': meta['num_docs'],
+                       'num_chunks': meta['num_chunks'], 'fingerprint': digest})
+        logging.info(f"Wrote shard {name} ({meta['num_docs']} documents, {meta['num_chunks']} chunks)")
+
+    rewritten = sum(1 for s in shards if old.get(s['name']) is not s)
+    if not rewritten and len(shards) == len(old) and previous.get('by') == by:
+        logging.info(f"All {num_shards} shards unchanged; keeping generation {previous.get('generation')}")
+        return previous
+    manifest = {'generation': time.time_ns(), 'by': by, 'num_shards': num_shards, 'shards': shards}
+    _write_manifest(path, manifest)
+    logging.info(f"Committed {num_shards} shards by {by} ({rewritten} rewritten)")
+
+    keep = {s['name'] for s in shards} | (set(old) if keep_previous else set())
+    for name in os.listdir(os.path.join(path, SHARDS_DIR)):
+        if name not in keep:
+            shutil.rmtree(shard_path(path, name), ignore_errors=True)
+    return manifest
+
+
+def remove_shards(path=STORE_DIR, remove_files=False):
+    """Retire a sharded layout after a single-store build (meta.json is used once shards.json is gone)."""
+    try:
+        os.remove(os.path.join(path, MANIFEST))
+    except FileNotFoundError:
+        pass
+    if remove_files:
+        shutil.rmtree(os.path.join(path, SHARDS_DIR), ignore_errors=True)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def fan_out_pool(workers=None):
+    """Process-wide thread pool for shard fan-out, created on first use and again after a fork.
+
+    `workers` only applies when the pool is created (default: one per CPU, at most 32).
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        # Threads do not survive a fork: a preloaded master's pool is useless to its workers
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=workers or min(32, os.cpu_count() or 1),
+                                       thread_name_prefix='shard')
+            _pool_pid = os.getpid()
+        return _pool
+
+
+class ShardedStore:
+    """The shards' stores read as one store, addressed by global document id."""
+
+    def __init__(self, stores, manifest, path=STORE_DIR):
+        self.stores = stores
+        self.path = path
+        self.docs = [doc for store in stores for doc in store.docs]
+        self.generation = manifest['generation']
+        # Shard start ids, plus the total
+        self.offsets = [0]
+        for store in stores:
+            self.offsets.append(self.offsets[-1] + len(store))
+        # Model, dimensions and build settings are the same in every shard, but an
+        # empty shard has no vectors (dim 0) and no index artifacts to report
+        self.primary = next((store for store in stores if store.meta.get('num_chunks')),
+                            next((store for store in stores if len(store)), stores[0] if stores else None))
+        first = self.primary.meta if self.primary is not None else {}
+        self.meta = {**first, 'generation': self.generation, 'num_docs': len(self.docs),
+                     'num_chunks': sum(store.meta.get('num_chunks', 0) for store in stores),
+                     'shards': len(stores), 'shard_by': manifest.get('by')}
+
+    def locate(self, doc_id):
+        """(shard number, local document id) of a global document id."""
+        # Empty shards share their start with the next one; bisect_right skips them
+        shard = bisect.bisect_right(self.offsets, doc_id) - 1
+        return shard, doc_id - self.offsets[shard]
+
+    def __len__(self):
+        return len(self.docs)
+
+    @property
+    def model(self):
+        return self.primary.model if self.primary is not None else DEFAULT_MODEL
+
+    @property
+    def dim(self):
+        return self.meta.get('dim', 0)
+
+    @property
+    def dimensions(self):
+        return self.meta.get('dimensions')
+
+    def artifact_path(self, name):
+        """Path of a non-empty shard's artifact: tells whether the build wrote one at all."""
+        return self.primary.artifact_path(name) if self.primary is not None else None
+
+    def content(self, doc_id):
+        shard, local = self.locate(doc_id)
+        return self.stores[shard].content(local)
+
+    def original_content(self, doc_id):
+        shard, local = self.locate(doc_id)
+        return self.stores[shard].original_content(local)
+
+    def html(self, doc_id):
+        shard, local = self.locate(doc_id)
+        return self.stores[shard].html(local)
+
+    def chunk_text(self, doc_id, chunk_index):
+        shard, local = self.locate(doc_id)
+        return self.stores[shard].chunk_text(local, chunk_index)
+
+    def doc_vectors_for(self, doc_ids):
+        rows = np.zeros((len(doc_ids), self.dim), dtype=np.float32)
+        for row, doc_id in enumerate(doc_ids):
+            shard, local = self.locate(doc_id)
+            rows[row] = self.stores[shard].doc_vectors[local]
+        return rows
+
+    def to_records(self):
+        return [record for store in self.stores for record in store.to_records()]
+
+
+class _FanOutScorer:
+    """`engine` or `lexical` of a ShardedSnapshot: per-shard score() arrays joined in global id order."""
+
+    def __init__(self, snapshot, component, fill):
+        self.snapshot = snapshot
+        self.component = component
+        # What the component reports for documents outside `docs`
+        self.fill = fill
+
+    def score(self, *args, docs=None, **kwargs):
+        parts = self.snapshot.map(
+            lambda shard, local: getattr(shard, self.component).score(*args, docs=local, **kwargs), docs)
+        best = np.full(len(self.snapshot), self.fill, dtype=np.float64)
+        best_chunk = np.zeros(len(self.snapshot), dtype=np.int64)
+        for offset, (shard_best, shard_chunk) in parts:
+            best[offset:offset + len(shard_best)] = shard_best
+            best_chunk[offset:offset + len(shard_chunk)] = shard_chunk
+        return best, best_chunk
+
+
+class _FanOutLexical(_FanOutScorer):
+    """`lexical` of a ShardedSnapshot: BM25 with the statistics of all shards."""
+
+    def score(self, query, docs=None, stats=None):
+        return super().score(query, docs=docs, stats=stats or self.snapshot.lexical_stats(query))
+
+
+class ShardedSnapshot:
+    """A loaded sharded build: the interface of Snapshot over global document ids, plus `map` for fan-out."""
+
+    def __init__(self, shards, manifest, path=STORE_DIR, workers=None):
+        self.shards = shards
+        self.store = ShardedStore([shard.store for shard in shards], manifest, path=path)
+        self.offsets = self.store.offsets
+        self.docs = self.store.docs
+        self.generation = self.store.generation
+        self.workers = workers
+        self.index = KnowledgeIndex(self.docs)
+        self.prerendered = all(shard.prerendered for shard in shards)
+        self.engine = _FanOutScorer(self, 'engine', -1.0)
+        self.lexical = _FanOutLexical(self, 'lexical', 0.0)
+
+    @property
+    def load_seconds(self):
+        totals = {}
+        for shard in self.shards:
+            for name, seconds in shard.load_seconds.items():
+                totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def warm(self):
+        for shard in self.shards:
+            shard.warm()
+        return self
+
+    def loaded(self, name):
+        return all(shard.loaded(name) for shard in self.shards)
+
+    def lexical_stats(self, query):
+        """BM25 collection statistics of all shards for `query` (the `stats` of LexicalIndex.score)."""
+        indexes = [shard.lexical for shard in self.shards]
+        num_units = sum(index.num_units for index in indexes)
+        total_len = sum(index.avg_len * index.num_units for index in indexes)
+        doc_freqs = {term: sum(index.doc_freq(term) for index in indexes) for term in set(tokenize(query))}
+        return num_units, total_len / max(num_units, 1), doc_freqs
+
+    def __len__(self):
+        return len(self.docs)
+
+    def map(self, fn, candidates=None):
+        """[(offset, fn(shard, local_candidates))] for every shard with candidates, run in parallel.
+
+        `candidates` are sorted global ids (None: every document); shards
+        without any are skipped.
+        """
+        jobs = []
+        for shard, start, end in zip(self.shards, self.offsets, self.offsets[1:]):
+            if candidates is None:
+                local = None
+                if start == end:
+                    continue
+            else:
+                lo, hi = np.searchsorted(candidates, [start, end])
+                if lo == hi:
+                    continue
+                local = candidates[lo:hi] - start
+            jobs.append((start, shard, local))
+        if len(jobs) <= 1 or self.workers == 1:
+            return [(start, fn(shard, local)) for start, shard, local in jobs]
+        pool = fan_out_pool(self.workers)
+        futures = [(start, pool.submit(fn, shard, local)) for start, shard, local in jobs]
+        return [(start, future.result()) for start, future in futures]
+
+
+def ranked(keys, depth, **columns):
+    """The first `depth` entries of parallel columns by descending key (ties in position order), with their keys.
+
+    This is the per-shard list merge_ranked expects; pass document ids as `ids`.
+    """
+    keys = np.asarray(keys)
+    order = top_k(keys, depth)
+    return {'keys': keys[order].tolist(),
+            **{name: np.asarray(column)[order].tolist() for name, column in columns.items()}}
+
+
+def merge_ranked(parts, depth):
+    """k-way heap merge of [(offset, ranked list)] into the first `depth` entries, with global ids.
+
+    Every list is ordered by descending key, then ascending id, so the merge
+    is that order over all shards: the same as ranking the union at once.
+    """
+    if not parts:
+        return {'keys': [], 'ids': []}
+    names = [name for name in parts[0][1] if name not in ('keys', 'ids')]
+    streams = [zip([-key for key in part['keys']], [offset + doc_id for doc_id in part['ids']],
+                   *(part[name] for name in names))
+               for offset, part in parts]
+    rows = list(itertools.islice(heapq.merge(*streams), depth))
+    columns = list(zip(*rows)) if rows else [()] * (len(names) + 2)
+    merged = {'keys': [-key for key in columns[0]], 'ids': list(columns[1])}
+    for name, column in zip(names, columns[2:]):
+        merged[name] = list(column)
+    return merged
+
+
+def load_sharded_snapshot(path=STORE_DIR, use_ann=True, use_quant=True, workers=None):
+    """Open the shards listed in shards.json, or return None if there is no manifest."""
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None
+    shards = [Snapshot(VectorStore.open(shard_path(path, entry['name'])), use_ann=use_ann, use_quant=use_quant)
+              for entry in manifest['shards']]
+    return ShardedSnapshot(shards, manifest, path=path, workers=workers)
+
+
+def open_store(path=STORE_DIR, legacy_path=LEGACY_PATH):
+    """The sharded store if shards.json exists, else the single store (see vector_store.load_store)."""
+    manifest = read_manifest(path)
+    if manifest is not None:
+        stores = [VectorStore.open(shard_path(path, entry['name'])) for entry in manifest['shards']]
+        return ShardedStore(stores, manifest, path=path)
+    return load_store(path, legacy_path)
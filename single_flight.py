@@ -0,0 +1,68 @@
+"""
+Request coalescing for concurrent identical work.
+
+Popular queries arrive from many users at once, and the search box fires a
+request on every debounced keystroke. Without coordination each cache miss
+makes its own upstream embedding call. A SingleFlight group runs at most one
+call per key at a time: the first caller (the leader) does the work and every
+caller that arrives while it is running waits for the same result instead.
+
+Waiters give up after a bounded timeout (the leader keeps going, so its result
+still lands in the caches for the next request). Errors are shared too, and
+nothing is remembered once a call finishes; caching stays the caller's job.
+"""
+import threading
+from concurrent.futures import Future, TimeoutError
+
+
+class SingleFlight:
+    """Per-process group of in-flight calls keyed by string, with shared-call counters."""
+
+    def __init__(self, name='calls'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, timeout=None):
+        """Return fn() for `key`, joining a call already in flight for the same key.
+
+        `timeout` bounds how long a waiter blocks on someone else's call; it
+        raises TimeoutError when exceeded. The leader runs fn() on its own
+        thread, so its duration is bounded by fn itself (e.g. a client timeout).
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if leader:
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+            return future.result()
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {'group': self.name, 'leaders': self.leaders, 'shared': self.shared,
+                    'timeouts': self.timeouts, 'in_flight': len(self._calls)}
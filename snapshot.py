@@ -0,0 +1,192 @@
+"""
+Immutable knowledge base snapshots with background hot reload.
+
+A Snapshot bundles everything a request reads (store, scoring engine, BM25
+and tag indexes, generation). Requests grab the current snapshot once and use it
+throughout, so a reload never changes data under an in-flight request.
+
+Only the store metadata and the tag index are loaded up front; they are all
+the index page, /tags without a query and /content need. The scoring engine
+with its IVF index and quantized codes, and the BM25 index, load on first
+use (once, under a lock), so a cold start can serve its first request
+without touching the vectors. `warm()` loads everything; background reloads
+call it before swapping, so requests never wait on a reloaded build.
+
+SnapshotManager notices a new build by stat()ing meta.json, or shards.json for
+a sharded build (replaced last by build.py, so a changed stamp means a complete
+build), loads and indexes it on a background thread and swaps it in with a
+single reference assignment. Each worker checks at most once per interval, only
+one thread per worker reloads, and a random delay spreads the reloads of many
+workers over a few seconds.
+"""
+import os
+import time
+import random
+import logging
+import threading
+from kb_index import KnowledgeIndex
+from rendering import RENDER_VERSION
+from vector_store import STORE_DIR, LEGACY_PATH, VectorStore, load_store
+
+
+class lazy_component:
+    """Snapshot attribute loaded on first access, once per snapshot, and timed."""
+
+    def __init__(self, load):
+        self.load = load
+        self.name = load.__name__
+
+    def __get__(self, snapshot, owner=None):
+        if snapshot is None:
+            return self
+        with snapshot._load_lock:
+            # Loaded values live in the instance dict, which later lookups hit first
+            if self.name not in snapshot.__dict__:
+                t0 = time.perf_counter()
+                snapshot.__dict__[self.name] = self.load(snapshot)
+                snapshot.load_seconds[self.name] = time.perf_counter() - t0
+        return snapshot.__dict__[self.name]
+
+
+class Snapshot:
+    """One loaded build of the knowledge base."""
+
+    def __init__(self, store, use_ann=True, use_quant=True):
+        self.store = store
+        self.docs = store.docs
+        self.generation = store.generation
+        self.use_ann = use_ann
+        self.use_quant = use_quant
+        self.load_seconds = {}
+        self._load_lock = threading.RLock()
+        self.index = KnowledgeIndex(store.docs)
+        # Stored HTML is only trusted if it was rendered with the current rules
+        self.prerendered = store.meta.get('render_version') == RENDER_VERSION
+
+    @lazy_component
+    def ann(self):
+        from ann_index import load_index
+        return load_index(self.store) if self.use_ann else None
+
+    @lazy_component
+    def quantized(self):
+        from quantize import load_codes
+        if not self.use_quant:
+            return None
+        # use_quant is True (any code type) or the code types to search with
+        return load_codes(self.store) if self.use_quant is True else load_codes(self.store, kinds=self.use_quant)
+
+    @lazy_component
+    def engine(self):
+        from search_engine import SearchEngine
+        return SearchEngine.from_store(self.store, ann=self.ann, quantized=self.quantized)
+
+    @lazy_component
+    def lexical(self):
+        from lexical_index import load_index
+        return load_index(self.store)
+
+    def warm(self):
+        """Load every lazy component now."""
+        for name in ('ann', 'quantized', 'engine', 'lexical'):
+            getattr(self, name)
+        return self
+
+    def loaded(self, name):
+        return name in self.__dict__
+
+    def __len__(self):
+        return len(self.docs)
+
+
+def load_snapshot(path=STORE_DIR, legacy_path=LEGACY_PATH, use_ann=True, use_quant=True, shard_workers=None):
+    """The current build: a ShardedSnapshot if build.py wrote shards (see shards.py), else a Snapshot."""
+    from shards import MANIFEST, load_sharded_snapshot
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        return load_sharded_snapshot(path, use_ann=use_ann, use_quant=use_quant, workers=shard_workers)
+    store = load_store(path, legacy_path)
+    if store is None:
+        logging.warning("No embeddings found. Run build.py to generate embeddings.")
+        store = VectorStore.from_records([])
+    return Snapshot(store, use_ann=use_ann, use_quant=use_quant)
+
+
+def build_stamp(path=STORE_DIR, legacy_path=LEGACY_PATH):
+    """Cheap change detector: (file, mtime, size) of shards.json, meta.json or the legacy JSON."""
+    for candidate in (os.path.join(path, 'shards.json'), os.path.join(path, 'meta.json'), legacy_path):
+        try:
+            st = os.stat(candidate)
+            return candidate, st.st_mtime_ns, st.st_size
+        except OSError:
+            continue
+    return None
+
+
+class SnapshotManager:
+    """Serves the current Snapshot and swaps in new builds as they appear.
+
+    `interval` <= 0 disables reload checks; `on_swap` callbacks run after each
+    swap (e.g. to invalidate caches keyed by the old generation).
+    """
+
+    def __init__(self, loader, stamp=build_stamp, interval=5.0, jitter=2.0):
+        self._loader = loader
+        self._stamp = stamp
+        self.interval = interval
+        self.jitter = jitter
+        self.stamp = stamp()
+        self.snapshot = loader()
+        self._callbacks = []
+        self._reloading = threading.Lock()
+        self._next_check = time.monotonic() + interval
+
+    def on_swap(self, callback):
+        self._callbacks.append(callback)
+        return callback
+
+    def current(self):
+        if self.interval > 0 and time.monotonic() >= self._next_check:
+            self._check()
+        return self.snapshot
+
+    def _check(self):
+        # Only one thread per process checks or reloads at a time
+        if not self._reloading.acquire(blocking=False):
+            return
+        self._next_check = time.monotonic() + self.interval
+        try:
+            stamp = self._stamp()
+        except Exception:
+            stamp = self.stamp
+        if stamp == self.stamp:
+            self._reloading.release()
+            return
+        threading.Thread(target=self._reload, args=(stamp,), name='kb-reload', daemon=True).start()
+
+    def _reload(self, stamp):
+        try:
+            # Spread reloads across workers that all noticed the same build
+            time.sleep(random.uniform(0, self.jitter))
+            t0 = time.perf_counter()
+            snapshot = self._loader().warm()
+            old, self.snapshot = self.snapshot, snapshot
+            self.stamp = stamp
+            logging.info(f"Reloaded knowledge base: generation {old.generation} -> {snapshot.generation}, "
+                         f"{len(snapshot)} documents in {time.perf_counter() - t0:.2f}s")
+            for callback in self._callbacks:
+                callback(snapshot)
+        except Exception as e:
+            # Keep serving the old snapshot; the unchanged stamp retries next interval
+            logging.warning(f"Knowledge base reload failed: {e}")
+        finally:
+            self._reloading.release()
+
+    def reload_now(self):
+        """Synchronously load the latest build (used by tests and admin tooling)."""
+        with self._reloading:
+            stamp = self._stamp()
+            self.snapshot = self._loader()
+            self.stamp = stamp
+        for callback in self._callbacks:
+            callback(self.snapshot)
+        return self.snapshot
@@ -9,6 +9,9 @@ class KnowledgeSearch {
         this.closePanel = document.getElementById('closePanel');
         this.searchTimeout = null;
         this.previousActiveElement = null;
+        // In-flight requests, aborted when a newer keystroke supersedes them
+        this.searchController = null;
+        this.tagsController = null;
 
         // Inline tags container below search input (new UX)
         this.inlineTags = document.getElementById('inlineTags');
@@ -102,6 +105,7 @@ class KnowledgeSearch {
         const query = this.searchInput.value.trim();
         
         if (!query) {
+            if (this.searchController) this.searchController.abort();
             this.showWelcome();
             this.status.textContent = '';
             // Update tags to overall top when cleared
@@ -120,18 +124,56 @@ class KnowledgeSearch {
     }
 
     async performSearch(query, append = false) {
+        if (this.searchController) this.searchController.abort();
+        const controller = new AbortController();
+        this.searchController = controller;
         try {
             const tagsParam = [...this.selectedTags].join(',');
-            const url = `/search?q=${encodeURIComponent(query)}&limit=${this.limit}&offset=${this.offset}&sort=${encodeURIComponent(this.sort)}${tagsParam ? `&tags=${encodeURIComponent(tagsParam)}` : ''}`;
-            const response = await fetch(url);
+            const params = `q=${encodeURIComponent(query)}&limit=${this.limit}&offset=${this.offset}&sort=${encodeURIComponent(this.sort)}${tagsParam ? `&tags=${encodeURIComponent(tagsParam)}` : ''}`;
+            if (!append && window.ReadableStream && window.TextDecoder) {
+                // First page: draw keyword matches as soon as they arrive, then the refined ranking
+                await this.streamSearch(`/search/stream?${params}`, query, controller);
+                return;
+            }
+            const response = await fetch(`/search?${params}`, { signal: controller.signal });
             const payload = await response.json();
             this.displayResults(payload.results || [], query, payload.total || 0, append);
         } catch (error) {
+            // Superseded by a newer search: its own request owns the status line
+            if (error.name === 'AbortError') return;
             console.error('Search error:', error);
             this.status.textContent = 'SEARCH ERROR';
         } finally {
-            this.status.textContent = '';
+            if (this.searchController === controller) {
+                this.searchController = null;
+                this.status.textContent = '';
+            }
+        }
+    }
+
+    async streamSearch(url, query, controller) {
+        const response = await fetch(url, { signal: controller.signal });
+        if (!response.body) throw new Error('Streaming not supported');
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        const handle = line => {
+            if (!line.trim()) return;
+            const message = JSON.parse(line);
+            if (message.phase === 'error') throw new Error(message.error || 'search failed');
+            // An empty early phase would flash "no results" before the refined ranking
+            if (message.phase !== 'final' && !(message.results || []).length) return;
+            this.displayResults(message.results || [], query, message.total || 0, false);
+        };
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.forEach(handle);
         }
+        handle(buffer + decoder.decode());
     }
 
     displayResults(results, query, total, append = false) {
@@ -271,8 +313,19 @@ class KnowledgeSearch {
     async updateInlineTags(query) {
         const q = (query || '').trim();
         const url = q ? `/tags?q=${encodeURIComponent(q)}&limit=5` : `/tags?limit=5`;
-        const resp = await fetch(url);
-        const data = await resp.json();
+        if (this.tagsController) this.tagsController.abort();
+        const controller = new AbortController();
+        this.tagsController = controller;
+        let data;
+        try {
+            const resp = await fetch(url, { signal: controller.signal });
+            data = await resp.json();
+        } catch (error) {
+            if (error.name === 'AbortError') return;
+            throw error;
+        } finally {
+            if (this.tagsController === controller) this.tagsController = null;
+        }
         // Normalize to string tags array
         this.allTags = this.normalizeTags(data.map(x => typeof x === 'string' ? x : (x.tag || '')));
         this.renderInlineTags(this.allTags);
@@ -0,0 +1,35 @@
+import os
+
+# The app is imported against the committed embeddings/ store, without
+# background loading or a cache shared with a running server
+os.environ.setdefault('WARM_START', '0')
+os.environ.setdefault('QUERY_CACHE', 'memory')
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+
+import hashlib
+
+import numpy as np
+import pytest
+
+WORDS = 'alpha beta gamma delta epsilon zeta eta theta iota kappa lambda sigma'.split()
+
+
+def make_record(i, vector, text=None, tags=None):
+    # A different length per note, so BM25 scores do not tie
+    text = text or f"Note {i} about {WORDS[i % len(WORDS)]} and {WORDS[(i * 5) % len(WORDS)]}." + ' more' * i
+    vector = [float(x) for x in vector]
+    return {'file': f"note-{i:03d}.md", 'title': f"Note {i}", 'is_url': False, 'source_url': None,
+            'tags': tags if tags is not None else [WORDS[i % 3]], 'content': text, 'original_content': text,
+            'content_hash': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+            'created_ts': 1_700_000_000 + i, 'modified_ts': 1_700_000_000 + i,
+            'chunks': [{'text': text, 'embedding': vector}], 'embedding': vector}
+
+
+@pytest.fixture
+def records():
+    """Build records of `n` notes with random unit vectors."""
+    def build(n=40, dim=16, seed=0):
+        vectors = np.random.default_rng(seed).normal(size=(n, dim))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return [make_record(i, vectors[i]) for i in range(n)]
+    return build
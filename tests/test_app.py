@@ -0,0 +1,167 @@
+import json
+
+import numpy as np
+import pytest
+
+import app as app_module
+from conftest import make_record
+from snapshot import SnapshotManager, build_stamp, load_snapshot
+from vector_store import write_store
+
+
+@pytest.fixture
+def snap():
+    return app_module.snapshots.current()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    def unavailable(query, snap):
+        raise RuntimeError('embedding API unavailable')
+    monkeypatch.setattr(app_module, 'get_query_embedding_cached', unavailable)
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def serve_store(monkeypatch, tmp_path):
+    """Serve records from a fresh store in tmp_path; returns its SnapshotManager."""
+    path = str(tmp_path)
+
+    def serve(records):
+        write_store(records, path)
+        manager = SnapshotManager(lambda: load_snapshot(path=path), stamp=lambda: build_stamp(path, ''), interval=0)
+        monkeypatch.setattr(app_module, 'snapshots', manager)
+        return manager
+    return serve
+
+
+def score(snap, query, mode, query_embedding):
+    return app_module.score_documents(snap, query, mode, query_embedding, None, app_module.SEARCH_NPROBE,
+                                      app_module.SEARCH_RERANK, True)
+
+
+def test_hybrid_keyword_only_hits_rank_below_semantic_cutoff(snap):
+    # A vector orthogonal to every document: no semantic matches at all
+    orthogonal = np.linalg.svd(np.asarray(snap.store.doc_vectors_for(np.arange(len(snap)))))[2][-1]
+    ids, similarity, _, _ = score(snap, 'ai', 'hybrid', orthogonal.astype(np.float32))
+    assert len(ids) and similarity.max() <= app_module.SEMANTIC_CUTOFF
+    lexical_ids, lexical_similarity, _, _ = score(snap, 'ai', 'lexical', None)
+    assert np.array_equal(ids, lexical_ids)
+    assert lexical_similarity.max() == 1.0
+
+
+def test_tags_fall_back_to_counts_without_embedding(client, snap):
+    tags = client.get('/tags?q=ai').get_json()
+    assert tags == [{'tag': t, 'count': n} for t, n in snap.index.top_tags(len(tags))]
+
+
+def test_search_falls_back_to_lexical_without_embedding(client):
+    body = client.get('/search?q=ai').get_json()
+    assert body['results'] and body['mode'] == 'lexical'
+
+
+def test_content_etag_revalidates_until_the_document_changes(serve_store, tmp_path, records):
+    notes = records(n=3)
+    manager = serve_store(notes)
+    client = app_module.app.test_client()
+
+    first = client.get('/content/note-001.md')
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and etag
+    cached = client.get('/content/note-001.md', headers={'If-None-Match': etag})
+    assert cached.status_code == 304 and cached.data == b'' and cached.headers['ETag'] == etag
+
+    # A new generation that rewrites the note invalidates the old validator
+    notes[1] = make_record(1, notes[1]['embedding'], text='Rewritten note about kappa.')
+    write_store(notes, str(tmp_path))
+    generation = manager.current().generation
+    assert manager.reload_now().generation != generation
+    fresh = client.get('/content/note-001.md', headers={'If-None-Match': etag})
+    assert fresh.status_code == 200 and fresh.headers['ETag'] != etag
+    assert 'Rewritten' in fresh.get_json()['content']
+
+
+def test_search_defaults_to_semantic_mode(monkeypatch, snap):
+    vector = np.asarray(snap.store.doc_vectors_for(np.arange(1)))[0]
+    monkeypatch.setattr(app_module, 'get_query_embedding_cached', lambda query, snap: vector)
+    client = app_module.app.test_client()
+    body = client.get('/search?q=ai').get_json()
+    assert body['mode'] == 'semantic' and body['results']
+    assert client.get('/search?q=ai&mode=hybrid').get_json()['mode'] == 'hybrid'
+
+
+def test_pages_share_one_ranking_until_past_rank_depth(monkeypatch, serve_store, records):
+    serve_store(records(n=40))
+    monkeypatch.setattr(app_module, 'SEARCH_RANK_DEPTH', 10)
+    calls = []
+    score_documents = app_module.score_documents
+    monkeypatch.setattr(app_module, 'score_documents', lambda *args, **kwargs: calls.append(1) or
+                        score_documents(*args, **kwargs))
+    client = app_module.app.test_client()
+
+    def page(offset):
+        body = client.get(f"/search?q=note&mode=lexical&limit=5&offset={offset}").get_json()
+        return [r['file'] for r in body['results']], body['total']
+
+    first, total = page(0)
+    assert len(calls) == 1 and total == 40
+    second, _ = page(5)
+    assert len(calls) == 1
+    # Past the ranked depth the ranking is recomputed deeper, consistently with the first pages
+    third, _ = page(10)
+    assert len(calls) == 2
+    assert page(0)[0] == first and page(5)[0] == second and len(calls) == 2
+    assert len(set(first + second + third)) == 15
+
+
+def stream(client, url):
+    return [json.loads(line) for line in client.get(url).get_data(as_text=True).splitlines()]
+
+
+def test_stream_sends_lexical_phase_then_final(monkeypatch, serve_store, records):
+    notes = records(n=12)
+    serve_store(notes)
+    vector = np.asarray(notes[0]['embedding'], dtype=np.float32)
+    monkeypatch.setattr(app_module, 'get_query_embedding_cached', lambda query, snap: vector)
+    client = app_module.app.test_client()
+
+    lexical, final = stream(client, '/search/stream?q=alpha&mode=semantic')
+    assert (lexical['phase'], lexical['mode']) == ('lexical', 'lexical')
+    assert (final['phase'], final['mode']) == ('final', 'semantic')
+    assert lexical['results'] and final['results'][0]['file'] == notes[0]['file']
+    # The final ranking is cached now, so a repeat answers with it alone
+    assert [m['phase'] for m in stream(client, '/search/stream?q=alpha&mode=semantic')] == ['final']
+
+
+def test_stream_degrades_to_lexical_when_embedding_fails(client, serve_store, records):
+    serve_store(records(n=12))
+    lexical, final = stream(client, '/search/stream?q=alpha&mode=semantic')
+    assert lexical['phase'] == 'lexical' and lexical['results']
+    assert final['phase'] == 'final' and final['mode'] == 'lexical'
+    assert [r['file'] for r in final['results']] == [r['file'] for r in lexical['results']]
+    sse = client.get('/search/stream?q=alpha&format=sse').get_data(as_text=True)
+    assert [line for line in sse.splitlines() if line.startswith('event:')] == ['event: lexical', 'event: final']
+
+
+def test_search_sends_server_timing_and_metrics_expose_it(serve_store, records):
+    serve_store(records(n=12))
+    client = app_module.app.test_client()
+    resp = client.get('/search?q=alpha&mode=lexical')
+    assert resp.status_code == 200
+    timings = [part.split(';dur=') for part in resp.headers['Server-Timing'].split(', ')]
+    names = [name for name, _ in timings]
+    assert all(float(dur) >= 0 and name.isidentifier() for name, dur in timings)
+    assert {'score', 'sort', 'serialize'} <= set(names) and names[-1] == 'total'
+
+    client.get('/search?q=alpha&mode=lexical')
+    scrape = client.get('/metrics')
+    body = scrape.get_data(as_text=True)
+    assert 'Server-Timing' not in scrape.headers
+    for family, kind in (('mindsynth_stage_seconds', 'histogram'), ('mindsynth_request_seconds', 'histogram'),
+                         ('mindsynth_cache_requests_total', 'counter'),
+                         ('mindsynth_coalesced_calls_total', 'counter')):
+        assert f"# TYPE {family} {kind}" in body
+    lines = dict(line.rsplit(' ', 1) for line in body.splitlines() if not line.startswith('#'))
+    assert float(lines['mindsynth_stage_seconds_bucket{stage="score",le="+Inf"}']) >= 1
+    assert float(lines['mindsynth_request_seconds_count{endpoint="search"}']) >= 2
+    assert float(lines['mindsynth_cache_requests_total{cache="results",result="hit"}']) >= 1
@@ -0,0 +1,66 @@
+import pytest
+
+import build
+from fake_openai import FakeOpenAI, api_error, fake_embedding
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(build, 'EMBED_BACKOFF_BASE', 0.0)
+    monkeypatch.setattr(build, 'EMBED_MAX_RETRIES', 2)
+
+
+TEXTS = [f"chunk number {i}" for i in range(10)]
+
+
+def expected(texts, dim=8):
+    return [fake_embedding(text, build.EMBEDDING_MODEL, dim) for text in texts]
+
+
+def test_batches_map_vectors_back_to_inputs():
+    client = FakeOpenAI(dim=8)
+    assert build.embed_texts(TEXTS, client=client, max_batch=4) == expected(TEXTS)
+    assert (client.calls, client.inputs) == (3, 10)
+
+
+def test_transient_failures_and_dropped_inputs_are_retried(monkeypatch):
+    monkeypatch.setattr(build, 'EMBED_MAX_RETRIES', 4)
+    client = FakeOpenAI(dim=8, fail_first=1, drop_rate=0.3)
+    assert build.embed_texts(TEXTS, client=client, max_batch=10) == expected(TEXTS)
+
+
+def test_one_rejected_input_does_not_sink_its_batch():
+    client = FakeOpenAI(dim=8, reject={TEXTS[6]})
+    vectors = build.embed_texts(TEXTS, client=client, max_batch=10)
+    assert vectors[6] is None
+    assert [v for i, v in enumerate(vectors) if i != 6] == [v for i, v in enumerate(expected(TEXTS)) if i != 6]
+    # Split down to the bad input, without retrying a 400
+    assert client.calls < 10
+
+
+def test_outage_stops_after_retries_without_splitting():
+    client = FakeOpenAI(dim=8, fail_first=1000)
+    with pytest.raises(build.EmbeddingUnavailable):
+        build.embed_texts(TEXTS, client=client, max_batch=10)
+    assert client.calls == build.EMBED_MAX_RETRIES + 1
+
+
+def test_bad_credentials_fail_at_once():
+    class Unauthorized(FakeOpenAI):
+        def _create(self, model, input, dimensions):
+            self.calls += 1
+            raise api_error('AuthenticationError', 'bad key')
+
+    client = Unauthorized(dim=8)
+    with pytest.raises(build.EmbeddingUnavailable):
+        build.embed_texts(TEXTS, client=client)
+    assert client.calls == 1
+
+
+def test_embedding_stage_stops_the_build():
+    stage = build.EmbeddingStage(FakeOpenAI(dim=8, fail_first=1000), build.StageTimer())
+    stage.start()
+    for doc in range(3):
+        stage.submit(doc, TEXTS)
+    with pytest.raises(build.EmbeddingUnavailable):
+        stage.close()
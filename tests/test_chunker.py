@@ -0,0 +1,25 @@
+from chunker import TokenCounter, chunk_markdown
+
+# The length estimate, so results do not depend on tiktoken being installed
+COUNTER = TokenCounter(encoding=None)
+
+
+def test_heading_counts_against_chunk_limit():
+    heading = '# ' + ' '.join(['heading'] * 15)
+    body = ' '.join(f'Sentence number {i} of the section.' for i in range(200))
+    chunks = chunk_markdown(f"{heading}\n\n{body}\n", max_tokens=100, overlap=10, counter=COUNTER)
+    assert chunks[0].startswith(heading)
+    assert max(COUNTER.count(chunk) for chunk in chunks) <= 100
+
+
+def test_headings_start_chunks_and_edits_stay_local():
+    sections = [f"## Part {i}\n\n" + ' '.join(f'Line {i}.{j} of text.' for j in range(60)) for i in range(4)]
+    before = chunk_markdown('\n\n'.join(sections), max_tokens=80, overlap=8, counter=COUNTER)
+    sections[2] = sections[2].replace('Line 2.30 of text.', 'Line 2.30 of edited text.')
+    after = chunk_markdown('\n\n'.join(sections), max_tokens=80, overlap=8, counter=COUNTER)
+    changed = [c for c in after if c not in before]
+    assert changed and all('Part 2' in c or 'Line 2.' in c for c in changed)
+
+
+def test_counter_name_records_tokenizer():
+    assert COUNTER.name == 'estimate'
@@ -0,0 +1,115 @@
+import numpy as np
+
+import app as app_module
+from conftest import make_record
+from diversity import mark_duplicates, mmr, near_duplicate_pairs
+from shards import load_sharded_snapshot, write_shards
+from snapshot import Snapshot
+from vector_store import VectorStore, write_store
+
+
+def unit(*values, dim=8):
+    vector = np.zeros(dim)
+    vector[:len(values)] = values
+    return vector / np.linalg.norm(vector)
+
+
+def tweet(i, url):
+    # A failed oEmbed: every tweet previews (and embeds) as the same text
+    record = make_record(i, unit(1.0), text='View Tweet')
+    record.update(is_url=True, source_url=url, original_content=url)
+    return record
+
+
+def test_same_preview_of_different_pages_is_not_a_duplicate():
+    records = [tweet(0, 'https://x.com/a/status/1'), tweet(1, 'https://x.com/b/status/2'),
+               tweet(2, 'https://x.com/a/status/1/')]
+    assert mark_duplicates(records) == 1
+    assert [r['duplicate_of'] for r in records] == [None, None, 'note-000.md']
+
+
+def test_similar_vectors_need_matching_text():
+    text = 'Notes on gradient descent, step sizes and how momentum changes convergence in practice.'
+    records = [make_record(0, unit(1.0), text=text), make_record(1, unit(1.0), text=text + ' Edited.'),
+               make_record(2, unit(1.0), text='Something else entirely, written about another topic.')]
+    assert mark_duplicates(records, threshold=0.97) == 1
+    assert [r['duplicate_of'] for r in records] == [None, 'note-000.md', None]
+
+
+def test_duplicates_point_at_a_similar_representative_not_a_chain():
+    # sim(a, b) = sim(b, c) ~ 0.98 but sim(a, c) ~ 0.92: c is not a copy of a
+    angle = np.arccos(0.98)
+    vectors = [unit(1.0, 0.0), unit(np.cos(angle), np.sin(angle)), unit(np.cos(2 * angle), np.sin(2 * angle))]
+    records = [make_record(i, vectors[i], text='the same text in every note') for i in range(3)]
+    mark_duplicates(records, threshold=0.97)
+    assert [r['duplicate_of'] for r in records] == [None, 'note-000.md', None]
+
+
+def test_earliest_copy_is_kept():
+    records = [make_record(i, unit(1.0), text='one note saved twice') for i in range(2)]
+    records[0]['created_ts'] = records[1]['created_ts'] + 10
+    mark_duplicates(records)
+    assert [r['duplicate_of'] for r in records] == ['note-001.md', None]
+
+
+def test_tiled_pairs_match_one_block():
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(50, 8))
+    vectors[30] = vectors[3] + 0.01
+    vectors[44] = vectors[12]
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    pairs = {(i, j) for i, j, _ in near_duplicate_pairs(vectors, 0.97, block=7)}
+    assert pairs == {(i, j) for i, j, _ in near_duplicate_pairs(vectors, 0.97, block=1024)}
+    assert {(3, 30), (12, 44)} <= pairs
+
+
+def test_mmr_skips_redundant_results():
+    relevance = [0.9, 0.89, 0.5]
+    vectors = [unit(1.0), unit(1.0), unit(0.0, 1.0)]
+    assert mmr(relevance, vectors) == [0, 2, 1]
+    assert mmr(relevance, vectors, lambda_=1.0) == [0, 1, 2]
+
+
+def copies(n=3):
+    vectors = [unit(1.0), unit(1.0), unit(0.0, 1.0)]
+    records = [make_record(i, vectors[i], text='a note saved twice' if i < 2 else None) for i in range(n)]
+    mark_duplicates(records)
+    return records
+
+
+def test_dedup_drops_marked_documents(tmp_path):
+    write_store(copies(), str(tmp_path))
+    snap = Snapshot(VectorStore.open(str(tmp_path)), use_ann=False, use_quant=False)
+    args = ('saved', 'lexical', None, None, 8, 64, True)
+    assert list(app_module.score_documents(snap, *args)[0]) == [0, 1]
+    assert list(app_module.score_documents(snap, *args, dedup=True)[0]) == [0]
+
+
+def test_diversify_on_shards_with_an_empty_first_shard(tmp_path):
+    write_shards(copies(), str(tmp_path), num_shards=8)
+    snap = load_sharded_snapshot(str(tmp_path), use_ann=False, use_quant=False)
+    assert len(snap.shards[0]) == 0
+    by_file = {doc['file']: i for i, doc in enumerate(snap.docs)}
+    ids = [by_file[f'note-00{i}.md'] for i in range(3)]
+    ranking = {'ids': ids, 'similarity': [0.9, 0.89, 0.5], 'score': [3.0, 2.0, 1.0], 'chunks': [0, 0, 0]}
+    assert app_module.diversify(snap, ranking)['ids'] == [ids[0], ids[2], ids[1]]
+
+
+def test_sharded_dedup_scales_bm25_like_a_single_store(tmp_path):
+    # The duplicate matches the tag filter but its leader does not
+    records = copies()
+    records[0]['tags'], records[1]['tags'], records[2]['tags'] = ['x'], ['y'], ['y']
+    records[2]['content'] = records[2]['chunks'][0]['text'] = 'saved once ' + 'with more words ' * 4
+    write_store(records, str(tmp_path / 'single'))
+    write_shards(records, str(tmp_path / 'sharded'), num_shards=2)
+    single = Snapshot(VectorStore.open(str(tmp_path / 'single')), use_ann=False, use_quant=False)
+    sharded = load_sharded_snapshot(str(tmp_path / 'sharded'), use_ann=False, use_quant=False)
+
+    def similarities(snap):
+        candidates = snap.index.docs_with_tags(['y'])
+        ranking = app_module.compute_ranking(snap, 'saved', ['y'], 'relevance', 'lexical', 8, 64, True, 10,
+                                             dedup=True)[0]
+        assert len(candidates) == 2 and ranking['total'] == 1
+        return [float(s) for s in ranking['similarity']]
+
+    assert similarities(sharded) == similarities(single) < [1.0]
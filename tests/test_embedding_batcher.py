@@ -0,0 +1,59 @@
+import threading
+
+import openai
+
+from embedding_batcher import EmbeddingBatcher
+from fake_openai import FakeOpenAI, fake_embedding
+
+MODEL = 'text-embedding-3-small'
+
+
+def embed_concurrently(batcher, texts):
+    """embed() each text from its own thread; returns per-text results (vector or exception)."""
+    results = [None] * len(texts)
+
+    def call(i):
+        try:
+            results[i] = batcher.embed(texts[i])
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(texts))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return results
+
+
+def test_concurrent_requests_become_one_upstream_call():
+    client = FakeOpenAI(dim=8)
+    texts = [f"query {i}" for i in range(6)] + ['query 0']
+    # The window only closes early when the batch is full
+    batcher = EmbeddingBatcher(client, window_ms=2000, max_batch=len(texts), timeout=5)
+    results = embed_concurrently(batcher, texts)
+    assert client.calls == 1 and client.inputs == 6
+    assert results == [fake_embedding(t, MODEL, 8) for t in texts]
+    assert batcher.stats()['batches'] == 1 and batcher.stats()['max_batch'] == len(texts)
+    assert batcher.stats()['upstream_inputs'] == 6
+
+
+def test_refused_input_only_fails_its_own_caller():
+    client = FakeOpenAI(dim=8, reject=['bad query'])
+    texts = ['query a', 'bad query', 'query b', 'query c']
+    batcher = EmbeddingBatcher(client, window_ms=2000, max_batch=len(texts), timeout=5)
+    results = embed_concurrently(batcher, texts)
+    assert isinstance(results[1], openai.BadRequestError)
+    for i in (0, 2, 3):
+        assert results[i] == fake_embedding(texts[i], MODEL, 8)
+    assert batcher.stats()['errors'] == 1
+    # Every input sent upstream is counted, including the split retries
+    assert batcher.stats()['upstream_inputs'] == client.inputs
+
+
+def test_upstream_failure_fails_every_caller_in_the_batch():
+    client = FakeOpenAI(dim=8, fail_first=1)
+    batcher = EmbeddingBatcher(client, window_ms=2000, max_batch=3, timeout=5)
+    results = embed_concurrently(batcher, ['x', 'y', 'z'])
+    assert client.calls == 1 and all(isinstance(r, RuntimeError) for r in results)
+    assert batcher.stats()['upstream_inputs'] == 3
@@ -0,0 +1,44 @@
+import numpy as np
+
+from lexical_index import LexicalIndex, Vocabulary
+
+
+def build(texts):
+    return LexicalIndex.build(((i, 0, text) for i, text in enumerate(texts)), len(texts))
+
+
+def test_vocabulary_lookup_is_exact():
+    vocab = Vocabulary.from_terms(sorted(['alpha', 'beta', 'café', 'zeta']))
+    assert [vocab.index(t) for t in ('alpha', 'café', 'zeta')] == [0, 2, 3]
+    assert vocab.index('alp') is None
+    assert vocab.index('omega') is None
+    assert vocab.index('zz') is None
+
+
+def test_long_token_does_not_pad_vocabulary(tmp_path):
+    blob = 'x' * 5000
+    index = build(['short words here', f'another note {blob}'])
+    assert index.terms.blob.nbytes < 5100
+    path = str(tmp_path / 'lexical.npz')
+    index.save(path)
+    loaded = LexicalIndex.load(path)
+    assert loaded.doc_freq(blob) == 1
+    assert loaded.doc_freq('words') == 1
+
+
+def test_loads_string_array_vocabulary(tmp_path):
+    index = build(['apples and pears', 'pears only', 'plums'])
+    path = str(tmp_path / 'lexical.npz')
+    terms = np.array([index.terms[i].decode() for i in range(len(index.terms))])
+    np.savez(path, terms=terms, offsets=index.offsets, postings=index.postings, freqs=index.freqs,
+             unit_doc=index.unit_doc, unit_chunk=index.unit_chunk, unit_len=index.unit_len,
+             num_docs=np.int64(3), generation=np.int64(0))
+    loaded = LexicalIndex.load(path)
+    assert np.array_equal(loaded.score('pears')[0], index.score('pears')[0])
+
+
+def test_best_unit_per_document():
+    index = build(['rust and go', 'go go go', 'python'])
+    best, _ = index.score('go')
+    assert best[1] > best[0] > 0
+    assert best[2] == 0
@@ -0,0 +1,61 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from quantize import FAST_KINDS, KINDS, QuantizedIndex, built_kinds, load_codes, write_codes
+
+
+def unit_rows(n, dim, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_shortlist_contains_exact_best(kind):
+    vectors = unit_rows(2000, 64)
+    index = QuantizedIndex.build(vectors, kind=kind, prefix_dim=32)
+    query = vectors[7]
+    assert 7 in index.shortlist(query, k=50)
+
+
+def store_with_codes(tmp_path, kinds, generation=3):
+    meta = {'generation': generation, 'dim': 8}
+    for kind in kinds:
+        write_codes(str(tmp_path), meta, unit_rows(10, 8), kind=kind, prefix_dim=4)
+    files = meta['files']
+    return SimpleNamespace(generation=generation, meta=meta,
+                           artifact_path=lambda name: os.path.join(tmp_path, files[name]) if name in files else None)
+
+
+def test_int8_codes_are_opt_in(tmp_path):
+    store = store_with_codes(tmp_path, ['int8'])
+    assert load_codes(store, kinds=FAST_KINDS) is None
+    assert load_codes(store).kind == 'int8'
+
+
+def test_several_kinds_are_searched_in_preference_order(tmp_path):
+    store = store_with_codes(tmp_path, ['binary', 'prefix'])
+    assert built_kinds(store) == ['binary', 'prefix']
+    assert store.meta['quantize'] == {'binary': {'dim': 8}, 'prefix': {'dim': 4}}
+    assert load_codes(store, kinds=('prefix', 'binary')).kind == 'prefix'
+    assert load_codes(store, kinds=('int8', 'binary')).kind == 'binary'
+    assert load_codes(store, kinds=('int8',)) is None
+
+
+def test_single_kind_builds_from_before_per_kind_files_still_load(tmp_path):
+    path = os.path.join(tmp_path, 'quant-3.npz')
+    QuantizedIndex.build(unit_rows(10, 8), kind='binary', generation=3).save(path)
+    meta = {'files': {'quant': 'quant-3.npz'}, 'quantize': {'kind': 'binary', 'dim': 8}}
+    store = SimpleNamespace(generation=3, meta=meta, artifact_path=lambda name: path if name == 'quant' else None)
+    assert built_kinds(store) == ['binary'] and load_codes(store).kind == 'binary'
+
+
+def test_binary_scores_without_numpy_bitwise_count(monkeypatch):
+    import quantize
+    vectors = unit_rows(100, 64)
+    index = QuantizedIndex.build(vectors, kind='binary')
+    expected = index.approx_scores(vectors[3])
+    monkeypatch.setattr(quantize, '_bitwise_count', quantize._POPCOUNT.__getitem__)
+    assert np.array_equal(index.approx_scores(vectors[3]), expected)
@@ -0,0 +1,67 @@
+import os
+import threading
+
+from query_cache import MemoryBackend, QueryCache, SQLiteBackend, encode_vector, decode_vector
+
+
+def test_sqlite_round_trip_and_expiry(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite'))
+    backend.set('live', b'value', ttl=60)
+    backend.set('stale', b'old', ttl=-1)
+    assert backend.get('live') == b'value'
+    assert backend.get('stale') is None
+    assert backend.get('missing') is None
+    assert backend.info()['entries'] == 2
+
+
+def test_sqlite_hits_only_touch_stale_entries(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite'))
+    backend.set('key', b'value', ttl=60)
+    statements = []
+    backend._conn().set_trace_callback(statements.append)
+    for _ in range(10):
+        assert backend.get('key') == b'value'
+    assert not [s for s in statements if s.startswith('UPDATE')]
+
+    backend._conn().execute("UPDATE cache SET last_used = last_used - ?", (backend.TOUCH_INTERVAL + 1,))
+    statements.clear()
+    backend.get('key')
+    backend.get('key')
+    assert len([s for s in statements if s.startswith('UPDATE')]) == 1
+
+
+def test_sqlite_prune_evicts_least_recently_used(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite'), max_mb=1)
+    db = backend._conn()
+    for i in range(3):
+        backend.set(f'k{i}', b'x' * 400_000, ttl=60)
+        db.execute("UPDATE cache SET last_used = ? WHERE key = ?", (i, f'k{i}'))
+    backend._prune(db, now=0)
+    assert backend.get('k0') is None
+    assert backend.get('k2') is not None
+
+
+def test_query_cache_counts_across_threads():
+    cache = QueryCache(MemoryBackend(), 'test', ttl=60, encode=encode_vector, decode=decode_vector)
+    key = cache.key('model', 'query')
+    cache.set(key, [1.0, 2.0])
+
+    def lookup():
+        for _ in range(500):
+            cache.get(key)
+            cache.get('missing')
+
+    threads = [threading.Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (cache.hits, cache.misses) == (4000, 4000)
+    assert list(cache.get(key)) == [1.0, 2.0]
+
+
+def test_sqlite_file_is_owner_only(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache' / 'cache.sqlite'))
+    backend.set('k', b'v', ttl=60)
+    assert os.stat(backend.path).st_mode & 0o777 == 0o600
+    assert os.stat(tmp_path / 'cache').st_mode & 0o777 == 0o700
@@ -0,0 +1,61 @@
+import numpy as np
+
+import app as app_module
+from shards import load_sharded_snapshot, read_manifest, write_shards
+from snapshot import Snapshot
+from vector_store import VectorStore, write_store
+
+
+def load_both(tmp_path, records, num_shards=4):
+    write_store(records, str(tmp_path / 'single'))
+    write_shards(records, str(tmp_path / 'sharded'), num_shards=num_shards)
+    single = Snapshot(VectorStore.open(str(tmp_path / 'single')), use_ann=False, use_quant=False)
+    sharded = load_sharded_snapshot(str(tmp_path / 'sharded'), use_ann=False, use_quant=False, workers=2)
+    return single, sharded
+
+
+def ranking_files(snap, mode, query, query_embedding, depth=10):
+    if hasattr(snap, 'shards'):
+        ranking = app_module.rank_sharded(snap, query, mode, query_embedding, None, 'relevance', depth,
+                                          app_module.SEARCH_NPROBE, app_module.SEARCH_RERANK, True)
+    else:
+        matches = app_module.score_documents(snap, query, mode, query_embedding, None, app_module.SEARCH_NPROBE,
+                                             app_module.SEARCH_RERANK, True)
+        ranking = app_module.rank_documents(snap, *matches, 'relevance', depth)
+    return [snap.docs[i]['file'] for i in ranking['ids']], ranking['total']
+
+
+def test_sharded_ranking_matches_single_store(tmp_path, records):
+    recs = records()
+    single, sharded = load_both(tmp_path, recs)
+    assert len(sharded.shards) == 4 and len(sharded) == len(single)
+    query = np.asarray(recs[5]['embedding'], dtype=np.float32)
+    for mode in ('semantic', 'lexical', 'hybrid'):
+        embedding = None if mode == 'lexical' else query
+        assert ranking_files(sharded, mode, 'gamma', embedding) == ranking_files(single, mode, 'gamma', embedding)
+
+
+def test_empty_shards_do_not_hide_dimensions(tmp_path, records):
+    recs = records(n=3)
+    _, sharded = load_both(tmp_path, recs, num_shards=8)
+    assert any(len(shard) == 0 for shard in sharded.shards)
+    assert sharded.store.dim == 16
+    vectors = sharded.store.doc_vectors_for(range(len(sharded)))
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+
+
+def test_rebuild_rewrites_only_changed_shards(tmp_path, records):
+    recs = records()
+    path = str(tmp_path / 'kb')
+    first = write_shards(recs, path, num_shards=4)
+    # A fresh checkout: every file time changes, no content does
+    for record in recs:
+        record['modified_ts'] += 3600
+    assert write_shards(recs, path, num_shards=4)['generation'] == first['generation']
+
+    recs[0]['content_hash'] = 'edited'
+    second = write_shards(recs, path, num_shards=4)
+    changed = [new['name'] for old, new in zip(first['shards'], second['shards'])
+               if old['generation'] != new['generation']]
+    assert len(changed) == 1
+    assert read_manifest(path) == second
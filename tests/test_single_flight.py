@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+THREADS = 8
+
+
+def run_concurrently(group, fn):
+    """Call group.do('key', fn) from THREADS threads; fn is held until all have joined."""
+    release = threading.Event()
+    results, errors = [], []
+
+    def held():
+        release.wait(5)
+        return fn()
+
+    def call():
+        try:
+            results.append(group.do('key', held, timeout=5))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + 5
+    while group.stats()['shared'] < THREADS - 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join(5)
+    return results, errors
+
+
+def test_concurrent_callers_share_one_leader_call():
+    group = SingleFlight()
+    calls = []
+    results, errors = run_concurrently(group, lambda: calls.append(1) or 'value')
+    assert calls == [1] and results == ['value'] * THREADS and not errors
+    assert group.stats() == {'group': 'calls', 'leaders': 1, 'shared': THREADS - 1, 'timeouts': 0, 'in_flight': 0}
+
+
+def test_leader_error_reaches_waiters_and_clears_the_key():
+    group = SingleFlight()
+
+    def fail():
+        raise ValueError('upstream failed')
+
+    results, errors = run_concurrently(group, fail)
+    assert not results and len(errors) == THREADS and all(isinstance(e, ValueError) for e in errors)
+    assert group.in_flight() == 0
+    # Nothing is remembered: the next call runs again
+    assert group.do('key', lambda: 'retried') == 'retried'
+    assert group.leaders == 2
+
+
+def test_waiter_times_out_while_leader_continues():
+    group = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=group.do, args=('key', lambda: release.wait(5)))
+    leader.start()
+    while not group.in_flight():
+        time.sleep(0.001)
+    with pytest.raises(TimeoutError):
+        group.do('key', lambda: None, timeout=0.01)
+    release.set()
+    leader.join(5)
+    assert group.timeouts == 1 and group.in_flight() == 0
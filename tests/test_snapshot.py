@@ -0,0 +1,56 @@
+import pytest
+
+from snapshot import SnapshotManager, build_stamp, load_snapshot
+from vector_store import write_store
+
+
+def manager_for(path, loader=None, **kwargs):
+    return SnapshotManager(loader or (lambda: load_snapshot(path=path)), stamp=lambda: build_stamp(path, ''),
+                           **kwargs)
+
+
+def test_reload_swaps_generation_and_runs_callbacks(tmp_path, records):
+    path = str(tmp_path)
+    write_store(records(n=3), path)
+    manager = manager_for(path, interval=0)
+    first = manager.current()
+    swapped = []
+    manager.on_swap(swapped.append)
+
+    write_store(records(n=5), path)
+    assert manager.current() is first
+    latest = manager.reload_now()
+    assert latest.generation != first.generation and len(latest) == 5
+    assert manager.current() is latest
+    assert swapped == [latest]
+
+
+def test_background_reload_failure_keeps_serving_old_snapshot(tmp_path, records):
+    path = str(tmp_path)
+    write_store(records(n=3), path)
+    loads = {'fail': False}
+
+    def loader():
+        if loads['fail']:
+            raise OSError('half-written build')
+        return load_snapshot(path=path)
+
+    manager = manager_for(path, loader=loader, interval=0, jitter=0)
+    old, old_stamp = manager.current(), manager.stamp
+    swapped = []
+    manager.on_swap(swapped.append)
+
+    write_store(records(n=5), path)
+    loads['fail'] = True
+    manager._reloading.acquire()
+    manager._reload(build_stamp(path, ''))
+    assert manager.current() is old and manager.stamp == old_stamp and not swapped
+    with pytest.raises(OSError):
+        manager.reload_now()
+    assert manager.current() is old and not swapped
+
+    # The unchanged stamp makes the next check try again
+    loads['fail'] = False
+    manager._reloading.acquire()
+    manager._reload(build_stamp(path, ''))
+    assert len(manager.current()) == 5 and len(swapped) == 1
@@ -0,0 +1,30 @@
+import numpy as np
+
+from search_engine import SearchEngine
+from vector_store import VectorStore, write_store
+
+
+def test_float16_store_stays_memory_mapped(tmp_path, records):
+    recs = records(n=30)
+    write_store(recs, str(tmp_path / 'f32'))
+    write_store(recs, str(tmp_path / 'f16'), dtype='float16')
+    full, half = VectorStore.open(str(tmp_path / 'f32')), VectorStore.open(str(tmp_path / 'f16'))
+    assert half.chunk_vectors.dtype == np.float16
+    assert isinstance(half.chunk_vectors, np.memmap)
+
+    query = np.asarray(recs[4]['embedding'], dtype=np.float32)
+    for kwargs in ({}, {'docs': np.array([1, 4, 9])}):
+        expected, _ = SearchEngine.from_store(full).score(query, **kwargs)
+        got, _ = SearchEngine.from_store(half).score(query, **kwargs)
+        assert got.dtype == np.float32
+        assert np.allclose(got, expected, atol=1e-3)
+    assert half.doc_vectors_for([4]).dtype == np.float32
+
+
+def test_store_round_trip(tmp_path, records):
+    recs = records(n=5)
+    write_store(recs, str(tmp_path))
+    store = VectorStore.open(str(tmp_path))
+    assert [doc['file'] for doc in store.docs] == [r['file'] for r in recs]
+    assert store.content(2) == recs[2]['content']
+    assert store.chunk_text(3, 0) == recs[3]['chunks'][0]['text']
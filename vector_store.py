@@ -0,0 +1,373 @@
+"""
+Compact, memory-mappable on-disk format for the knowledge base.
+
+A build writes a directory (``embeddings/`` by default) containing:
+
+- ``chunks-<gen>.npy``  (n_chunks, dim) L2-normalized chunk vectors, float32 or float16
+- ``docs-<gen>.npy``    (n_docs, dim) L2-normalized document vectors
+- ``text-<gen>.bin``    UTF-8 chunk/document text and pre-rendered HTML, addressed
+                        by [offset, length] spans
+- ``meta.json``         titles, tags, timestamps, hashes, chunk offsets and the
+                        file names of the current generation
+
+The vector files are opened with ``np.load(mmap_mode='r')`` so gunicorn workers
+share them through the page cache (float16 files too: they are converted per
+block while scoring, see search_engine.matvec), and text is only decoded when a
+snippet or document is actually served. Index artifacts saved as .npz are
+mapped the same way by `load_npz`. ``embeddings.json`` is still readable as a
+legacy fallback.
+
+Usage: python vector_store.py [embeddings.json] [embeddings/]   (convert legacy JSON)
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import logging
+import zipfile
+import numpy as np
+from search_engine import normalize_rows
+
+STORE_DIR = 'embeddings'
+LEGACY_PATH = 'embeddings.json'
+FORMAT_VERSION = 1
+DEFAULT_MODEL = 'text-embedding-3-small'
+
+# Document fields copied verbatim into meta.json
+DOC_FIELDS = ('file', 'title', 'is_url', 'source_url', 'tags', 'content_hash', 'created_ts', 'modified_ts',
+              'duplicate_of')
+
+
+def _atomic_write_bytes(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _atomic_save_npy(path, array):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+class _TextBlob:
+    """Append-only UTF-8 buffer that hands out [offset, length] spans."""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def add(self, text):
+        data = (text or '').encode('utf-8')
+        span = [self.size, len(data)]
+        self.parts.append(data)
+        self.size += len(data)
+        return span
+
+    def getvalue(self):
+        return b''.join(self.parts)
+
+
+def _vector(value):
+    # Records may carry lists (embeddings.json) or arrays (generated in memory)
+    return [] if value is None else value
+
+
+def _pack(records, model=DEFAULT_MODEL):
+    """Split legacy records into (meta, chunk_vectors, doc_vectors, text_bytes)."""
+    blob = _TextBlob()
+    docs = []
+    chunk_spans = []
+    chunk_rows = []
+    doc_rows = []
+    for item in records:
+        chunks = item.get('chunks') or []
+        doc = {k: item.get(k) for k in DOC_FIELDS}
+        doc['tags'] = doc['tags'] or []
+        doc['chunk_start'] = len(chunk_spans)
+        doc['chunk_count'] = len(chunks)
+        doc['has_embedding'] = 'embedding' in item
+        content = item.get('content', '')
+        doc['content'] = blob.add(content)
+        original = item.get('original_content', content)
+        doc['original_content'] = doc['content'] if original == content else blob.add(original)
+        if item.get('html') is not None:
+            doc['html'] = blob.add(item['html'])
+        for ch in chunks:
+            chunk_spans.append(blob.add(ch.get('text', '')))
+            chunk_rows.append(_vector(ch.get('embedding')))
+        doc_rows.append(_vector(item.get('embedding')))
+        docs.append(doc)
+
+    dim = next((len(v) for v in chunk_rows + doc_rows if len(v)), 0)
+
+    def to_matrix(rows):
+        matrix = np.zeros((len(rows), dim), dtype=np.float32)
+        for i, v in enumerate(rows):
+            if len(v):
+                matrix[i] = v
+        return normalize_rows(matrix)
+
+    meta = {
+        'format': FORMAT_VERSION,
+        'model': model,
+        'dim': dim,
+        'normalized': True,
+        'num_docs': len(docs),
+        'num_chunks': len(chunk_spans),
+        'docs': docs,
+        'chunk_text': chunk_spans,
+    }
+    return meta, to_matrix(chunk_rows), to_matrix(doc_rows), blob.getvalue()
+
+
+def embedding_model_id(model, dimensions=None):
+    """Model name qualified by the requested vector size, for cache keys that must not mix sizes."""
+    return f"{model}@{dimensions}" if dimensions else model
+
+
+# Archive members smaller than this are simply read
+_MMAP_MIN_BYTES = 1 << 16
+
+
+def load_npz(path):
+    """Arrays of an .npz written by np.savez, memory-mapped in place where possible.
+
+    np.load ignores mmap_mode for archives, so every process would hold its own
+    copy of an index. np.savez stores members uncompressed, so a member's data
+    can be mapped straight from the file and shared through the page cache by
+    all workers, across reloads too. Small, compressed or object members are read.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if info.compress_type != zipfile.ZIP_STORED or info.file_size < _MMAP_MIN_BYTES:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+            # Local file header: 30 fixed bytes, then the file name and extra field
+            f.seek(info.header_offset)
+            name_len, extra_len = struct.unpack('<HH', f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else \
+                np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            if dtype.hasobject:
+                raise ValueError(f"{path}: object array {name} cannot be loaded without pickle")
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                     order='F' if fortran_order else 'C')
+    return arrays
+
+
+def artifact_name(stem, generation, ext):
+    """Generation-stamped file name, e.g. chunks-1712345678.npy."""
+    return f"{stem}-{generation}.{ext}"
+
+
+def _generation_of(name):
+    stem = name.rsplit('.', 1)[0]
+    if '-' not in stem:
+        return None
+    suffix = stem.rsplit('-', 1)[1]
+    return int(suffix) if suffix.isdigit() else None
+
+
+def _remove_old_generations(path, keep):
+    """Delete generation-stamped artifacts not in `keep` (open memmaps stay valid)."""
+    for name in os.listdir(path):
+        generation = _generation_of(name)
+        if generation is not None and generation not in keep:
+            try:
+                os.remove(os.path.join(path, name))
+            except OSError as e:
+                logging.warning(f"Could not remove old artifact {name}: {e}")
+
+
+def remove_store(path=STORE_DIR):
+    """Delete a store's meta.json and data files (open memmaps stay valid)."""
+    try:
+        os.remove(os.path.join(path, 'meta.json'))
+    except FileNotFoundError:
+        pass
+    _remove_old_generations(path, keep=set())
+
+
+def write_meta(path, meta):
+    """Atomically replace meta.json; readers switch generations when this lands."""
+    _atomic_write_bytes(os.path.join(path, 'meta.json'),
+                        json.dumps(meta, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def write_store(records, path=STORE_DIR, dtype='float32', model=DEFAULT_MODEL, extras=None, keep_previous=True):
+    """Write records (embeddings.json schema) as a binary store.
+
+    Every data file carries the build generation in its name and meta.json,
+    which lists them under `files`, is replaced last, so a reader that opens
+    meta.json always finds a complete, consistent set of files. `extras`, if
+    given, is called as extras(meta, chunk_vectors, doc_vectors) before the
+    commit to write additional artifacts (registering them in meta['files']).
+    Files from older generations are then removed; the previous one is kept
+    for readers still opening it unless `keep_previous` is False.
+    """
+    os.makedirs(path, exist_ok=True)
+    meta, chunk_vectors, doc_vectors, text = _pack(records, model=model)
+    generation = time.time_ns()
+    meta['dtype'] = np.dtype(dtype).name
+    meta['generation'] = generation
+    meta['files'] = {
+        'chunks': artifact_name('chunks', generation, 'npy'),
+        'docs': artifact_name('docs', generation, 'npy'),
+        'text': artifact_name('text', generation, 'bin'),
+    }
+    _atomic_save_npy(os.path.join(path, meta['files']['chunks']), chunk_vectors.astype(dtype))
+    _atomic_save_npy(os.path.join(path, meta['files']['docs']), doc_vectors.astype(dtype))
+    _atomic_write_bytes(os.path.join(path, meta['files']['text']), text)
+    if extras is not None:
+        extras(meta, chunk_vectors, doc_vectors)
+
+    previous = None
+    try:
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            previous = json.load(f).get('generation')
+    except (OSError, ValueError):
+        pass
+    write_meta(path, meta)
+    _remove_old_generations(path, keep={generation, previous} if keep_previous else {generation})
+    return meta
+
+
+class VectorStore:
+    """Read-only view over a knowledge base: metadata in memory, vectors and text on demand."""
+
+    def __init__(self, meta, chunk_vectors, doc_vectors, text, path=None):
+        self.meta = meta
+        self.path = path
+        self.docs = meta['docs']
+        self.generation = meta.get('generation', 0)
+        self.chunk_vectors = self._as_unit_rows(chunk_vectors, meta)
+        self.doc_vectors = self._as_unit_rows(doc_vectors, meta)
+        self._chunk_text = meta['chunk_text']
+        self._text = text
+        self.chunk_offsets = np.zeros(len(self.docs) + 1, dtype=np.int64)
+        np.cumsum([d['chunk_count'] for d in self.docs], out=self.chunk_offsets[1:])
+
+    @staticmethod
+    def _as_unit_rows(vectors, meta):
+        # float32 and float16 memmaps are used in place, shared by every worker;
+        # unnormalized (legacy) data is normalized into a float32 copy
+        if vectors.dtype in (np.float32, np.float16) and meta.get('normalized'):
+            return vectors
+        return normalize_rows(vectors)
+
+    @classmethod
+    def open(cls, path=STORE_DIR):
+        """Open a store directory written by build.py."""
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        # Stores written before generation-stamped files used fixed names
+        files = {'chunks': 'chunks.npy', 'docs': 'docs.npy', 'text': 'text.bin', **(meta.get('files') or {})}
+        chunk_vectors = np.load(os.path.join(path, files['chunks']), mmap_mode='r')
+        doc_vectors = np.load(os.path.join(path, files['docs']), mmap_mode='r')
+        text_path = os.path.join(path, files['text'])
+        if os.path.getsize(text_path):
+            with open(text_path, 'rb') as f:
+                text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            text = b''
+        return cls(meta, chunk_vectors, doc_vectors, text, path=path)
+
+    def artifact_path(self, name):
+        """Path of an extra artifact registered in meta['files'], or None."""
+        filename = (self.meta.get('files') or {}).get(name)
+        if not filename or self.path is None:
+            return None
+        return os.path.join(self.path, filename)
+
+    @classmethod
+    def from_records(cls, records, model=DEFAULT_MODEL):
+        """Build an in-memory store from the legacy embeddings.json list."""
+        meta, chunk_vectors, doc_vectors, text = _pack(records, model=model)
+        return cls(meta, chunk_vectors, doc_vectors, text)
+
+    def __len__(self):
+        return len(self.docs)
+
+    @property
+    def model(self):
+        return self.meta.get('model', DEFAULT_MODEL)
+
+    @property
+    def dim(self):
+        return self.meta.get('dim', 0)
+
+    @property
+    def dimensions(self):
+        """Shortened embedding size requested at build time (None: the model's native size)."""
+        return self.meta.get('dimensions')
+
+    def _read(self, span):
+        offset, length = span
+        return bytes(self._text[offset:offset + length]).decode('utf-8')
+
+    def content(self, doc_id):
+        return self._read(self.docs[doc_id]['content'])
+
+    def original_content(self, doc_id):
+        return self._read(self.docs[doc_id]['original_content'])
+
+    def html(self, doc_id):
+        """Pre-rendered HTML for a document, or None if the build did not store any."""
+        span = self.docs[doc_id].get('html')
+        return self._read(span) if span else None
+
+    def chunk_text(self, doc_id, chunk_index):
+        """Text of a document's chunk, by document-local index."""
+        return self._read(self._chunk_text[self.docs[doc_id]['chunk_start'] + chunk_index])
+
+    def doc_vectors_for(self, doc_ids):
+        """Unit document vectors of `doc_ids`, one row each (zeros for documents without one)."""
+        return np.asarray(self.doc_vectors[np.asarray(doc_ids, dtype=np.int64)], dtype=np.float32)
+
+    def to_records(self):
+        """Materialize the legacy list-of-dicts schema (used by incremental builds)."""
+        records = []
+        for doc_id, doc in enumerate(self.docs):
+            item = {k: doc.get(k) for k in DOC_FIELDS}
+            item['content'] = self.content(doc_id)
+            item['original_content'] = self.original_content(doc_id)
+            if doc.get('html'):
+                item['html'] = self.html(doc_id)
+            start, end = self.chunk_offsets[doc_id], self.chunk_offsets[doc_id + 1]
+            item['chunks'] = [
+                {'text': self.chunk_text(doc_id, i), 'embedding': self.chunk_vectors[row].tolist()}
+                for i, row in enumerate(range(start, end))
+            ]
+            if doc.get('has_embedding'):
+                item['embedding'] = self.doc_vectors[doc_id].tolist()
+            records.append(item)
+        return records
+
+
+def load_store(path=STORE_DIR, legacy_path=LEGACY_PATH):
+    """Open the binary store, falling back to legacy embeddings.json. Returns None if neither exists."""
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return VectorStore.open(path)
+    if legacy_path and os.path.exists(legacy_path):
+        with open(legacy_path, 'r', encoding='utf-8') as f:
+            return VectorStore.from_records(json.load(f))
+    return None
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    src = sys.argv[1] if len(sys.argv) > 1 else LEGACY_PATH
+    dst = sys.argv[2] if len(sys.argv) > 2 else STORE_DIR
+    with open(src, 'r', encoding='utf-8') as f:
+        meta = write_store(json.load(f), dst, keep_previous=False)
+    logging.info(f"Wrote {dst}/ ({meta['num_docs']} documents, {meta['num_chunks']} chunks)")
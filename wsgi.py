@@ -0,0 +1,34 @@
+"""
+WSGI entry point for production servers: ``gunicorn wsgi:application``.
+
+With gunicorn's preload_app (gunicorn.conf.py) this module is imported once,
+in the master, before any worker is forked:
+
+- the current snapshot is warmed here, so every worker starts with the search
+  indexes loaded. Vectors and index arrays are memory-mapped files, shared
+  through the page cache by all workers and across reloads; what remains in
+  process memory (metadata, tag index) is shared copy-on-write;
+- gc.freeze() moves everything loaded so far out of the cyclic collector's
+  reach, so collections in the workers do not write to (and so copy) those pages;
+- openai is imported but no client is created: a client's connection pool
+  must not cross a fork, and each worker creates its own on first use.
+
+The background warm-up thread of app.py is disabled: threads do not survive a fork.
+"""
+import os
+import gc
+import time
+import logging
+
+os.environ.setdefault('WARM_START', '0')
+
+from app import app, snapshots  # noqa: E402
+
+application = app
+
+_t0 = time.perf_counter()
+_snapshot = snapshots.current().warm()
+import openai  # noqa: E402,F401
+gc.freeze()
+logging.info(f"Preloaded generation {_snapshot.generation} ({len(_snapshot)} documents) "
+             f"in {time.perf_counter() - _t0:.2f}s")